@@ -1,8 +1,10 @@
 const express = require('express');
 const router = express.Router();
-const { spawn } = require('child_process');
-const path = require('path');
-const { getRegisteredFaces } = require('../services/db');
+const { getRegisteredFacesPage } = require('../services/db');
+const faceWorker = require('../services/faceWorker');
+
+// Rows fetched per query when streaming the whole registered faces listing
+const FACES_STREAM_PAGE_SIZE = parseInt(process.env.FACES_STREAM_CHUNK || '500', 10);
 
 // Check if an image contains a face
 router.post('/check-face', async (req, res) => {
@@ -13,53 +15,20 @@ router.post('/check-face', async (req, res) => {
       return res.status(400).json({ success: false, message: 'No image provided' });
     }
     
-    // Remove data URL prefix
-    const base64Image = image.replace(/^data:image\/\w+;base64,/, '');
-    
-    // Spawn Python process to check for face
-    const pythonProcess = spawn('python', [
-      path.join(__dirname, '../../python/face_recognition_service.py'),
-      '--check-face'
-    ]);
-    
-    let result = '';
-    
-    // Send base64 image to Python process
-    pythonProcess.stdin.write(base64Image);
-    pythonProcess.stdin.end();
-    
-    // Collect data from Python process
-    pythonProcess.stdout.on('data', (data) => {
-      result += data.toString();
-    });
-    
-    // Handle process completion
-    pythonProcess.on('close', (code) => {
-      if (code !== 0) {
-        return res.status(500).json({ 
-          success: false, 
-          message: 'Error processing image' 
-        });
-      }
-      
-      try {
-        const parsedResult = JSON.parse(result);
-        return res.json({
-          success: true,
-          faceDetected: parsedResult.faceDetected
-        });
-      } catch (parseError) {
-        console.error('Error parsing Python output:', parseError);
-        return res.status(500).json({ 
-          success: false, 
-          message: 'Error parsing face detection result' 
-        });
-      }
-    });
+    let result;
+    try {
+      result = await faceWorker.request('check-face', { image: faceWorker.imageFromDataUrl(image) });
+    } catch (workerError) {
+      console.error('Face worker error in check-face:', workerError);
+      return res.status(500).json({ 
+        success: false, 
+        message: 'Error processing image' 
+      });
+    }
     
-    // Handle Python process errors
-    pythonProcess.stderr.on('data', (data) => {
-      console.error(`Python error: ${data}`);
+    return res.json({
+      success: true,
+      faceDetected: result.faceDetected
     });
     
   } catch (error) {
@@ -83,55 +52,32 @@ router.post('/register-face', async (req, res) => {
       });
     }
     
-    // Remove data URL prefix
-    const base64Image = image.replace(/^data:image\/\w+;base64,/, '');
-    
-    // Spawn Python process to register face
-    const pythonProcess = spawn('python', [
-      path.join(__dirname, '../../python/face_recognition_service.py'),
-      '--register-face',
-      name
-    ]);
-    
-    let result = '';
-    
-    // Send base64 image to Python process
-    pythonProcess.stdin.write(base64Image);
-    pythonProcess.stdin.end();
-    
-    // Collect data from Python process
-    pythonProcess.stdout.on('data', (data) => {
-      result += data.toString();
-    });
+    let result;
+    try {
+      result = await faceWorker.request('register-face', { image: faceWorker.imageFromDataUrl(image), name });
+    } catch (workerError) {
+      console.error('Face worker error in register-face:', workerError);
+      return res.status(500).json({ 
+        success: false, 
+        message: 'Error registering face' 
+      });
+    }
     
-    // Handle process completion
-    pythonProcess.on('close', (code) => {
-      if (code !== 0) {
-        return res.status(500).json({ 
-          success: false, 
-          message: 'Error registering face' 
-        });
-      }
-      
-      try {
-        const parsedResult = JSON.parse(result);
-        return res.json({
-          success: true,
-          message: parsedResult.message,
-          id: parsedResult.id
-        });
-      } catch (parseError) {
-        console.error('Error parsing Python output:', parseError);
-        return res.status(500).json({ 
-          success: false, 
-          message: 'Error parsing registration result' 
-        });
-      }
-    });
+    if (result.success === false) {
+      // 409 for a face that is already registered, 422 for an image without one
+      return res.status(result.reason === 'duplicate' ? 409 : 422).json({
+        success: false,
+        reason: result.reason,
+        message: result.message,
+        duplicate: result.duplicate
+      });
+    }
     
-    // Handle Python process errors
-    pythonProcess.stderr.on('data', (data) => {
-      console.error(`Python error: ${data}`);
+    return res.json({
+      success: true,
+      message: result.message,
+      id: result.id,
+      merged: Boolean(result.merged)
     });
     
   } catch (error) {
@@ -143,13 +89,42 @@ router.post('/register-face', async (req, res) => {
   }
 });
 
-// Get all registered faces
+// Get registered faces, newest first. With ?limit= or ?cursor= one page is
+// returned along with nextCursor; otherwise every face is streamed out page
+// by page, so the listing is never held in memory as a whole.
 router.get('/registered-faces', async (req, res) => {
+  const { limit, cursor } = req.query;
+  
   try {
-    const faces = await getRegisteredFaces();
-    res.json({ success: true, faces });
+    if (limit !== undefined || cursor !== undefined) {
+      const page = await getRegisteredFacesPage({ limit, cursor });
+      return res.json({ success: true, faces: page.faces, nextCursor: page.nextCursor });
+    }
+    
+    let page = await getRegisteredFacesPage({ limit: FACES_STREAM_PAGE_SIZE });
+    res.type('application/json');
+    res.write('{"success":true,"faces":[');
+    let first = true;
+    for (;;) {
+      for (const face of page.faces) {
+        res.write((first ? '' : ',') + JSON.stringify(face));
+        first = false;
+      }
+      if (!page.nextCursor || res.destroyed) {
+        break;
+      }
+      page = await getRegisteredFacesPage({ limit: FACES_STREAM_PAGE_SIZE, cursor: page.nextCursor });
+    }
+    res.end(']}');
   } catch (error) {
+    if (error.code === 'INVALID_CURSOR') {
+      return res.status(400).json({ success: false, message: error.message });
+    }
     console.error('Error getting registered faces:', error);
+    if (res.headersSent) {
+      // Too late for an error response; cut the stream short
+      return res.destroy(error);
+    }
     res.status(500).json({ 
       success: false, 
       message: `Server error: ${error.message}` 
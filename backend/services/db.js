@@ -73,11 +73,35 @@ const storeFaceEncoding = async (name, encoding) => {
   }
 };
 
+// Rows per page of the registered faces listing, and the most a client may ask for
+const FACES_PAGE_SIZE = parseInt(process.env.FACES_PAGE_SIZE || '100', 10);
+const FACES_MAX_PAGE_SIZE = parseInt(process.env.FACES_MAX_PAGE_SIZE || '1000', 10);
+
+// Cursors are base64url JSON [created_at, id] of the last row of a page,
+// the same format python/database.py uses
+const encodeFacesCursor = (createdAt, id) =>
+  Buffer.from(JSON.stringify([createdAt, id])).toString('base64url');
+
+const decodeFacesCursor = (cursor) => {
+  let value;
+  try {
+    value = JSON.parse(Buffer.from(cursor, 'base64url').toString('utf8'));
+  } catch (error) {
+    value = null;
+  }
+  if (!Array.isArray(value) || typeof value[0] !== 'string' || !Number.isInteger(value[1])) {
+    const error = new Error(`Invalid cursor: ${cursor}`);
+    error.code = 'INVALID_CURSOR';
+    throw error;
+  }
+  return value;
+};
+
 // Get all registered faces
 const getRegisteredFaces = async () => {
   try {
     const result = await pool.query(
-      'SELECT id, name, created_at FROM faces ORDER BY created_at DESC'
+      'SELECT id, name, created_at FROM faces ORDER BY created_at DESC, id DESC'
     );
     
     return result.rows;
@@ -87,6 +111,47 @@ const getRegisteredFaces = async () => {
   }
 };
 
+// One page of registered faces, newest first, keyed on (created_at, id) so
+// deep pages stay cheap and new registrations don't shift rows between pages.
+// nextCursor is null on the last page.
+const getRegisteredFacesPage = async ({ limit = FACES_PAGE_SIZE, cursor = null } = {}) => {
+  const pageSize = Math.max(1, Math.min(parseInt(limit, 10) || FACES_PAGE_SIZE, FACES_MAX_PAGE_SIZE));
+  // created_at is also read as text: JS dates keep only milliseconds
+  const columns = 'id, name, created_at, created_at::text AS created_at_key';
+  
+  try {
+    let result;
+    if (cursor) {
+      const [createdAt, id] = decodeFacesCursor(cursor);
+      result = await pool.query(
+        `SELECT ${columns} FROM faces WHERE (created_at, id) < ($1::timestamp, $2)
+         ORDER BY created_at DESC, id DESC LIMIT $3`,
+        [createdAt, id, pageSize + 1]
+      );
+    } else {
+      result = await pool.query(
+        `SELECT ${columns} FROM faces ORDER BY created_at DESC, id DESC LIMIT $1`,
+        [pageSize + 1]
+      );
+    }
+    
+    // The extra row only tells whether another page follows
+    const rows = result.rows.slice(0, pageSize);
+    const last = rows[rows.length - 1];
+    const nextCursor = result.rows.length > pageSize ? encodeFacesCursor(last.created_at_key, last.id) : null;
+    
+    return {
+      faces: rows.map(({ id, name, created_at }) => ({ id, name, created_at })),
+      nextCursor
+    };
+  } catch (error) {
+    if (error.code !== 'INVALID_CURSOR') {
+      console.error('Error getting registered faces page:', error);
+    }
+    throw error;
+  }
+};
+
 // Get face encodings for recognition
 const getFaceEncodings = async () => {
   try {
@@ -163,6 +228,7 @@ module.exports = {
   pool,
   storeFaceEncoding,
   getRegisteredFaces,
+  getRegisteredFacesPage,
   getFaceEncodings,
   getFaceById,
   getLastRegisteredFace,
@@ -0,0 +1,43 @@
+const path = require('path');
+const { createPythonWorker } = require('./pythonWorker');
+
+const SCRIPT_PATH = path.join(__dirname, '../../python/face_recognition_service.py');
+
+// Binary frames start with the header and payload lengths (uint32, big-endian)
+const FRAME_PREFIX_BYTES = 8;
+
+// Turn a (data URL or bare) base64 image into the raw bytes the worker expects
+const imageFromDataUrl = (dataUrl) => {
+  const comma = dataUrl.indexOf(',');
+  return Buffer.from(comma === -1 ? dataUrl : dataUrl.slice(comma + 1), 'base64');
+};
+
+// Write one length-prefixed frame: JSON header followed by the image bytes
+const writeFrame = (stream, message) => {
+  const { image, ...header } = message;
+  const payload = image || Buffer.alloc(0);
+  const headerBytes = Buffer.from(JSON.stringify(header));
+  const prefix = Buffer.alloc(FRAME_PREFIX_BYTES);
+  prefix.writeUInt32BE(headerBytes.length, 0);
+  prefix.writeUInt32BE(payload.length, 4);
+
+  stream.cork();
+  stream.write(prefix);
+  stream.write(headerBytes);
+  if (payload.length > 0) {
+    stream.write(payload);
+  }
+  stream.uncork();
+};
+
+const worker = createPythonWorker('Face worker', SCRIPT_PATH, ['--serve', '--binary'], writeFrame);
+
+// Send a request to the face recognition worker and resolve with its JSON result.
+// `params.image` is a Buffer of JPEG/PNG bytes, or raw pixels together with
+// `format` ('gray', 'bgr', 'rgb', ...) and `shape` ([height, width]).
+const request = (op, params = {}) => worker.request({ op, ...params });
+
+module.exports = {
+  request,
+  imageFromDataUrl
+};
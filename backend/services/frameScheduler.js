@@ -0,0 +1,84 @@
+// Highest recognition rate per client stream (frames per second, 0 = unlimited)
+const TARGET_FPS = parseFloat(process.env.RECOGNITION_TARGET_FPS || '10');
+
+// Latest-frame-wins scheduling for one client's live recognition stream.
+// At most one frame is being processed and at most one is waiting; a newer
+// frame replaces the waiting one, so a slow worker never builds a backlog
+// and results always describe a recent frame.
+class FrameScheduler {
+  constructor(processFrame, { targetFps = TARGET_FPS } = {}) {
+    this.processFrame = processFrame;
+    this.minIntervalMs = targetFps > 0 ? 1000 / targetFps : 0;
+    this.pending = null;
+    this.busy = false;
+    this.timer = null;
+    this.closed = false;
+    this.lastStartedAt = 0;
+    this.stats = { received: 0, processed: 0, dropped: 0, failed: 0 };
+  }
+
+  // Queue a frame, replacing any frame that hasn't started yet
+  submit(frame) {
+    if (this.closed) {
+      return;
+    }
+
+    this.stats.received++;
+    if (this.pending !== null) {
+      this.stats.dropped++;
+    }
+    this.pending = frame;
+    this.schedule();
+  }
+
+  // Start the waiting frame once the worker is free and the FPS budget allows
+  schedule() {
+    if (this.busy || this.timer || this.pending === null || this.closed) {
+      return;
+    }
+
+    const waitMs = this.lastStartedAt + this.minIntervalMs - Date.now();
+    if (waitMs > 0) {
+      this.timer = setTimeout(() => {
+        this.timer = null;
+        this.schedule();
+      }, waitMs);
+      return;
+    }
+
+    const frame = this.pending;
+    this.pending = null;
+    this.busy = true;
+    this.lastStartedAt = Date.now();
+    this.stats.processed++;
+
+    Promise.resolve()
+      .then(() => this.processFrame(frame))
+      .catch((error) => {
+        this.stats.failed++;
+        console.error('Error processing recognition frame:', error);
+      })
+      .finally(() => {
+        this.busy = false;
+        this.schedule();
+      });
+  }
+
+  // Stop accepting frames; a frame already being processed still finishes
+  close() {
+    this.closed = true;
+    if (this.pending !== null) {
+      this.stats.dropped++;
+      this.pending = null;
+    }
+    if (this.timer) {
+      clearTimeout(this.timer);
+      this.timer = null;
+    }
+  }
+}
+
+module.exports = {
+  FrameScheduler,
+  TARGET_FPS
+};
@@ -0,0 +1,106 @@
+const { spawn } = require('child_process');
+const readline = require('readline');
+
+// Milliseconds a request may wait for its response before it is rejected
+const REQUEST_TIMEOUT_MS = parseInt(process.env.PYTHON_WORKER_TIMEOUT_MS || '60000', 10);
+
+// A long-running Python process answering requests with one JSON line each.
+// Requests carry an id so several can be in flight; `writeRequest(stdin, message)`
+// encodes a request for the process, and the worker is restarted lazily if it exits.
+// A request without a response after `timeoutMs` is rejected.
+const createPythonWorker = (name, scriptPath, args, writeRequest, timeoutMs = REQUEST_TIMEOUT_MS) => {
+  let worker = null;
+  let nextRequestId = 1;
+  const pendingRequests = new Map();
+
+  // Reject every in-flight request, e.g. when the worker exits
+  const failPendingRequests = (error) => {
+    pendingRequests.forEach(({ reject, timer }) => {
+      clearTimeout(timer);
+      reject(error);
+    });
+    pendingRequests.clear();
+  };
+
+  // Spawn the Python worker and wire up its output
+  const startWorker = () => {
+    const pythonProcess = spawn('python', [scriptPath, ...args]);
+
+    const lines = readline.createInterface({ input: pythonProcess.stdout });
+    lines.on('line', (line) => {
+      let response;
+      try {
+        response = JSON.parse(line);
+      } catch (parseError) {
+        console.error('Error parsing Python output:', parseError);
+        return;
+      }
+
+      const pending = pendingRequests.get(response.id);
+      if (!pending) {
+        console.warn(`${name} returned unknown request id: ${response.id}`);
+        return;
+      }
+
+      pendingRequests.delete(response.id);
+      clearTimeout(pending.timer);
+      delete response.id;
+
+      if (response.error) {
+        pending.reject(new Error(response.error));
+      } else {
+        pending.resolve(response);
+      }
+    });
+
+    // Handle Python process errors
+    pythonProcess.stderr.on('data', (data) => {
+      console.error(`Python error: ${data}`);
+    });
+
+    pythonProcess.on('error', (error) => {
+      console.error(`${name} failed to start:`, error);
+    });
+
+    // Writing to a worker that just died fails with EPIPE; its 'close'
+    // handler rejects the pending requests
+    pythonProcess.stdin.on('error', (error) => {
+      console.error(`${name} input closed:`, error.message);
+    });
+
+    // Restart lazily on the next request if the worker dies
+    pythonProcess.on('close', (code) => {
+      console.warn(`${name} exited with code ${code}`);
+      if (worker === pythonProcess) {
+        worker = null;
+      }
+      failPendingRequests(new Error(`${name} exited`));
+    });
+
+    return pythonProcess;
+  };
+
+  // Send a request and resolve with the worker's JSON response
+  const request = (message) => {
+    if (!worker) {
+      worker = startWorker();
+    }
+
+    const id = nextRequestId++;
+
+    return new Promise((resolve, reject) => {
+      const timer = setTimeout(() => {
+        pendingRequests.delete(id);
+        reject(new Error(`${name} did not answer request ${id} within ${timeoutMs} ms`));
+      }, timeoutMs);
+      pendingRequests.set(id, { resolve, reject, timer });
+      writeRequest(worker.stdin, { id, ...message });
+    });
+  };
+
+  return { request };
+};
+
+module.exports = {
+  createPythonWorker
+};
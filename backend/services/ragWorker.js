@@ -0,0 +1,16 @@
+const path = require('path');
+const { createPythonWorker } = require('./pythonWorker');
+
+const SCRIPT_PATH = path.join(__dirname, '../../python/enhanced_rag_service.py');
+
+// The worker keeps its vector index and QA chain loaded between questions
+const worker = createPythonWorker('RAG worker', SCRIPT_PATH, ['--serve'], (stream, message) => {
+  stream.write(JSON.stringify(message) + '\n');
+});
+
+// Ask the enhanced RAG service a question; resolves with { response, source_count }
+const query = (message) => worker.request({ query: message });
+
+module.exports = {
+  query
+};
@@ -1,6 +1,8 @@
 const WebSocket = require('ws');
-const { spawn } = require('child_process');
-const path = require('path');
+const crypto = require('crypto');
+const faceWorker = require('./faceWorker');
+const ragWorker = require('./ragWorker');
+const { FrameScheduler } = require('./frameScheduler');
 
 // Setup WebSocket server with handlers
 const setupWebSocketServer = (wss) => {
@@ -9,15 +11,27 @@ const setupWebSocketServer = (wss) => {
   wss.on('connection', (ws) => {
     console.log('Client connected to WebSocket');
     
+    // Identifies this client's stream so faces can be tracked across frames
+    ws.sessionId = crypto.randomUUID();
+    
+    // Only the newest frame waits while one is being recognized; older ones are dropped
+    ws.frameScheduler = new FrameScheduler((data) => handleRecognitionRequest(ws, data));
+    
     // Handle incoming messages
-    ws.on('message', (message) => {
+    ws.on('message', (message, isBinary) => {
       try {
+        // Binary messages are encoded camera frames to recognize as-is
+        if (isBinary) {
+          ws.frameScheduler.submit({ image: message });
+          return;
+        }
+        
         const data = JSON.parse(message.toString());
         
         // Handle different message types
         switch (data.type) {
           case 'RECOGNIZE':
-            handleRecognitionRequest(ws, data);
+            ws.frameScheduler.submit(data);
             break;
           
           case 'CHAT_QUERY':
@@ -36,6 +50,14 @@ const setupWebSocketServer = (wss) => {
     // Handle connection close
     ws.on('close', () => {
       console.log('Client disconnected from WebSocket');
+      
+      ws.frameScheduler.close();
+      const { processed, dropped } = ws.frameScheduler.stats;
+      console.log(`Recognition stream ${ws.sessionId}: ${processed} frames processed, ${dropped} dropped`);
+      
+      // Release the worker's tracking state for this stream
+      faceWorker.request('end-session', { session: ws.sessionId })
+        .catch((error) => console.error('Error ending recognition session:', error));
     });
     
     // Handle errors
@@ -55,54 +77,31 @@ const setupWebSocketServer = (wss) => {
 };
 
 // Handle face recognition request
-const handleRecognitionRequest = (ws, data) => {
+const handleRecognitionRequest = async (ws, data) => {
   try {
-    // Extract image data (remove data URL prefix)
-    const base64Image = data.image.replace(/^data:image\/\w+;base64,/, '');
-    
-    // Spawn Python process for face recognition
-    const pythonProcess = spawn('python', [
-      path.join(__dirname, '../../python/face_recognition_service.py'),
-      '--recognize'
-    ]);
-    
-    let result = '';
-    
-    // Send base64 image to Python process
-    pythonProcess.stdin.write(base64Image);
-    pythonProcess.stdin.end();
-    
-    // Collect data from Python process
-    pythonProcess.stdout.on('data', (data) => {
-      result += data.toString();
-    });
-    
-    // Handle process completion
-    pythonProcess.on('close', (code) => {
-      if (code !== 0) {
-        return sendErrorResponse(ws, 'Error processing recognition request');
-      }
-      
-      try {
-        const parsedResult = JSON.parse(result);
-        
-        // Send recognition results back to client
-        if (ws.readyState === WebSocket.OPEN) {
-          ws.send(JSON.stringify({
-            type: 'RECOGNITION_RESULT',
-            faces: parsedResult.faces
-          }));
-        }
-      } catch (parseError) {
-        console.error('Error parsing Python output:', parseError);
-        sendErrorResponse(ws, 'Error parsing recognition result');
-      }
-    });
+    // Frames arrive as raw bytes or as a base64 data URL
+    const image = Buffer.isBuffer(data.image) ? data.image : faceWorker.imageFromDataUrl(data.image);
+    
+    let result;
+    try {
+      result = await faceWorker.request('recognize', {
+        image,
+        session: ws.sessionId
+      });
+    } catch (workerError) {
+      console.error('Face worker error during recognition:', workerError);
+      return sendErrorResponse(ws, 'Error processing recognition request');
+    }
     
-    // Handle Python process errors
-    pythonProcess.stderr.on('data', (data) => {
-      console.error(`Python error: ${data}`);
-    });
+    // Send recognition results back to client
+    if (ws.readyState === WebSocket.OPEN) {
+      const { processed, dropped } = ws.frameScheduler.stats;
+      ws.send(JSON.stringify({
+        type: 'RECOGNITION_RESULT',
+        faces: result.faces,
+        frames: { processed, dropped }
+      }));
+    }
     
   } catch (error) {
     console.error('Error handling recognition request:', error);
@@ -111,7 +110,7 @@ const handleRecognitionRequest = (ws, data) => {
 };
 
 // Handle chat query for RAG
-const handleChatQuery = (ws, data) => {
+const handleChatQuery = async (ws, data) => {
   try {
     // Send loading message to client
     if (ws.readyState === WebSocket.OPEN) {
@@ -122,51 +121,24 @@ const handleChatQuery = (ws, data) => {
       }));
     }
     
-    // Spawn Python process for Enhanced RAG with LangChain + FAISS + Cohere
-    const pythonProcess = spawn('python', [
-      path.join(__dirname, '../../python/enhanced_rag_service.py'),
-      '--query'
-    ]);
-    
-    let result = '';
-    
-    // Send query to Python process
-    pythonProcess.stdin.write(data.message);
-    pythonProcess.stdin.end();
-    
-    // Collect data from Python process
-    pythonProcess.stdout.on('data', (data) => {
-      result += data.toString();
-    });
-    
-    // Handle process completion
-    pythonProcess.on('close', (code) => {
-      if (code !== 0) {
-        return sendErrorResponse(ws, 'Error processing chat query');
-      }
-      
-      try {
-        const parsedResult = JSON.parse(result);
-        
-        // Send response back to client
-        if (ws.readyState === WebSocket.OPEN) {
-          ws.send(JSON.stringify({
-            type: 'CHAT_RESPONSE',
-            message: parsedResult.response,
-            sourceCount: parsedResult.source_count || 0,
-            isLoading: false
-          }));
-        }
-      } catch (parseError) {
-        console.error('Error parsing Python output:', parseError);
-        sendErrorResponse(ws, 'Error parsing chat response');
-      }
-    });
+    // Enhanced RAG (LangChain + FAISS + Cohere) runs in a long-lived worker
+    let result;
+    try {
+      result = await ragWorker.query(data.message);
+    } catch (workerError) {
+      console.error('RAG worker error:', workerError);
+      return sendErrorResponse(ws, 'Error processing chat query');
+    }
     
-    // Handle Python process errors
-    pythonProcess.stderr.on('data', (data) => {
-      console.error(`Python error: ${data}`);
-    });
+    // Send response back to client
+    if (ws.readyState === WebSocket.OPEN) {
+      ws.send(JSON.stringify({
+        type: 'CHAT_RESPONSE',
+        message: result.response,
+        sourceCount: result.source_count || 0,
+        isLoading: false
+      }));
+    }
     
   } catch (error) {
     console.error('Error handling chat query:', error);
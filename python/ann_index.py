@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+import os
+import json
+import logging
+import threading
+import contextlib
+import numpy as np
+
+logger = logging.getLogger("ann_index")
+
+# Search backend for the face gallery: exact, flat, ivf or hnsw
+SEARCH_BACKEND = os.getenv("FACE_SEARCH_BACKEND", "exact")
+
+# Galleries smaller than this are always searched exactly
+ANN_MIN_SIZE = int(os.getenv("FACE_ANN_MIN_SIZE", "1000"))
+
+# IVF: number of inverted lists, and how many of them each query visits
+IVF_NLIST = int(os.getenv("FACE_IVF_NLIST", "1024"))
+IVF_NPROBE = int(os.getenv("FACE_IVF_NPROBE", "16"))
+
+# HNSW: graph degree, and candidate list sizes while building and searching
+HNSW_M = int(os.getenv("FACE_HNSW_M", "32"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("FACE_HNSW_EF_CONSTRUCTION", "200"))
+HNSW_EF_SEARCH = int(os.getenv("FACE_HNSW_EF_SEARCH", "64"))
+
+# IVF training uses at most this many vectors per inverted list
+IVF_TRAINING_POINTS_PER_LIST = 64
+
+class ReadWriteLock:
+    """Any number of readers, or one writer; waiting writers go first."""
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writing = False
+        self._waiting_writers = 0
+
+    @contextlib.contextmanager
+    def reading(self):
+        with self._condition:
+            while self._writing or self._waiting_writers:
+                self._condition.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if not self._readers:
+                    self._condition.notify_all()
+
+    @contextlib.contextmanager
+    def writing(self):
+        with self._condition:
+            self._waiting_writers += 1
+            while self._writing or self._readers:
+                self._condition.wait()
+            self._waiting_writers -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writing = False
+                self._condition.notify_all()
+
+class FaissIndex:
+    """Approximate nearest-neighbour search over the gallery through faiss.
+
+    Positions in the faiss index are gallery row numbers, so the gallery
+    keeps ids and names and this class only answers "which rows are
+    closest". Until the gallery reaches ``min_size`` rows the index stays
+    unbuilt (``ready`` is False) and the gallery falls back to exact search.
+
+    faiss can't add to an index while it is being searched, so searches
+    share a read lock and everything that changes the index takes it
+    exclusively.
+    """
+
+    KINDS = ("flat", "ivf", "hnsw")
+
+    def __init__(self, kind, min_size=ANN_MIN_SIZE, nlist=IVF_NLIST, nprobe=IVF_NPROBE,
+                 hnsw_m=HNSW_M, ef_construction=HNSW_EF_CONSTRUCTION, ef_search=HNSW_EF_SEARCH):
+        if kind not in self.KINDS:
+            raise ValueError(f"Unknown search backend: {kind}")
+
+        import faiss
+        self._faiss = faiss
+        self.kind = kind
+        self.min_size = min_size
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.hnsw_m = hnsw_m
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self.index = None
+        self._rwlock = ReadWriteLock()
+
+    @property
+    def ready(self):
+        return self.index is not None
+
+    @property
+    def ntotal(self):
+        return 0 if self.index is None else self.index.ntotal
+
+    def _create(self, matrix):
+        faiss = self._faiss
+        dimension = matrix.shape[1]
+
+        if self.kind == "flat":
+            return faiss.IndexFlatL2(dimension)
+
+        if self.kind == "hnsw":
+            index = faiss.IndexHNSWFlat(dimension, self.hnsw_m)
+            index.hnsw.efConstruction = self.ef_construction
+            return index
+
+        # Keep roughly 39+ training points per list, as faiss expects
+        nlist = max(1, min(self.nlist, len(matrix) // 39))
+        quantizer = faiss.IndexFlatL2(dimension)
+        index = faiss.IndexIVFFlat(quantizer, dimension, nlist)
+
+        sample_size = min(len(matrix), nlist * IVF_TRAINING_POINTS_PER_LIST)
+        sample = matrix
+        if sample_size < len(matrix):
+            rows = np.random.default_rng(0).choice(len(matrix), sample_size, replace=False)
+            sample = matrix[np.sort(rows)]
+        index.train(np.ascontiguousarray(sample, dtype=np.float32))
+        return index
+
+    def _apply_search_params(self):
+        if self.kind == "ivf":
+            self.index.nprobe = self.nprobe
+        elif self.kind == "hnsw":
+            self.index.hnsw.efSearch = self.ef_search
+
+    def set_search_params(self, nprobe=None, ef_search=None):
+        """Trade recall for latency on an already built index."""
+        if nprobe is not None:
+            self.nprobe = nprobe
+        if ef_search is not None:
+            self.ef_search = ef_search
+        with self._rwlock.writing():
+            if self.index is not None:
+                self._apply_search_params()
+
+    def build(self, matrix):
+        """(Re)build the index from every gallery row."""
+        matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+        logger.info(f"Building {self.kind} index over {len(matrix)} encodings")
+        index = self._create(matrix)
+        index.add(matrix)
+        with self._rwlock.writing():
+            self.index = index
+            self._apply_search_params()
+
+    def sync(self, rows_from, size):
+        """Bring the index up to date with the gallery's ``size`` rows.
+
+        ``rows_from(start)`` returns the gallery's rows from ``start`` on,
+        so only the rows the index is missing are gathered.
+        """
+        if self.index is None:
+            if size >= self.min_size:
+                self.build(rows_from(0))
+        elif size > self.index.ntotal:
+            rows = np.ascontiguousarray(rows_from(self.index.ntotal), dtype=np.float32)
+            with self._rwlock.writing():
+                self.index.add(rows)
+
+    def search(self, queries, k=1):
+        """Return (distances, row indices) of the k nearest rows per query.
+
+        Missing neighbours (possible with IVF at low nprobe) come back with
+        index -1 and an infinite distance.
+        """
+        queries = np.ascontiguousarray(np.atleast_2d(queries), dtype=np.float32)
+        with self._rwlock.reading():
+            sq_distances, indices = self.index.search(queries, k)
+        distances = np.sqrt(np.maximum(sq_distances, 0.0))
+        distances[indices < 0] = np.inf
+        return distances, indices
+
+    def save(self, path, ids):
+        """Write the index plus the gallery ids it covers."""
+        with self._rwlock.reading():
+            self._faiss.write_index(self.index, path)
+        with open(path + ".json", "w") as f:
+            json.dump({
+                "kind": self.kind,
+                "dimension": self.index.d,
+                "ids": [int(i) for i in ids[:self.index.ntotal]]
+            }, f)
+        logger.info(f"Saved {self.kind} index with {self.index.ntotal} encodings to {path}")
+
+    def load(self, path, ids, dimension):
+        """Load a saved index if it was built from a prefix of the given ids."""
+        if not (os.path.exists(path) and os.path.exists(path + ".json")):
+            return False
+
+        with open(path + ".json") as f:
+            meta = json.load(f)
+
+        saved_ids = meta.get("ids", [])
+        if (meta.get("kind") != self.kind or meta.get("dimension") != dimension
+                or saved_ids != [int(i) for i in ids[:len(saved_ids)]]):
+            logger.warning(f"Ignoring stale search index at {path}")
+            return False
+
+        index = self._faiss.read_index(path)
+        with self._rwlock.writing():
+            self.index = index
+            self._apply_search_params()
+        logger.info(f"Loaded {self.kind} index with {self.index.ntotal} encodings from {path}")
+        return True
+
+def create_index(kind=None, **params):
+    """Create the configured ANN index, or None for exact search.
+
+    Falls back to exact search when faiss isn't installed.
+    """
+    kind = kind or SEARCH_BACKEND
+    if kind == "exact":
+        return None
+
+    try:
+        return FaissIndex(kind, **params)
+    except ImportError:
+        logger.warning(f"faiss is not installed; using exact search instead of '{kind}'")
+        return None
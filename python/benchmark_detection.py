@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+import cv2
+from detectors import DETECTION_PROFILES, detect_faces, get_detector, to_grayscale
+
+def synthetic_frames(count, width, height):
+    """Webcam-sized frames with a simple drawn face at varying positions."""
+    rng = np.random.default_rng(0)
+    frames = []
+    for i in range(count):
+        frame = rng.integers(40, 90, (height, width, 3), dtype=np.uint8)
+        size = height // 3
+        cx = width // 4 + (i * 37) % (width // 2)
+        cy = height // 2
+        cv2.circle(frame, (cx, cy), size // 2, (200, 200, 200), -1)
+        cv2.circle(frame, (cx - size // 6, cy - size // 8), size // 14, (0, 0, 0), -1)
+        cv2.circle(frame, (cx + size // 6, cy - size // 8), size // 14, (0, 0, 0), -1)
+        cv2.ellipse(frame, (cx, cy + size // 6), (size // 5, size // 10), 0, 0, 180, (0, 0, 0), 3)
+        frames.append(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+    return frames
+
+def load_frames(directory):
+    frames = []
+    for filename in sorted(os.listdir(directory)):
+        image = cv2.imread(os.path.join(directory, filename), cv2.IMREAD_COLOR)
+        if image is not None:
+            frames.append(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+    return frames
+
+def legacy_detect(image, scale_factor, min_neighbors):
+    """Detection as the service originally did it: full resolution, fresh cascade."""
+    gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+    face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+    return face_cascade.detectMultiScale(gray, scale_factor, min_neighbors)
+
+def measure(frames, detect, repeat):
+    faces = 0
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for frame in frames:
+            faces += len(detect(frame))
+    elapsed = time.perf_counter() - started
+    processed = len(frames) * repeat
+    return {"fps": processed / elapsed, "ms_per_frame": 1000 * elapsed / processed, "faces": faces}
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark face detection throughput')
+    parser.add_argument('--images', metavar='DIR', help='Directory of frames to use instead of synthetic ones')
+    parser.add_argument('--frames', type=int, default=20, help='Number of synthetic frames')
+    parser.add_argument('--width', type=int, default=1280, help='Synthetic frame width')
+    parser.add_argument('--height', type=int, default=720, help='Synthetic frame height')
+    parser.add_argument('--repeat', type=int, default=3, help='Passes over the frame set')
+    args = parser.parse_args()
+
+    frames = load_frames(args.images) if args.images else synthetic_frames(args.frames, args.width, args.height)
+    if not frames:
+        print(json.dumps({"error": "No frames to benchmark"}))
+        sys.exit(1)
+
+    # Warm up the shared detector so loading isn't timed
+    get_detector().load()
+
+    legacy_settings = {"check": (1.05, 2), "register": (1.1, 4), "recognize": (1.1, 4)}
+    results = {}
+    for operation in DETECTION_PROFILES:
+        if operation not in legacy_settings:
+            continue
+        scale_factor, min_neighbors = legacy_settings[operation]
+        results[operation] = {
+            "legacy": measure(frames, lambda f: legacy_detect(f, scale_factor, min_neighbors), args.repeat),
+            "pipeline": measure(frames, lambda f: detect_faces(to_grayscale(f), operation), args.repeat),
+        }
+        results[operation]["speedup"] = results[operation]["pipeline"]["fps"] / results[operation]["legacy"]["fps"]
+
+    print(f"{'operation':<10} {'legacy fps':>11} {'pipeline fps':>13} {'speedup':>8}")
+    for operation, result in results.items():
+        print(f"{operation:<10} {result['legacy']['fps']:>11.1f} {result['pipeline']['fps']:>13.1f} {result['speedup']:>7.1f}x")
+
+    print(json.dumps(results))
+
+if __name__ == "__main__":
+    main()
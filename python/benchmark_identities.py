@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+import json
+import time
+import argparse
+import numpy as np
+from gallery import FaceGallery
+from identities import IdentityIndex
+
+def synthetic_gallery(people, samples, dimension, spread, seed=0):
+    """(id, name, encoding) rows: ``samples`` noisy unit vectors around each person's center."""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(people, dimension)).astype(np.float32)
+    centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+    # Enrolment counts vary; some people are registered many times
+    counts = rng.integers(1, 2 * samples, size=people)
+    owners = np.repeat(np.arange(people), counts)
+    rng.shuffle(owners)
+    encodings = centers[owners] + spread * rng.normal(size=(len(owners), dimension)).astype(np.float32)
+    rows = [(position + 1, f"Person {owner}", encoding) for position, (owner, encoding) in enumerate(zip(owners, encodings))]
+    return centers, rows
+
+def measure(queries, search):
+    started = time.perf_counter()
+    indices, distances = search(queries)
+    elapsed = time.perf_counter() - started
+    return {"ms_per_query": 1000 * elapsed / len(queries)}, indices, distances
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark per-person centroid matching against a per-row scan')
+    parser.add_argument('--people', type=int, default=20000, help='Number of registered people')
+    parser.add_argument('--samples', type=int, default=10, help='Average registrations per person')
+    parser.add_argument('--dimension', type=int, default=128, help='Encoding dimension')
+    parser.add_argument('--spread', type=float, default=0.05, help='Per-dimension noise of each registration')
+    parser.add_argument('--queries', type=int, default=200, help='Number of probes')
+    parser.add_argument('--shortlist', type=int, default=8, help='People re-ranked by their samples')
+    args = parser.parse_args()
+
+    centers, rows = synthetic_gallery(args.people, args.samples, args.dimension, args.spread)
+    gallery = FaceGallery(lambda after_id, pending: [])
+    gallery.add_many(rows)
+
+    identities = IdentityIndex(gallery, args.shortlist)
+    started = time.perf_counter()
+    identities.sync()
+    build_seconds = time.perf_counter() - started
+
+    rng = np.random.default_rng(1)
+    queries = centers[rng.integers(0, args.people, args.queries)]
+    queries = queries + args.spread * rng.normal(size=queries.shape).astype(np.float32)
+
+    rows_result, row_indices, row_distances = measure(queries, gallery.search)
+    identity_result, identity_indices, identity_distances = measure(queries, identities.search)
+    results = {
+        "faces": len(gallery),
+        "people": len(identities),
+        "build_ms": 1000 * build_seconds,
+        "rows": rows_result,
+        "identities": identity_result,
+        "same_person": float(np.mean([
+            gallery.names[row] == gallery.names[identity]
+            for row, identity in zip(row_indices, identity_indices)
+        ])),
+        "max_distance_gap": float(np.max(identity_distances - row_distances)),
+    }
+    results["speedup"] = results["rows"]["ms_per_query"] / results["identities"]["ms_per_query"]
+
+    print(f"{'method':<12} {'ms/query':>10}")
+    for method in ("rows", "identities"):
+        print(f"{method:<12} {results[method]['ms_per_query']:>10.4f}")
+    print(f"{results['faces']} faces of {results['people']} people, grouped in {results['build_ms']:.0f} ms, "
+          f"same person {100 * results['same_person']:.1f}%, speedup {results['speedup']:.1f}x")
+
+    print(json.dumps(results))
+
+if __name__ == "__main__":
+    main()
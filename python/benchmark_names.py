@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+import json
+import time
+import random
+import argparse
+from datetime import datetime, timedelta
+import psycopg2.extras
+from db_pool import db_connection
+from schema import MIGRATIONS
+from rag_service import find_registered_names
+
+# Titles some names start with, to exercise punctuation in names
+TITLES = ["Dr.", "Mr.", "Ms."]
+
+SYLLABLES = ["an", "bel", "cor", "da", "el", "fi", "gor", "ha", "is", "jo", "ka", "li",
+             "mar", "no", "or", "pe", "qui", "ra", "sa", "ti", "ul", "vi", "wen", "xa", "yo", "zu"]
+
+QUESTIONS = [
+    "When was {} registered?",
+    "What time did {} get added to the system?",
+    "when did {} and {} register",
+    "When was the last face registered?",
+]
+
+def synthetic_rows(count, seed=0):
+    """(id, name, created_at) rows with distinct one- to three-word names."""
+    rng = random.Random(seed)
+    started = datetime(2024, 1, 1)
+    names = set()
+    rows = []
+    while len(rows) < count:
+        words = [
+            "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))).capitalize()
+            for _ in range(rng.choice((1, 2, 2, 3)))
+        ]
+        if rng.random() < 0.1:
+            words.insert(0, rng.choice(TITLES))
+        name = " ".join(words)
+        if name in names:
+            continue
+        names.add(name)
+        rows.append((len(rows) + 1, name, started + timedelta(minutes=len(rows))))
+    return rows
+
+def synthetic_questions(rows, count, seed=1):
+    rng = random.Random(seed)
+    questions = []
+    for _ in range(count):
+        template = rng.choice(QUESTIONS)
+        questions.append(template.format(*(rng.choice(rows)[1] for _ in range(template.count("{}")))))
+    return questions
+
+def load_names(cur, rows):
+    """Fill a temporary faces table, which hides the real one for this transaction.
+    
+    It gets the same name index as the real table, from the schema
+    migration that creates it.
+    """
+    cur.execute("""
+        CREATE TEMP TABLE faces (id INTEGER PRIMARY KEY, name VARCHAR(255) NOT NULL, created_at TIMESTAMP)
+        ON COMMIT DROP
+    """)
+    psycopg2.extras.execute_values(cur, "INSERT INTO faces (id, name, created_at) VALUES %s", rows, page_size=10000)
+    for version, _, statements in MIGRATIONS:
+        if version == 4:
+            for statement in statements:
+                cur.execute(statement)
+    cur.execute("ANALYZE faces")
+
+def linear_scan(cur, question):
+    """Matching as the service originally did it: a substring test per registered name."""
+    cur.execute("""
+        SELECT LOWER(name) AS name, MIN(created_at) AS created_at
+        FROM faces
+        WHERE name <> '' AND STRPOS(%s, LOWER(name)) > 0
+        GROUP BY LOWER(name)
+    """, (question.lower(),))
+    return cur.fetchall()
+
+def measure(questions, match):
+    matched = 0
+    started = time.perf_counter()
+    for question in questions:
+        matched += len(match(question))
+    elapsed = time.perf_counter() - started
+    return {"ms_per_query": 1000 * elapsed / len(questions), "matches": matched}
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark finding registered names in "when" questions')
+    parser.add_argument('--names', type=int, default=100000, help='Number of registered names')
+    parser.add_argument('--queries', type=int, default=200, help='Number of questions to match')
+    args = parser.parse_args()
+
+    rows = synthetic_rows(args.names)
+    questions = synthetic_questions(rows, args.queries)
+
+    with db_connection() as conn, conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
+        started = time.perf_counter()
+        load_names(cur, rows)
+        load_seconds = time.perf_counter() - started
+
+        results = {
+            "names": len(rows),
+            "load_ms": 1000 * load_seconds,
+            "linear_scan": measure(questions, lambda question: linear_scan(cur, question)),
+            "indexed": measure(questions, lambda question: find_registered_names(cur, question)),
+        }
+    results["speedup"] = results["linear_scan"]["ms_per_query"] / results["indexed"]["ms_per_query"]
+
+    print(f"{'method':<12} {'ms/query':>10} {'matches':>8}")
+    for method in ("linear_scan", "indexed"):
+        print(f"{method:<12} {results[method]['ms_per_query']:>10.4f} {results[method]['matches']:>8}")
+    print(f"{results['names']} names loaded in {results['load_ms']:.0f} ms, speedup {results['speedup']:.0f}x")
+
+    print(json.dumps(results))
+
+if __name__ == "__main__":
+    main()
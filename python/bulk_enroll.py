@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+import os
+import re
+import sys
+import json
+import time
+import hashlib
+import logging
+import tarfile
+import argparse
+import itertools
+import functools
+import numpy as np
+from schema import ensure_schema
+from worker_pool import WORKER_MODE, WORKERS, WorkerPool
+from config import data_path
+import face_recognition_service as service
+
+logger = logging.getLogger("bulk_enroll")
+
+# Images per duplicate check and COPY; the checkpoint advances after each
+ENROLL_BATCH_SIZE = int(os.getenv("FACE_ENROLL_BATCH_SIZE", "500"))
+
+# Duplicate policy for imports. Merging folds a repeated image of a person
+# into their earlier row, which is what makes a repeated batch harmless
+ENROLL_DUPLICATE_POLICY = os.getenv("FACE_ENROLL_DUPLICATE_POLICY", "merge")
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+
+# "alice_02.jpg" -> "alice"
+_SAMPLE_SUFFIX = re.compile(r"[_\-\s]*\d+$")
+
+def label_for(path):
+    """Person name for an image: its folder, or its file name at the top level.
+
+    Underscores become spaces, so "George_W_Bush/0001.jpg" is "George W Bush".
+    """
+    folder, filename = os.path.split(os.path.normpath(path))
+    label = os.path.basename(folder) if folder else _SAMPLE_SUFFIX.sub("", os.path.splitext(filename)[0])
+    return label.replace("_", " ").strip()
+
+def is_image(path):
+    return os.path.splitext(path)[1].lower() in IMAGE_EXTENSIONS
+
+def iter_images(source, skip=0):
+    """Yield (path, name, image bytes) for every image in a directory or tarball.
+
+    Images are read one at a time, in a fixed order, so a checkpoint can
+    refer to them by position. The first ``skip`` images are passed over
+    without reading their contents.
+    """
+    position = 0
+    if os.path.isdir(source):
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            for filename in sorted(files):
+                full_path = os.path.join(root, filename)
+                path = os.path.relpath(full_path, source)
+                if is_image(path):
+                    position += 1
+                    if position > skip:
+                        with open(full_path, "rb") as f:
+                            yield path, label_for(path), f.read()
+        return
+
+    with tarfile.open(source, "r:*") as archive:
+        for member in archive:
+            if member.isfile() and is_image(member.name):
+                position += 1
+                if position > skip:
+                    yield member.name, label_for(member.name), archive.extractfile(member).read()
+
+def encode_item(item, detector=None):
+    """Encode one image on a worker; returns (path, name, encoding or None, error)."""
+    path, name, data = item
+    try:
+        return path, name, service.encode_registration(data, detector), None
+    except Exception as e:
+        return path, name, None, str(e)
+
+def checkpoint_path(source):
+    """Default checkpoint file for a source, kept under the data directory."""
+    digest = hashlib.sha1(os.path.abspath(source).encode("utf-8")).hexdigest()[:12]
+    return data_path("bulk_enroll", f"{digest}.json")
+
+def load_checkpoint(path, source):
+    try:
+        with open(path) as f:
+            checkpoint = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return checkpoint if checkpoint.get("source") == os.path.abspath(source) else None
+
+def save_checkpoint(path, checkpoint):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, path)
+
+def enroll(source, checkpoint_file=None, batch_size=ENROLL_BATCH_SIZE, workers=WORKERS, mode=WORKER_MODE,
+           detector=None, policy=ENROLL_DUPLICATE_POLICY, restart=False):
+    """Register every labelled image under ``source``, resuming from its checkpoint.
+
+    Images are detected and encoded on the worker pool. Each batch is then
+    deduplicated and stored in one go (see register_encodings), and the
+    checkpoint records how many source images are done. A run that dies
+    between a batch's COPY and its checkpoint repeats that batch when
+    resumed; with the merge policy the repeats are folded into the rows
+    they repeat. The reject policy only refuses faces already registered
+    under another name, so it would store them again.
+    """
+    checkpoint_file = checkpoint_file or checkpoint_path(source)
+    checkpoint = None if restart else load_checkpoint(checkpoint_file, source)
+    if checkpoint is None:
+        checkpoint = {
+            "source": os.path.abspath(source),
+            "done": 0,
+            "counts": {"registered": 0, "merged": 0, "duplicate": 0, "no-face": 0, "failed": 0},
+        }
+    elif checkpoint["done"]:
+        logger.info(f"Resuming after {checkpoint['done']} images (checkpoint {checkpoint_file})")
+
+    service.load_gallery_snapshot()
+    service.gallery.refresh(force=True)
+    images = iter_images(source, checkpoint["done"])
+    encode = functools.partial(encode_item, detector=detector)
+    enroll_pool = WorkerPool(workers, mode, initializer=service._init_worker,
+                             initargs=([detector] if detector else None, workers, mode, False))
+
+    counts = checkpoint["counts"]
+    # Images read, and faces registered or merged, by this run
+    processed = enrolled = 0
+    started = time.monotonic()
+    try:
+        results = enroll_pool.map(encode, images)
+        while True:
+            batch = list(itertools.islice(results, batch_size))
+            if not batch:
+                break
+
+            encoded = [(name, encoding) for _, name, encoding, error in batch if encoding is not None]
+            for path, name, encoding, error in batch:
+                if error is not None:
+                    counts["failed"] += 1
+                    logger.warning(f"Skipping {path}: {error}")
+                elif encoding is None:
+                    counts["no-face"] += 1
+                    logger.info(f"Skipping {path}: no face detected")
+
+            if encoded:
+                names = [name for name, _ in encoded]
+                encodings = np.stack([encoding for _, encoding in encoded])
+                for result in service.register_encodings(names, encodings, policy):
+                    if result["success"]:
+                        counts["merged" if result.get("merged") else "registered"] += 1
+                        enrolled += 1
+                    else:
+                        counts[result["reason"]] += 1
+
+            checkpoint["done"] += len(batch)
+            save_checkpoint(checkpoint_file, checkpoint)
+
+            processed += len(batch)
+            elapsed = time.monotonic() - started
+            logger.info(
+                f"Enrolled {checkpoint['done']} images ({processed / elapsed:.1f} images/s, "
+                f"{enrolled / elapsed:.1f} faces/s this run): "
+                f"{json.dumps(counts)}"
+            )
+    finally:
+        enroll_pool.shutdown()
+
+    elapsed = time.monotonic() - started
+    return {
+        "source": source,
+        "checkpoint": checkpoint_file,
+        "images": checkpoint["done"],
+        "processed_this_run": processed,
+        "enrolled_this_run": enrolled,
+        "seconds": elapsed,
+        "images_per_second": processed / elapsed if elapsed else 0.0,
+        "faces_per_second": enrolled / elapsed if elapsed else 0.0,
+        "counts": counts,
+        "stages": enroll_pool.stats()["stages"],
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Register a directory or tarball of labelled face images')
+    parser.add_argument('source', help='Directory (one folder per person) or tar archive of images')
+    parser.add_argument('--checkpoint', metavar='PATH', help='Checkpoint file (default: under the data directory)')
+    parser.add_argument('--restart', action='store_true', help='Ignore any checkpoint and start from the first image')
+    parser.add_argument('--batch-size', type=int, default=ENROLL_BATCH_SIZE, help='Images stored per COPY')
+    parser.add_argument('--workers', type=int, default=WORKERS, help='Images encoded concurrently')
+    parser.add_argument('--worker-mode', choices=['thread', 'process'], default=WORKER_MODE,
+                        help='Encode on threads or processes')
+    parser.add_argument('--detector', metavar='NAME', help='Face detector to use')
+    parser.add_argument('--duplicate-policy', choices=['reject', 'merge', 'allow'], default=ENROLL_DUPLICATE_POLICY,
+                        help='What to do with near-duplicate faces (FACE_ENROLL_DUPLICATE_POLICY)')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.source):
+        print(json.dumps({"error": f"No such file or directory: {args.source}"}))
+        sys.exit(1)
+
+    ensure_schema()
+    result = enroll(args.source, args.checkpoint, args.batch_size, args.workers, args.worker_mode,
+                    args.detector, args.duplicate_policy, args.restart)
+    print(json.dumps(result))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,13 @@
+#!/usr/bin/env python3
+import os
+
+# Directory for on-disk indexes, caches and snapshots
+DATA_DIR = os.getenv(
+    "FACETRACE_DATA_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+)
+
+def data_path(*parts):
+    """Return a path inside DATA_DIR, creating the directory if needed."""
+    os.makedirs(DATA_DIR, exist_ok=True)
+    return os.path.join(DATA_DIR, *parts)
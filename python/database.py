@@ -1,9 +1,17 @@
 #!/usr/bin/env python3
+import io
 import os
+import json
+import base64
 import logging
 import psycopg2
 import psycopg2.extras
-import numpy as np
+from db_pool import db_connection
+from schema import migrate
+
+# face_features and encoding_format pull in OpenCV and numpy, so they are
+# imported inside the functions that use them; the keyword assistant only
+# needs the listing helpers here
 
 # Configure logging
 logging.basicConfig(
@@ -12,69 +20,33 @@ logging.basicConfig(
 )
 logger = logging.getLogger("database")
 
-# Database connection parameters from environment variables
-db_params = {
-    "host": os.getenv("PGHOST", "localhost"),
-    "database": os.getenv("PGDATABASE", "postgres"),
-    "user": os.getenv("PGUSER", "postgres"),
-    "password": os.getenv("PGPASSWORD", "lakshman&66"),
-    "port": os.getenv("PGPORT", "5432")
-}
-
-def get_db_connection():
-    """Establish a database connection."""
-    try:
-        conn = psycopg2.connect(**db_params)
-        return conn
-    except Exception as e:
-        logger.error(f"Database connection error: {e}")
-        raise
+# Rows per page of the registered faces listing, and the most a caller may ask for
+FACES_PAGE_SIZE = int(os.getenv("FACES_PAGE_SIZE", "100"))
+FACES_MAX_PAGE_SIZE = int(os.getenv("FACES_MAX_PAGE_SIZE", "1000"))
+
+# Rows fetched per round trip when streaming the whole listing
+FACES_STREAM_CHUNK = int(os.getenv("FACES_STREAM_CHUNK", "500"))
 
 def initialize_database():
     """Create necessary tables if they don't exist."""
-    try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        
-        # Create faces table
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS faces (
-                id SERIAL PRIMARY KEY,
-                name VARCHAR(255) NOT NULL,
-                encoding BYTEA NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        
-        conn.commit()
-        cur.close()
-        conn.close()
-        logger.info("Database initialized successfully")
-    except Exception as e:
-        logger.error(f"Database initialization error: {e}")
-        raise
+    return migrate()
 
 def store_face_encoding(name, encoding):
     """Store face encoding in database."""
+    from face_features import get_extractor
+    from encoding_format import encode_encodings
+    
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        
-        # Convert numpy array to bytes for storage
-        encoding_bytes = encoding.tobytes()
+        # Serialize the vector in the stored encoding format
+        encoding_bytes = encode_encodings(get_extractor(), encoding)[0]
         
-        # Insert into database
-        cur.execute(
-            "INSERT INTO faces (name, encoding) VALUES (%s, %s) RETURNING id, created_at",
-            (name, psycopg2.Binary(encoding_bytes))
-        )
-        
-        result = cur.fetchone()
-        face_id, created_at = result
-        
-        conn.commit()
-        cur.close()
-        conn.close()
+        with db_connection() as conn, conn.cursor() as cur:
+            # Insert into database
+            cur.execute(
+                "INSERT INTO faces (name, encoding) VALUES (%s, %s) RETURNING id, created_at",
+                (name, psycopg2.Binary(encoding_bytes))
+            )
+            face_id, created_at = cur.fetchone()
         
         logger.info(f"Face encoding stored: {name} (ID: {face_id})")
         
@@ -87,75 +59,178 @@ def store_face_encoding(name, encoding):
         logger.error(f"Error storing face encoding: {e}")
         raise
 
+def _copy_text(value):
+    """Escape a value for PostgreSQL's COPY text format."""
+    return (value.replace("\\", "\\\\").replace("\t", "\\t")
+                 .replace("\n", "\\n").replace("\r", "\\r"))
+
+def store_face_encodings(names, encodings):
+    """Store many face encodings in one transaction; returns (id, created_at) per face.
+    
+    ``encodings`` are written as given, so they should already be in the
+    stored format (see encoding_format.encode_encodings). Ids are reserved
+    from the table's sequence up front and the rows are streamed in with
+    COPY FROM STDIN, which costs one round trip for the whole batch yet
+    still tells the caller each face's id.
+    """
+    if len(names) == 0:
+        return []
+    
+    try:
+        with db_connection() as conn, conn.cursor() as cur:
+            cur.execute(
+                "SELECT nextval(pg_get_serial_sequence('faces', 'id')) FROM generate_series(1, %s)",
+                (len(names),)
+            )
+            face_ids = [row[0] for row in cur.fetchall()]
+            # created_at defaults to the transaction's start time
+            cur.execute("SELECT CURRENT_TIMESTAMP::timestamp")
+            created_at = cur.fetchone()[0]
+            
+            data = io.StringIO()
+            for face_id, name, encoding in zip(face_ids, names, encodings):
+                encoding_bytes = encoding if isinstance(encoding, bytes) else encoding.tobytes()
+                data.write(f"{face_id}\t{_copy_text(name)}\t\\\\x{encoding_bytes.hex()}\n")
+            data.seek(0)
+            cur.copy_expert("COPY faces (id, name, encoding) FROM STDIN", data)
+        
+        logger.info(f"Face encodings stored: {len(face_ids)} faces (IDs {face_ids[0]}-{face_ids[-1]})")
+        return [(face_id, created_at) for face_id in face_ids]
+    except Exception as e:
+        logger.error(f"Error storing face encodings: {e}")
+        raise
+
 def get_face_encodings():
     """Retrieve all face encodings from the database."""
+    from face_features import get_extractor
+    from encoding_format import decode_encoding
+    
     try:
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        
-        cur.execute("SELECT id, name, encoding FROM faces")
-        face_data = cur.fetchall()
+        with db_connection() as conn, conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
+            cur.execute("SELECT id, name, encoding FROM faces")
+            face_data = cur.fetchall()
         
+        extractor = get_extractor()
         faces = []
         for face in face_data:
             # Convert bytes to numpy array
-            encoding = np.frombuffer(face['encoding'], dtype=np.float64)
+            encoding = decode_encoding(face['encoding'], extractor)
             faces.append({
                 'id': face['id'],
                 'name': face['name'],
                 'encoding': encoding
             })
         
-        cur.close()
-        conn.close()
-        
         return faces
     except Exception as e:
         logger.error(f"Error retrieving face encodings: {e}")
         raise
 
 def get_registered_faces():
-    """Get all registered faces (metadata only)."""
+    """Get all registered faces (metadata only), newest first."""
+    return [face for chunk in iter_registered_faces() for face in chunk]
+
+def encode_faces_cursor(created_at, face_id):
+    """Opaque cursor pointing just past a face in the newest-first listing.
+    
+    ``created_at`` may be a datetime or PostgreSQL's text form of one; the
+    backend builds the same cursors, so pages can be fetched from either.
+    """
+    if not isinstance(created_at, str):
+        created_at = created_at.isoformat()
+    encoded = base64.urlsafe_b64encode(json.dumps([created_at, face_id]).encode("utf-8"))
+    return encoded.decode("ascii").rstrip("=")
+
+def decode_faces_cursor(cursor):
+    """(created_at, id) from a cursor; raises ValueError if it is malformed."""
     try:
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        
-        cur.execute("""
-            SELECT id, name, created_at 
-            FROM faces 
-            ORDER BY created_at DESC
-        """)
-        
-        faces = [dict(face) for face in cur.fetchall()]
-        
-        cur.close()
-        conn.close()
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, face_id = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except (TypeError, ValueError, UnicodeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor!r}") from e
+    if not isinstance(created_at, str) or not isinstance(face_id, int):
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+    return created_at, face_id
+
+def _face_row(face):
+    face = dict(face)
+    face['created_at'] = face['created_at'].isoformat()
+    return face
+
+def get_registered_faces_page(limit=FACES_PAGE_SIZE, cursor=None):
+    """One page of registered faces, newest first, and the cursor of the next.
+    
+    Pages are keyed on (created_at, id) rather than offsets, so each is an
+    index range scan however deep it is, and faces registered while paging
+    never shift rows between pages. ``next_cursor`` is None on the last page.
+    """
+    limit = max(1, min(int(limit), FACES_MAX_PAGE_SIZE))
+    try:
+        with db_connection() as conn, conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
+            if cursor is None:
+                cur.execute("""
+                    SELECT id, name, created_at
+                    FROM faces
+                    ORDER BY created_at DESC, id DESC
+                    LIMIT %s
+                """, (limit + 1,))
+            else:
+                created_at, face_id = decode_faces_cursor(cursor)
+                cur.execute("""
+                    SELECT id, name, created_at
+                    FROM faces
+                    WHERE (created_at, id) < (%s::timestamp, %s)
+                    ORDER BY created_at DESC, id DESC
+                    LIMIT %s
+                """, (created_at, face_id, limit + 1))
+            rows = cur.fetchall()
         
-        # Convert datetime to string for JSON serialization
-        for face in faces:
-            face['created_at'] = face['created_at'].isoformat()
+        # The extra row only tells whether another page follows
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_faces_cursor(rows[-1]['created_at'], rows[-1]['id'])
         
-        return faces
+        return {"faces": [_face_row(face) for face in rows], "next_cursor": next_cursor}
     except Exception as e:
         logger.error(f"Error retrieving registered faces: {e}")
         raise
 
+def iter_registered_faces(chunk_size=FACES_STREAM_CHUNK):
+    """Yield every registered face, newest first, in lists of ``chunk_size``.
+    
+    Rows come through a server-side cursor, so only one chunk is held in
+    memory at a time. The connection stays checked out until the
+    generator is exhausted or closed.
+    """
+    try:
+        with db_connection() as conn, conn.cursor(name="registered_faces",
+                                                  cursor_factory=psycopg2.extras.DictCursor) as cur:
+            cur.itersize = chunk_size
+            cur.execute("""
+                SELECT id, name, created_at
+                FROM faces
+                ORDER BY created_at DESC, id DESC
+            """)
+            while True:
+                rows = cur.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield [_face_row(face) for face in rows]
+    except Exception as e:
+        logger.error(f"Error streaming registered faces: {e}")
+        raise
+
 def get_face_by_id(face_id):
     """Get face by ID."""
     try:
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        
-        cur.execute("""
-            SELECT id, name, created_at 
-            FROM faces 
-            WHERE id = %s
-        """, (face_id,))
-        
-        face = cur.fetchone()
-        
-        cur.close()
-        conn.close()
+        with db_connection() as conn, conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
+            cur.execute("""
+                SELECT id, name, created_at 
+                FROM faces 
+                WHERE id = %s
+            """, (face_id,))
+            face = cur.fetchone()
         
         if face:
             # Convert to dict and format datetime
@@ -171,20 +246,14 @@ def get_face_by_id(face_id):
 def get_last_registered_face():
     """Get the last registered face."""
     try:
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        
-        cur.execute("""
-            SELECT id, name, created_at 
-            FROM faces 
-            ORDER BY created_at DESC 
-            LIMIT 1
-        """)
-        
-        face = cur.fetchone()
-        
-        cur.close()
-        conn.close()
+        with db_connection() as conn, conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
+            cur.execute("""
+                SELECT id, name, created_at 
+                FROM faces 
+                ORDER BY created_at DESC 
+                LIMIT 1
+            """)
+            face = cur.fetchone()
         
         if face:
             # Convert to dict and format datetime
@@ -200,19 +269,11 @@ def get_last_registered_face():
 def get_face_count():
     """Get the total number of registered faces."""
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        
-        cur.execute("SELECT COUNT(*) FROM faces")
-        count = cur.fetchone()[0]
-        
-        cur.close()
-        conn.close()
+        with db_connection() as conn, conn.cursor() as cur:
+            cur.execute("SELECT COUNT(*) FROM faces")
+            count = cur.fetchone()[0]
         
         return count
     except Exception as e:
         logger.error(f"Error counting faces: {e}")
         raise
-
-# Initialize database when module is loaded
-initialize_database()
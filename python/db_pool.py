@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
+
+logger = logging.getLogger("db_pool")
+
+# Database connection parameters from environment variables
+db_params = {
+    "host": os.getenv("PGHOST", "localhost"),
+    "database": os.getenv("PGDATABASE", "postgres"),
+    "user": os.getenv("PGUSER", "postgres"),
+    "password": os.getenv("PGPASSWORD", "lakshman&66"),
+    "port": os.getenv("PGPORT", "5432")
+}
+
+# Pool size, and how long a caller may wait for a free connection (seconds)
+POOL_MIN = int(os.getenv("PGPOOL_MIN", "1"))
+POOL_MAX = int(os.getenv("PGPOOL_MAX", "10"))
+POOL_TIMEOUT = float(os.getenv("PGPOOL_TIMEOUT", "30"))
+
+# Connections idle for longer than this are pinged before being handed out
+HEALTH_CHECK_INTERVAL = float(os.getenv("PGPOOL_HEALTH_CHECK_INTERVAL", "30"))
+
+class PoolTimeout(Exception):
+    """No connection became free within the pool timeout."""
+
+class ConnectionPool:
+    """A ThreadedConnectionPool that waits for free connections.
+
+    psycopg2's pool raises as soon as it is exhausted; this wrapper blocks
+    (up to ``timeout``) instead, health-checks connections that have been
+    idle, and records how long callers waited.
+    """
+
+    def __init__(self, minconn=POOL_MIN, maxconn=POOL_MAX, timeout=POOL_TIMEOUT,
+                 health_check_interval=HEALTH_CHECK_INTERVAL, **params):
+        self._pool = psycopg2.pool.ThreadedConnectionPool(minconn, maxconn, **params)
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._lock = threading.Lock()
+        self._last_used = {}
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self._stats = {
+            "checkouts": 0,
+            "in_use": 0,
+            "timeouts": 0,
+            "health_check_failures": 0,
+            "total_wait_seconds": 0.0,
+            "max_wait_seconds": 0.0,
+        }
+
+    def _is_healthy(self, conn):
+        if conn.closed:
+            return False
+
+        last_used = self._last_used.get(id(conn))
+        if last_used is not None and time.monotonic() - last_used < self.health_check_interval:
+            return True
+
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self):
+        """Check out a connection, waiting for one to be returned if needed."""
+        started = time.monotonic()
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self._stats["timeouts"] += 1
+            raise PoolTimeout(f"No database connection available after {self.timeout}s")
+
+        try:
+            conn = self._pool.getconn()
+            if not self._is_healthy(conn):
+                logger.warning("Discarding unhealthy database connection")
+                with self._lock:
+                    self._stats["health_check_failures"] += 1
+                self._last_used.pop(id(conn), None)
+                self._pool.putconn(conn, close=True)
+                conn = self._pool.getconn()
+        except Exception:
+            self._slots.release()
+            raise
+
+        waited = time.monotonic() - started
+        with self._lock:
+            self._stats["checkouts"] += 1
+            self._stats["in_use"] += 1
+            self._stats["total_wait_seconds"] += waited
+            self._stats["max_wait_seconds"] = max(self._stats["max_wait_seconds"], waited)
+        return conn
+
+    def putconn(self, conn):
+        """Return a connection, closing it if it is broken."""
+        close = conn.closed != 0
+        if not close:
+            status = conn.info.transaction_status
+            if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+                close = True
+            elif status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+
+        if close:
+            self._last_used.pop(id(conn), None)
+        else:
+            self._last_used[id(conn)] = time.monotonic()
+
+        try:
+            self._pool.putconn(conn, close=close)
+        finally:
+            with self._lock:
+                self._stats["in_use"] -= 1
+            self._slots.release()
+
+    def stats(self):
+        """Pool usage and wait-time metrics."""
+        with self._lock:
+            stats = dict(self._stats)
+        stats["min_size"] = self.minconn
+        stats["max_size"] = self.maxconn
+        stats["avg_wait_seconds"] = (
+            stats["total_wait_seconds"] / stats["checkouts"] if stats["checkouts"] else 0.0
+        )
+        return stats
+
+    def closeall(self):
+        self._pool.closeall()
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """Return the process-wide pool, creating it on first use.
+
+    Connections can't be shared across fork(), so a child process gets a
+    fresh pool of its own.
+    """
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                try:
+                    _pool = ConnectionPool(**db_params)
+                    _pool_pid = os.getpid()
+                except Exception as e:
+                    logger.error(f"Database connection error: {e}")
+                    raise
+    return _pool
+
+@contextmanager
+def db_connection():
+    """Borrow a pooled connection; commit on success, roll back on error."""
+    pool = get_pool()
+    conn = pool.getconn()
+    try:
+        yield conn
+        if not conn.closed:
+            conn.commit()
+    except Exception:
+        if not conn.closed:
+            conn.rollback()
+        raise
+    finally:
+        pool.putconn(conn)
+
+def pool_stats():
+    """Metrics for the current process's pool (empty if none was created)."""
+    return _pool.stats() if _pool is not None and _pool_pid == os.getpid() else {}
+
+def close_pool():
+    """Close every pooled connection, e.g. before a worker exits."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
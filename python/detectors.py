@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+import os
+import json
+import logging
+import threading
+import numpy as np
+import cv2
+
+logger = logging.getLogger("detectors")
+
+# Detector used when callers don't ask for a specific one
+DEFAULT_DETECTOR = os.getenv("FACE_DETECTOR", "haar_frontalface_default")
+
+# Frames wider than this are downscaled before detection (0 = never)
+DETECT_WIDTH = int(os.getenv("FACE_DETECT_WIDTH", "320"))
+
+# Detection settings per operation. Face sizes are in full-resolution
+# pixels (max_size 0 = no limit); detect_width overrides DETECT_WIDTH.
+DETECTION_PROFILES = {
+    "check": {"scale_factor": 1.05, "min_neighbors": 2, "min_size": 30, "max_size": 0},
+    "register": {"scale_factor": 1.1, "min_neighbors": 4, "min_size": 60, "max_size": 0},
+    "recognize": {"scale_factor": 1.1, "min_neighbors": 4, "min_size": 40, "max_size": 0},
+}
+
+# JSON overrides merged into the profiles, e.g. '{"recognize": {"detect_width": 480}}'
+for _operation, _overrides in json.loads(os.getenv("FACE_DETECTION_PROFILES", "{}")).items():
+    DETECTION_PROFILES.setdefault(_operation, {}).update(_overrides)
+
+# Smallest window the bundled Haar cascades can detect
+CASCADE_WINDOW = 24
+
+def _haar_cascade(filename):
+    """Build a factory that loads one of OpenCV's bundled Haar cascades."""
+    path = os.path.join(cv2.data.haarcascades, filename)
+
+    def load():
+        classifier = cv2.CascadeClassifier(path)
+        if classifier.empty():
+            raise ValueError(f"Failed to load cascade: {path}")
+        return classifier
+
+    return load
+
+# Registered detector factories, keyed by name
+DETECTOR_FACTORIES = {
+    "haar_frontalface_default": _haar_cascade("haarcascade_frontalface_default.xml"),
+    "haar_frontalface_alt": _haar_cascade("haarcascade_frontalface_alt.xml"),
+    "haar_frontalface_alt2": _haar_cascade("haarcascade_frontalface_alt2.xml"),
+    "haar_profileface": _haar_cascade("haarcascade_profileface.xml"),
+}
+
+class Detector:
+    """A named face detector that can be shared across threads.
+
+    OpenCV's cascade classifiers keep scratch state inside each instance, so
+    concurrent ``detectMultiScale`` calls on one object are unsafe. The
+    detector keeps a free list of loaded instances: each call borrows one, and
+    a new instance is only loaded when every existing one is busy. Once the
+    process has seen its peak concurrency, no call loads a model again.
+    """
+
+    def __init__(self, name, factory):
+        self.name = name
+        self._factory = factory
+        self._idle = []
+        self._lock = threading.Lock()
+        self.instances = 0
+
+    def _acquire(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+            self.instances += 1
+
+        logger.info(f"Loading detector '{self.name}' (instance {self.instances})")
+        try:
+            return self._factory()
+        except Exception:
+            with self._lock:
+                self.instances -= 1
+            raise
+
+    def _release(self, instance):
+        with self._lock:
+            self._idle.append(instance)
+
+    def load(self, count=1):
+        """Make sure at least ``count`` instances are loaded and idle."""
+        borrowed = [self._acquire() for _ in range(count)]
+        for instance in borrowed:
+            self._release(instance)
+        return self
+
+    def detect(self, gray, scale_factor=1.1, min_neighbors=4, **kwargs):
+        """Run detection on a grayscale image and return (x, y, w, h) boxes."""
+        instance = self._acquire()
+        try:
+            return instance.detectMultiScale(gray, scale_factor, min_neighbors, **kwargs)
+        finally:
+            self._release(instance)
+
+_detectors = {}
+_detectors_lock = threading.Lock()
+
+def register_detector(name, factory):
+    """Register a detector factory under a name (e.g. a cv2.dnn model loader)."""
+    with _detectors_lock:
+        DETECTOR_FACTORIES[name] = factory
+        _detectors.pop(name, None)
+
+def get_detector(name=None):
+    """Return the shared detector registered under the given name."""
+    name = name or DEFAULT_DETECTOR
+
+    detector = _detectors.get(name)
+    if detector is None:
+        with _detectors_lock:
+            detector = _detectors.get(name)
+            if detector is None:
+                if name not in DETECTOR_FACTORIES:
+                    raise ValueError(f"Unknown face detector: {name}")
+                detector = Detector(name, DETECTOR_FACTORIES[name])
+                _detectors[name] = detector
+
+    return detector
+
+def preload_detectors(names=None, count=1):
+    """Load detectors up front so the first request doesn't pay for it."""
+    for name in names or [DEFAULT_DETECTOR]:
+        get_detector(name).load(count)
+
+_buffers = threading.local()
+
+def _buffer(name, shape):
+    """A per-thread scratch array, reallocated only when the shape changes."""
+    buffers = getattr(_buffers, "arrays", None)
+    if buffers is None:
+        buffers = _buffers.arrays = {}
+    buffer = buffers.get(name)
+    if buffer is None or buffer.shape != shape:
+        buffer = buffers[name] = np.empty(shape, dtype=np.uint8)
+    return buffer
+
+def to_grayscale(image, code=cv2.COLOR_RGB2GRAY):
+    """Convert a colour image to grayscale in a reused per-thread buffer.
+    
+    The result is only valid until the same thread converts another image.
+    """
+    if image.ndim == 2:
+        return image
+    return cv2.cvtColor(image, code, dst=_buffer("gray", image.shape[:2]))
+
+def detection_width(operation="recognize"):
+    """Width the operation's frames are downscaled to for detection (0 = none)."""
+    return DETECTION_PROFILES[operation].get("detect_width", DETECT_WIDTH)
+
+def detect_faces(gray, operation="recognize", detector=None, full_size=None, **overrides):
+    """Detect faces on a downscaled copy of a grayscale frame.
+    
+    Uses the operation's profile from DETECTION_PROFILES (keyword arguments
+    override it) and returns an (n, 4) int array of (x, y, w, h) boxes in
+    full-resolution coordinates. If ``gray`` was decoded at a reduced
+    resolution, ``full_size`` gives the original (width, height).
+    """
+    profile = dict(DETECTION_PROFILES[operation], **overrides)
+    detect_width = profile.get("detect_width", DETECT_WIDTH)
+    
+    height, width = gray.shape
+    scale = detect_width / width if detect_width and width > detect_width else 1.0
+    
+    if scale < 1.0:
+        small_shape = (max(1, round(height * scale)), detect_width)
+        small = cv2.resize(gray, (small_shape[1], small_shape[0]),
+                           dst=_buffer("small", small_shape), interpolation=cv2.INTER_AREA)
+    else:
+        small = gray
+    
+    # Face sizes and output boxes are relative to the full-resolution frame
+    if full_size is not None:
+        scale *= width / full_size[0]
+        width, height = full_size
+    
+    kwargs = {}
+    min_size = max(CASCADE_WINDOW, round(profile.get("min_size", 0) * scale))
+    kwargs["minSize"] = (min_size, min_size)
+    if profile.get("max_size"):
+        max_size = max(min_size, round(profile["max_size"] * scale))
+        kwargs["maxSize"] = (max_size, max_size)
+    
+    boxes = get_detector(detector).detect(
+        small, profile["scale_factor"], profile["min_neighbors"], **kwargs
+    )
+    if len(boxes) == 0:
+        return np.empty((0, 4), dtype=np.int32)
+    
+    boxes = np.round(np.asarray(boxes, dtype=np.float64) / scale).astype(np.int32)
+    
+    # Keep rescaled boxes inside the frame
+    np.clip(boxes[:, 0], 0, width - 1, out=boxes[:, 0])
+    np.clip(boxes[:, 1], 0, height - 1, out=boxes[:, 1])
+    boxes[:, 2] = np.minimum(boxes[:, 2], width - boxes[:, 0])
+    boxes[:, 3] = np.minimum(boxes[:, 3], height - boxes[:, 1])
+    return boxes
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+import numpy as np
+from config import data_path
+
+logger = logging.getLogger("embedding_cache")
+
+# Where cached embeddings live (one vector file and index per model)
+CACHE_DIR = os.getenv("RAG_EMBEDDING_CACHE_DIR", "") or data_path("embedding_cache")
+
+# Most vectors kept per model; the least recently used are evicted beyond it
+CACHE_SIZE = int(os.getenv("RAG_EMBEDDING_CACHE_SIZE", "50000"))
+
+def content_key(model_id, text):
+    """Cache key for a text embedded by a given model."""
+    return hashlib.sha256(f"{model_id}\0{text}".encode("utf-8")).hexdigest()
+
+class EmbeddingCache:
+    """Content-addressed embedding vectors on disk.
+
+    Vectors sit in fixed slots of a memory-mapped float32 file, so reading
+    a hit costs no parsing; a small sqlite table maps each content key to
+    its slot and last use. When every slot is taken, the least recently
+    used entries are evicted and their slots reused.
+    """
+
+    def __init__(self, model_id, capacity=CACHE_SIZE, directory=CACHE_DIR):
+        self.model_id = model_id
+        self.capacity = capacity
+        name = re.sub(r"[^A-Za-z0-9_.-]+", "_", model_id)
+        os.makedirs(directory, exist_ok=True)
+        self.vectors_path = os.path.join(directory, f"{name}.f32")
+        self._db = sqlite3.connect(os.path.join(directory, f"{name}.sqlite"), timeout=30, check_same_thread=False)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                slot INTEGER NOT NULL UNIQUE,
+                last_used REAL NOT NULL
+            )
+        """)
+        self._db.execute("CREATE TABLE IF NOT EXISTS settings (name TEXT PRIMARY KEY, value INTEGER)")
+        self._db.commit()
+        self._lock = threading.Lock()
+        self._vectors = None
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def _open_vectors(self, dimension):
+        if self._vectors is not None:
+            return self._vectors
+
+        row = self._db.execute("SELECT value FROM settings WHERE name = 'dimension'").fetchone()
+        if row is not None and row[0] != dimension:
+            # The model's output size changed; nothing cached is usable
+            logger.warning(f"Embedding cache dimension changed ({row[0]} -> {dimension}); clearing it")
+            self._db.execute("DELETE FROM entries")
+            row = None
+        if row is None:
+            self._db.execute("INSERT OR REPLACE INTO settings VALUES ('dimension', ?)", (dimension,))
+            self._db.commit()
+
+        # Size the (sparse) vector file for the configured capacity
+        size = self.capacity * dimension * np.dtype(np.float32).itemsize
+        with open(self.vectors_path, "ab"):
+            pass
+        if os.path.getsize(self.vectors_path) != size:
+            os.truncate(self.vectors_path, size)
+            self._db.execute("DELETE FROM entries WHERE slot >= ?", (self.capacity,))
+            self._db.commit()
+
+        self._vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r+",
+                                  shape=(self.capacity, dimension))
+        return self._vectors
+
+    def _slots(self, cursor, keys):
+        """Slot of every cached key among ``keys``."""
+        slots = {}
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            slots.update(cursor.execute(
+                f"SELECT key, slot FROM entries WHERE key IN ({','.join('?' * len(chunk))})", chunk
+            ).fetchall())
+        return slots
+
+    def _dimension(self):
+        row = self._db.execute("SELECT value FROM settings WHERE name = 'dimension'").fetchone()
+        return row[0] if row else None
+
+    def get_many(self, texts):
+        """Cached vectors for each text (None where missing); counts hits and misses."""
+        keys = [content_key(self.model_id, text) for text in texts]
+        results = [None] * len(texts)
+
+        with self._lock:
+            dimension = self._dimension()
+            slots = self._slots(self._db, keys) if dimension is not None and keys else {}
+
+            if slots:
+                vectors = self._open_vectors(dimension)
+                for position, key in enumerate(keys):
+                    slot = slots.get(key)
+                    if slot is not None:
+                        results[position] = np.array(vectors[slot])
+
+                now = time.time()
+                self._db.executemany("UPDATE entries SET last_used = ? WHERE key = ?",
+                                     [(now, key) for key in slots])
+                self._db.commit()
+
+            hits = len([result for result in results if result is not None])
+            self.stats["hits"] += hits
+            self.stats["misses"] += len(texts) - hits
+        return results
+
+    def put_many(self, texts, vectors):
+        """Store freshly computed vectors, evicting the least recently used if full."""
+        if not texts:
+            return
+        vectors = np.asarray(vectors, dtype=np.float32)
+        keys = [content_key(self.model_id, text) for text in texts]
+
+        with self._lock:
+            storage = self._open_vectors(vectors.shape[1])
+            cursor = self._db.cursor()
+            # Serializes slot allocation with other processes sharing the cache
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                existing = self._slots(cursor, keys)
+                new_keys = [key for key in dict.fromkeys(keys) if key not in existing]
+
+                used = cursor.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+                free_slots = []
+                if used < self.capacity:
+                    taken = {row[0] for row in cursor.execute("SELECT slot FROM entries")}
+                    free_slots = [slot for slot in range(self.capacity) if slot not in taken][:len(new_keys)]
+
+                shortfall = min(len(new_keys), self.capacity) - len(free_slots)
+                if shortfall > 0:
+                    # Never evict an entry this call is about to rewrite
+                    evicted = [
+                        (key, slot) for key, slot in cursor.execute(
+                            "SELECT key, slot FROM entries ORDER BY last_used LIMIT ?",
+                            (shortfall + len(existing),)
+                        )
+                        if key not in existing
+                    ][:shortfall]
+                    cursor.executemany("DELETE FROM entries WHERE key = ?", [(key,) for key, _ in evicted])
+                    free_slots += [slot for _, slot in evicted]
+                    self.stats["evictions"] += len(evicted)
+
+                slots = dict(existing)
+                slots.update(zip(new_keys, free_slots))
+
+                now = time.time()
+                rows = []
+                for key, vector in zip(keys, vectors):
+                    slot = slots.get(key)
+                    if slot is None:
+                        continue
+                    storage[slot] = vector
+                    rows.append((key, slot, now))
+                storage.flush()
+
+                cursor.executemany("INSERT OR REPLACE INTO entries (key, slot, last_used) VALUES (?, ?, ?)", rows)
+                cursor.execute("COMMIT")
+            except Exception:
+                cursor.execute("ROLLBACK")
+                raise
+
+    def __len__(self):
+        return self._db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
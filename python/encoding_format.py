@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+import os
+import struct
+from collections import namedtuple
+import numpy as np
+
+# Stored encodings start with a 16-byte little-endian header:
+#   magic "FTEN", format version, extractor code, dtype code, flags
+#   (bit 0: vector is L2-normalized), dimension (uint32) and the int8
+#   dequantization scale (float32, 1.0 for other dtypes)
+# followed by the vector itself. The first 12 bytes are the same for every
+# row of one extractor and storage dtype, so rows can be grouped by them.
+MAGIC = b"FTEN"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<4sBBBBIf")
+FORMAT_PREFIX_SIZE = 12
+
+FLAG_NORMALIZED = 1
+
+DTYPE_CODES = {"uint8": 0, "float32": 1, "float16": 2, "int8": 3}
+DTYPES = {code: np.dtype(name) for name, code in DTYPE_CODES.items()}
+
+EXTRACTOR_CODES = {"raw": 1, "pca": 2, "dnn": 3}
+
+# How new feature vectors are stored: float32, float16 or int8 (with a
+# per-vector scale). Raw pixel encodings are always stored as uint8.
+STORAGE_DTYPE = os.getenv("FACE_ENCODING_DTYPE", "float16")
+
+EncodingHeader = namedtuple("EncodingHeader", "version extractor dtype normalized dimension scale")
+
+def storage_dtype(extractor, dtype=None):
+    """Name of the dtype an extractor's vectors are stored as."""
+    if np.dtype(extractor.dtype) == np.uint8:
+        return "uint8"
+    dtype = dtype or STORAGE_DTYPE
+    if dtype not in ("float32", "float16", "int8"):
+        raise ValueError(f"Unknown encoding storage dtype: {dtype}")
+    return dtype
+
+def extractor_prefix(extractor):
+    """Leading bytes shared by every stored encoding of this extractor, whatever its dtype."""
+    return MAGIC + bytes([FORMAT_VERSION, EXTRACTOR_CODES[extractor.name]])
+
+def is_formatted(data):
+    return bytes(data[:len(MAGIC)]) == MAGIC
+
+def read_header(data):
+    magic, version, extractor, dtype, flags, dimension, scale = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("Encoding has no format header")
+    if version != FORMAT_VERSION:
+        raise ValueError(f"Unsupported encoding format version: {version}")
+    return EncodingHeader(version, extractor, DTYPES[dtype], bool(flags & FLAG_NORMALIZED), dimension, scale)
+
+def encode_encodings(extractor, vectors, dtype=None):
+    """Serialize a matrix of feature vectors, one bytes object per row."""
+    vectors = np.atleast_2d(np.asarray(vectors))
+    dtype = storage_dtype(extractor, dtype)
+    flags = FLAG_NORMALIZED if extractor.normalized else 0
+
+    if dtype == "int8":
+        # Symmetric per-vector quantization: x ~= q * scale, q in [-127, 127]
+        vectors = vectors.astype(np.float32)
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        stored = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    else:
+        scales = np.ones(len(vectors), dtype=np.float32)
+        stored = vectors.astype(dtype)
+
+    return [
+        HEADER.pack(MAGIC, FORMAT_VERSION, EXTRACTOR_CODES[extractor.name], DTYPE_CODES[dtype], flags,
+                    stored.shape[1], float(scale)) + row.tobytes()
+        for row, scale in zip(stored, scales)
+    ]
+
+def _dequantize(values, dtype, scales=None):
+    if dtype == np.int8:
+        return values.astype(np.float32) * scales[:, None]
+    if dtype == np.float16:
+        return values.astype(np.float32)
+    # float32 and uint8 are used as stored, without a copy
+    return values
+
+def decode_encoding(data, extractor):
+    """One stored encoding as a vector.
+
+    Rows written before the format existed have no header; they are read
+    as the extractor's own dtype, as they always were.
+    """
+    if not is_formatted(data):
+        return np.frombuffer(data, dtype=extractor.dtype)
+
+    header = read_header(data)
+    values = np.frombuffer(data, dtype=header.dtype, count=header.dimension, offset=HEADER.size)
+    return _dequantize(values[None, :], header.dtype, np.array([header.scale], dtype=np.float32))[0]
+
+def decode_matrix(prefix, scales, payload, count, extractor):
+    """Stack ``count`` encodings that share one format into a matrix.
+
+    ``prefix`` is their common first FORMAT_PREFIX_SIZE bytes (empty for
+    headerless legacy rows), ``scales`` their concatenated scale fields
+    and ``payload`` their concatenated vectors, as aggregated by the
+    database. float32 and uint8 payloads are viewed in place.
+    """
+    if not prefix:
+        return np.frombuffer(payload, dtype=extractor.dtype).reshape(count, -1)
+
+    header = read_header(bytes(prefix) + b"\0" * (HEADER.size - FORMAT_PREFIX_SIZE))
+    values = np.frombuffer(payload, dtype=header.dtype).reshape(count, header.dimension)
+    if header.dtype == np.int8:
+        return _dequantize(values, header.dtype, np.frombuffer(scales, dtype=np.float32))
+    return _dequantize(values, header.dtype)
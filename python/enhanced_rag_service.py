@@ -5,21 +5,18 @@ import json
 import logging
 import argparse
 import time
+import fcntl
+import shutil
+import threading
 from datetime import datetime
 import psycopg2
 import psycopg2.extras
-import cohere
-import faiss
-import numpy as np
-
-# LangChain imports
-from langchain_core.documents import Document
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_cohere import CohereEmbeddings
-from langchain_community.vectorstores import FAISS
-from langchain_community.llms import Cohere
-from langchain.chains import RetrievalQA
-from langchain_core.prompts import PromptTemplate
+from db_pool import close_pool, db_connection
+from config import data_path
+from watermark import IdWatermark
+
+# LangChain, Cohere and FAISS take seconds to import, so they are imported
+# inside the functions that use them rather than at module load
 
 # Configure logging
 logging.basicConfig(
@@ -28,153 +25,280 @@ logging.basicConfig(
 )
 logger = logging.getLogger("enhanced_rag_service")
 
-# Database connection parameters from environment variables
-db_params = {
-    "host": os.getenv("PGHOST", "localhost"),
-    "database": os.getenv("PGDATABASE", "postgres"),
-    "user": os.getenv("PGUSER", "postgres"),
-    "password": os.getenv("PGPASSWORD", "lakshman&66"),
-    "port": os.getenv("PGPORT", "5432")
-}
-
-# Get Cohere API Key from environment or use the provided one
-COHERE_API_KEY = os.getenv("COHERE_API_KEY", "v1mBXtR48OllAMPADPuMxoApU1FecoZ9yvSbLfrd")
+# Where the FAISS index of face documents is kept between runs
+RAG_INDEX_DIR = os.getenv("RAG_INDEX_DIR", "") or data_path("rag_index")
 
-def get_db_connection():
-    """Establish a database connection."""
-    try:
-        conn = psycopg2.connect(**db_params)
-        return conn
-    except Exception as e:
-        logger.error(f"Database connection error: {e}")
-        raise
+# Documents retrieved per question
+RETRIEVAL_K = 3
 
 def get_face_registration_data():
     """Get all face registration data from the database."""
     try:
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        
-        # Query to get all face registration data
-        cur.execute("""
-            SELECT id, name, created_at
-            FROM faces
-            ORDER BY created_at DESC
-        """)
-        
-        faces = cur.fetchall()
-        
-        cur.close()
-        conn.close()
+        with db_connection() as conn, conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
+            # Query to get all face registration data
+            cur.execute("""
+                SELECT id, name, created_at
+                FROM faces
+                ORDER BY created_at DESC
+            """)
+            faces = cur.fetchall()
         
         return [dict(face) for face in faces]
     except Exception as e:
         logger.error(f"Error getting face registration data: {e}")
         raise
 
+def get_face_table_state():
+    """Row count and highest id of the faces table, to detect changes cheaply."""
+    with db_connection() as conn, conn.cursor() as cur:
+        cur.execute("SELECT COUNT(*), COALESCE(MAX(id), 0) FROM faces")
+        count, last_id = cur.fetchone()
+    return count, last_id
+
+def split_documents(documents):
+    """Split documents into chunks small enough to embed."""
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+    
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
+    return text_splitter.split_documents(documents)
+
+def create_person_documents(face_data):
+    """One LangChain document per registered face."""
+    from langchain_core.documents import Document
+    
+    documents = []
+    for face in face_data:
+        content = (
+            f"Person Information:\n"
+            f"Name: {face['name']}\n"
+            f"ID: {face['id']}\n"
+            f"Registration Date: {face['created_at']}\n"
+        )
+        documents.append(Document(
+            page_content=content,
+            metadata={"id": face['id'], "name": face['name'], "type": "person"}
+        ))
+    return split_documents(documents)
+
+def create_overview_documents(face_data):
+    """The system overview document: totals and the first and latest registration.
+    
+    People are only listed in their own documents, so the overview stays
+    one short chunk and a registration re-embeds just that chunk.
+    """
+    from langchain_core.documents import Document
+    
+    if not face_data:
+        return []
+    
+    overview = "Face Recognition System Overview:\n"
+    overview += f"Total registered faces: {len(face_data)}\n"
+    overview += f"Registered people: {len({face['name'] for face in face_data})}\n"
+    overview += f"First registration: {face_data[-1]['name']} at {face_data[-1]['created_at']}\n"
+    overview += f"Latest registration: {face_data[0]['name']} at {face_data[0]['created_at']}\n"
+    
+    return split_documents([Document(page_content=overview, metadata={"type": "overview"})])
+
 def create_documents_from_face_data():
     """Create LangChain documents from face registration data."""
     try:
         face_data = get_face_registration_data()
-        documents = []
-        
-        # Also create a comprehensive overview document
-        if face_data:
-            overview = "Face Recognition System Overview:\n"
-            overview += f"Total registered faces: {len(face_data)}\n"
-            overview += f"First registration: {face_data[-1]['created_at']}\n"
-            overview += f"Latest registration: {face_data[0]['created_at']}\n"
-            overview += "Registered people:\n"
-            
-            for idx, face in enumerate(face_data, 1):
-                # Add to overview
-                overview += f"{idx}. {face['name']} (ID: {face['id']}, Registered: {face['created_at']})\n"
-                
-                # Create individual documents
-                content = (
-                    f"Person Information:\n"
-                    f"Name: {face['name']}\n"
-                    f"ID: {face['id']}\n"
-                    f"Registration Date: {face['created_at']}\n"
-                )
-                
-                doc = Document(
-                    page_content=content,
-                    metadata={"id": face['id'], "name": face['name'], "type": "person"}
-                )
-                documents.append(doc)
-        
-            # Add overview document
-            overview_doc = Document(
-                page_content=overview,
-                metadata={"type": "overview"}
-            )
-            documents.append(overview_doc)
-        
-        # Split into smaller chunks if needed
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
-        split_docs = text_splitter.split_documents(documents)
-        
-        return split_docs
+        return create_person_documents(face_data) + create_overview_documents(face_data)
     except Exception as e:
         logger.error(f"Error creating documents: {e}")
         raise
 
-def initialize_rag_system():
-    """Initialize the RAG system with LangChain + FAISS + Cohere."""
-    try:
-        # Create documents
-        documents = create_documents_from_face_data()
-        
-        if not documents:
-            logger.warning("No face registration data found")
-            return None
-        
-        # Initialize embeddings with Cohere
-        embeddings = CohereEmbeddings(
-            model="embed-english-v3.0", 
-            cohere_api_key=COHERE_API_KEY,
-            user_agent="FaceRecognitionPlatform/1.0"
-        )
-        
-        # Create vector store
-        vector_store = FAISS.from_documents(documents, embeddings)
-        
-        # Create Cohere LLM instance
-        llm = Cohere(
-            model="command", 
-            cohere_api_key=COHERE_API_KEY,
-            temperature=0.1,
-            client=None  # Let the library create the client
-        )
+class RagIndex:
+    """A FAISS store of face documents persisted under RAG_INDEX_DIR.
+    
+    Person documents are keyed by ``faces.id`` and only faces added since
+    the last build are embedded: ids above the highest one indexed, and
+    ids below it that had not committed yet (see watermark.IdWatermark).
+    The short overview document is replaced whenever the table changes.
+    Deleted rows or a new embedding model trigger a full rebuild.
+    """
+    
+    def __init__(self, embeddings, model_id, path=RAG_INDEX_DIR):
+        self.embeddings = embeddings
+        self.model_id = model_id
+        self.path = path
+        self.meta_path = os.path.join(path, "meta.json")
+        self.lock_path = path.rstrip(os.sep) + ".lock"
+        self.store = None
+        self.meta = {"last_id": 0, "face_count": 0, "overview_ids": []}
+        self.watermark = IdWatermark()
+    
+    def _load(self):
+        from langchain_community.vectorstores import FAISS
         
-        # Create custom prompt template
-        prompt_template = """
-        You are an assistant for a face recognition system. Use the following pieces of context to answer the question. 
-        If you don't know the answer, just say that you don't know, don't try to make up an answer.
+        try:
+            with open(self.meta_path) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return
         
-        Context: {context}
+        if meta.get("embedding_model") != self.model_id:
+            logger.info("RAG index was built with another embedding model; rebuilding")
+            return
         
-        Question: {question}
+        if (meta["last_id"], meta["face_count"]) == (self.meta["last_id"], self.meta["face_count"]) and self.store is not None:
+            return
         
-        Answer:
-        """
+        self.store = FAISS.load_local(self.path, self.embeddings, allow_dangerous_deserialization=True)
+        self.meta = meta
+        self.watermark = IdWatermark()
+        self.watermark.restore(meta["last_id"], meta.get("pending", []))
+        self._fit()
+        logger.info(f"Loaded RAG index of {meta['face_count']} faces from {self.path}")
+    
+    def _fit(self):
+        """Let embeddings that weight queries by corpus statistics see the indexed documents."""
+        fit = getattr(self.embeddings, "fit", None)
+        if fit is not None and self.store is not None:
+            docstore = self.store.docstore
+            fit([docstore.search(doc_id).page_content for doc_id in self.store.index_to_docstore_id.values()])
+    
+    def _save(self):
+        tmp_path = self.path + ".tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        self.store.save_local(tmp_path)
+        with open(os.path.join(tmp_path, "meta.json"), "w") as f:
+            json.dump(dict(self.meta, embedding_model=self.model_id), f)
         
-        PROMPT = PromptTemplate(
-            template=prompt_template,
-            input_variables=["context", "question"]
-        )
+        shutil.rmtree(self.path, ignore_errors=True)
+        os.replace(tmp_path, self.path)
+    
+    def update(self):
+        """Bring the index up to date with the faces table; True if it changed."""
+        from langchain_community.vectorstores import FAISS
         
-        # Create QA chain
-        qa_chain = RetrievalQA.from_chain_type(
-            llm=llm,
-            chain_type="stuff",
-            retriever=vector_store.as_retriever(search_kwargs={"k": 3}),
-            chain_type_kwargs={"prompt": PROMPT},
-            return_source_documents=True
-        )
+        count, last_id = get_face_table_state()
+        if (count, last_id) == (self.meta["face_count"], self.meta["last_id"]) and (self.store is not None or count == 0):
+            return False
         
-        return qa_chain
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.lock_path, "a") as lock:
+            # Another process may be updating the same index
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            
+            self._load()
+            if self.store is not None and (count, last_id) == (self.meta["face_count"], self.meta["last_id"]):
+                return True
+            
+            face_data = get_face_registration_data()
+            if not face_data:
+                self.store = None
+                self.meta = {"last_id": 0, "face_count": 0, "overview_ids": []}
+                self.watermark = IdWatermark()
+                shutil.rmtree(self.path, ignore_errors=True)
+                return True
+            
+            watermark = self.watermark
+            new_faces = [
+                face for face in face_data
+                if face["id"] > watermark.last_id or watermark.is_pending(face["id"])
+            ]
+            
+            # Fewer old rows than were indexed means faces were deleted
+            deleted = len(face_data) - len(new_faces) < self.meta["face_count"]
+            rebuild = self.store is None or deleted
+            if rebuild:
+                new_faces = face_data
+                self.watermark = watermark = IdWatermark()
+            watermark.advance([face["id"] for face in new_faces])
+            person_docs = create_person_documents(new_faces)
+            overview_docs = create_overview_documents(face_data)
+            overview_ids = [f"overview-{last_id}-{i}" for i in range(len(overview_docs))]
+            
+            documents = person_docs + overview_docs
+            ids = [f"face-{doc.metadata['id']}-{i}" for i, doc in enumerate(person_docs)] + overview_ids
+            
+            if rebuild:
+                self.store = FAISS.from_documents(documents, self.embeddings, ids=ids)
+            else:
+                if self.meta["overview_ids"]:
+                    self.store.delete(self.meta["overview_ids"])
+                self.store.add_documents(documents, ids=ids)
+            
+            self.meta = {
+                "last_id": watermark.last_id,
+                "pending": watermark.pending(),
+                "face_count": len(face_data),
+                "overview_ids": overview_ids,
+            }
+            self._fit()
+            self._save()
+            logger.info(
+                f"{'Rebuilt' if rebuild else 'Updated'} RAG index: embedded {len(documents)} documents "
+                f"for {len(new_faces)} faces"
+            )
+            cache = getattr(self.embeddings, "cache", None)
+            if cache is not None:
+                logger.info(f"Embedding cache: {cache.stats}")
+            return True
+
+def create_qa_chain(vector_store):
+    """Build the retrieval QA chain over a vector store."""
+    from langchain.chains import RetrievalQA
+    from langchain_core.prompts import PromptTemplate
+    from rag_providers import create_llm
+    
+    # Create the configured LLM (RAG_LLM_PROVIDER)
+    llm = create_llm()
+    
+    # Create custom prompt template
+    prompt_template = """
+    You are an assistant for a face recognition system. Use the following pieces of context to answer the question. 
+    If you don't know the answer, just say that you don't know, don't try to make up an answer.
+    
+    Context: {context}
+    
+    Question: {question}
+    
+    Answer:
+    """
+    
+    PROMPT = PromptTemplate(
+        template=prompt_template,
+        input_variables=["context", "question"]
+    )
+    
+    # Create QA chain
+    return RetrievalQA.from_chain_type(
+        llm=llm,
+        chain_type="stuff",
+        retriever=vector_store.as_retriever(search_kwargs={"k": RETRIEVAL_K}),
+        chain_type_kwargs={"prompt": PROMPT},
+        return_source_documents=True
+    )
+
+# The index and chain are built once per process and reused across queries
+_rag_index = None
+_qa_chain = None
+_qa_chain_store = None
+_rag_lock = threading.Lock()
+
+def initialize_rag_system():
+    """Return the RAG chain (LangChain + FAISS + the configured providers), updating its index first."""
+    global _rag_index, _qa_chain, _qa_chain_store
+    
+    try:
+        with _rag_lock:
+            if _rag_index is None:
+                from rag_providers import create_embeddings, embedding_model_id
+                _rag_index = RagIndex(create_embeddings(), embedding_model_id())
+            _rag_index.update()
+            
+            if _rag_index.store is None:
+                logger.warning("No face registration data found")
+                return None
+            
+            # Documents are added to the store in place; only a rebuilt store needs a new chain
+            if _qa_chain is None or _qa_chain_store is not _rag_index.store:
+                _qa_chain = create_qa_chain(_rag_index.store)
+                _qa_chain_store = _rag_index.store
+            
+            return _qa_chain
     except Exception as e:
         logger.error(f"Error initializing RAG system: {e}")
         raise
@@ -206,15 +330,94 @@ def process_query(query):
             "response": f"I'm sorry, I encountered an error while processing your question: {str(e)}"
         }
 
+def benchmark_retrieval(queries, repeat=5):
+    """Time retrieval alone and whole answers for each query."""
+    qa_chain = initialize_rag_system()
+    if qa_chain is None:
+        return {"error": "No face registration data to search"}
+    
+    def percentiles(samples):
+        samples = sorted(samples)
+        return {
+            "avg_ms": 1000 * sum(samples) / len(samples),
+            "p50_ms": 1000 * samples[len(samples) // 2],
+            "p95_ms": 1000 * samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+        }
+    
+    retrieval, answers = [], []
+    for _ in range(repeat):
+        for query in queries:
+            started = time.perf_counter()
+            _rag_index.store.similarity_search(query, k=RETRIEVAL_K)
+            retrieval.append(time.perf_counter() - started)
+            
+            started = time.perf_counter()
+            process_query(query)
+            answers.append(time.perf_counter() - started)
+    
+    from rag_providers import EMBEDDING_PROVIDER, LLM_PROVIDER
+    return {
+        "embedding_provider": EMBEDDING_PROVIDER,
+        "llm_provider": LLM_PROVIDER,
+        "queries": len(retrieval),
+        "retrieval": percentiles(retrieval),
+        "answer": percentiles(answers),
+    }
+
+def serve():
+    """Answer newline-delimited JSON queries, keeping the index and chain loaded.
+    
+    Requests look like ``{"id": 1, "query": "..."}``; each response echoes
+    the id next to ``response`` and ``source_count``.
+    """
+    logger.info("Enhanced RAG service reading queries from stdin")
+    try:
+        for line in sys.stdin:
+            line = line.strip()
+            if not line:
+                continue
+            
+            try:
+                request = json.loads(line)
+            except ValueError as e:
+                response = {"error": f"Invalid request: {e}"}
+            else:
+                response = process_query(request.get("query", ""))
+                if request.get("id") is not None:
+                    response["id"] = request["id"]
+            
+            sys.stdout.write(json.dumps(response) + "\n")
+            sys.stdout.flush()
+    finally:
+        # Hand the database connections back before the worker exits
+        close_pool()
+
 def main():
     """Main entry point for the script."""
-    parser = argparse.ArgumentParser(description='Enhanced RAG Service with LangChain + FAISS + Cohere')
+    parser = argparse.ArgumentParser(description='Enhanced RAG Service with LangChain + FAISS')
     parser.add_argument('--query', action='store_true', help='Process a query using enhanced RAG')
+    parser.add_argument('--serve', action='store_true', help='Answer newline-delimited JSON queries until stdin closes')
+    parser.add_argument('--build-index', action='store_true', help='Build or update the saved RAG index and exit')
+    parser.add_argument('--benchmark-retrieval', action='store_true', help='Time retrieval and answers for one query per stdin line')
     
     args = parser.parse_args()
     
     try:
-        if args.query:
+        if args.serve:
+            serve()
+        elif args.build_index:
+            initialize_rag_system()
+            cache = getattr(_rag_index.embeddings, "cache", None)
+            print(json.dumps({
+                "success": True,
+                "faces": _rag_index.meta["face_count"],
+                "path": RAG_INDEX_DIR,
+                "embedding_cache": cache.stats if cache is not None else None
+            }))
+        elif args.benchmark_retrieval:
+            queries = [line.strip() for line in sys.stdin if line.strip()]
+            print(json.dumps(benchmark_retrieval(queries)))
+        elif args.query:
             # Read query from stdin
             query = sys.stdin.buffer.read().decode('utf-8')
             result = process_query(query)
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+import os
+import logging
+import threading
+import numpy as np
+import cv2
+from config import DATA_DIR
+
+logger = logging.getLogger("face_features")
+
+# Side length of the grayscale face crop every extractor starts from
+CROP_SIZE = 100
+
+# Extractor used for new encodings: raw, pca or dnn (empty = pick automatically)
+FEATURE_EXTRACTOR = os.getenv("FACE_FEATURE_EXTRACTOR", "")
+
+# Fitted PCA projection; once it exists it becomes the default extractor
+PCA_MODEL_PATH = os.getenv("FACE_PCA_MODEL_PATH", "") or os.path.join(DATA_DIR, "face_pca.npz")
+PCA_DIMENSION = int(os.getenv("FACE_PCA_DIMENSION", "128"))
+
+# Crops needed per PCA dimension; fewer give a projection fitted mostly to noise
+PCA_SAMPLES_PER_DIMENSION = 2
+
+# Torch face embedding model for cv2.dnn, e.g. OpenFace's nn4.small2.v1.t7
+DNN_MODEL_PATH = os.getenv("FACE_DNN_MODEL_PATH", "")
+DNN_INPUT_SIZE = 96
+
+def normalize_rows(vectors):
+    """Scale each row to unit length."""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+class RawPixelExtractor:
+    """The original encoding: the 100x100 crop's pixels, flattened."""
+
+    name = "raw"
+    dimension = CROP_SIZE * CROP_SIZE
+    dtype = np.uint8
+    normalized = False
+    match_threshold = 20000
+    # Much tighter: only about the same photo again counts as a duplicate
+    duplicate_distance = 2500
+
+    def extract(self, crops):
+        return np.asarray(crops, dtype=np.uint8).reshape(len(crops), -1)
+
+class PCAExtractor:
+    """Eigenface projection of histogram-equalized crops to a few dimensions.
+
+    The projection is fitted once from enrolled crops (see ``fit``) and
+    stored as an .npz file; outputs are L2-normalized float32 vectors.
+    """
+
+    name = "pca"
+    dtype = np.float32
+    normalized = True
+    match_threshold = 0.6
+    duplicate_distance = 0.15
+
+    def __init__(self, mean, components):
+        self.mean = mean.astype(np.float32)
+        self.components = np.ascontiguousarray(components, dtype=np.float32)
+        self.dimension = self.components.shape[0]
+
+    @staticmethod
+    def _prepare(crops):
+        crops = np.asarray(crops, dtype=np.uint8).reshape(len(crops), CROP_SIZE, CROP_SIZE)
+        return np.stack([cv2.equalizeHist(crop) for crop in crops]).reshape(len(crops), -1).astype(np.float32)
+
+    @classmethod
+    def fit(cls, crops, dimension=PCA_DIMENSION):
+        """Fit the projection from a sample of face crops.
+
+        Raises ValueError when there are fewer than PCA_SAMPLES_PER_DIMENSION
+        crops per dimension, rather than fitting a smaller projection.
+        """
+        required = PCA_SAMPLES_PER_DIMENSION * dimension
+        if len(crops) < required:
+            raise ValueError(
+                f"Fitting a {dimension}-D PCA projection needs at least {required} face crops, "
+                f"but only {len(crops)} were given; register more faces or lower FACE_PCA_DIMENSION"
+            )
+        data = cls._prepare(crops)
+        mean, components = cv2.PCACompute(data, mean=None, maxComponents=dimension)
+        logger.info(f"Fitted {components.shape[0]}-D PCA projection from {len(data)} crops")
+        return cls(mean.ravel(), components)
+
+    @classmethod
+    def load(cls, path=PCA_MODEL_PATH):
+        model = np.load(path)
+        return cls(model["mean"], model["components"])
+
+    def save(self, path=PCA_MODEL_PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        np.savez(path, mean=self.mean, components=self.components)
+        logger.info(f"Saved PCA projection to {path}")
+
+    def extract(self, crops):
+        projected = (self._prepare(crops) - self.mean) @ self.components.T
+        return normalize_rows(projected).astype(np.float32)
+
+class DNNExtractor:
+    """128-D embeddings from a Torch face model run through cv2.dnn."""
+
+    name = "dnn"
+    dimension = 128
+    dtype = np.float32
+    normalized = True
+    match_threshold = 0.9
+    duplicate_distance = 0.2
+
+    def __init__(self, model_path=DNN_MODEL_PATH):
+        if not model_path or not os.path.exists(model_path):
+            raise ValueError("FACE_DNN_MODEL_PATH must point to a face embedding model")
+        self.net = cv2.dnn.readNetFromTorch(model_path)
+        # A cv2.dnn Net can't run forward passes from several threads at once
+        self._lock = threading.Lock()
+
+    def extract(self, crops):
+        images = [
+            cv2.cvtColor(cv2.resize(crop, (DNN_INPUT_SIZE, DNN_INPUT_SIZE)), cv2.COLOR_GRAY2BGR)
+            for crop in np.asarray(crops, dtype=np.uint8)
+        ]
+        blob = cv2.dnn.blobFromImages(images, 1.0 / 255, (DNN_INPUT_SIZE, DNN_INPUT_SIZE),
+                                      (0, 0, 0), swapRB=True, crop=False)
+        with self._lock:
+            self.net.setInput(blob)
+            embeddings = self.net.forward()
+        return normalize_rows(embeddings.reshape(len(images), -1)).astype(np.float32)
+
+def default_extractor_name():
+    """The configured extractor, or pca once a projection has been fitted."""
+    if FEATURE_EXTRACTOR:
+        return FEATURE_EXTRACTOR
+    return "pca" if os.path.exists(PCA_MODEL_PATH) else "raw"
+
+def create_extractor(name):
+    if name == "raw":
+        return RawPixelExtractor()
+    if name == "pca":
+        return PCAExtractor.load()
+    if name == "dnn":
+        return DNNExtractor()
+    raise ValueError(f"Unknown feature extractor: {name}")
+
+_extractor = None
+_extractor_lock = threading.Lock()
+
+def get_extractor():
+    """Return the process-wide feature extractor."""
+    global _extractor
+    if _extractor is None:
+        with _extractor_lock:
+            if _extractor is None:
+                _extractor = create_extractor(default_extractor_name())
+                logger.info(f"Using '{_extractor.name}' face features ({_extractor.dimension}-D)")
+    return _extractor
+
+def encoding_size(extractor):
+    """Number of bytes a headerless (pre encoding_format) encoding takes for the extractor."""
+    return extractor.dimension * np.dtype(extractor.dtype).itemsize
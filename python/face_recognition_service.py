@@ -8,13 +8,30 @@ import os
 import io
 import argparse
 import logging
-import time
-import pickle
-import uuid
-from datetime import datetime
-from PIL import Image
+import itertools
+import threading
+import functools
+from concurrent.futures import wait
 import psycopg2
 import psycopg2.extras
+from db_pool import close_pool, db_connection, pool_stats
+from schema import ensure_schema
+from detectors import detect_faces, detection_width, preload_detectors
+from gallery import FaceGallery
+from identities import IdentityIndex, identity_key
+from tracking import SessionTrackers
+from frames import FrameError, FrameRejected, GrayFrame, decode_gray, frame_request, read_frame
+from worker_pool import WORKER_MODE, WORKERS, WorkerPool, timed
+from ann_index import SEARCH_BACKEND, create_index
+from database import store_face_encodings
+from config import data_path
+from face_features import (
+    PCA_MODEL_PATH, PCAExtractor, RawPixelExtractor, create_extractor, encoding_size, get_extractor
+)
+from encoding_format import (
+    FORMAT_PREFIX_SIZE, HEADER, MAGIC, decode_encoding, decode_matrix, encode_encodings,
+    extractor_prefix, read_header, storage_dtype
+)
 
 # Configure logging
 logging.basicConfig(
@@ -23,91 +40,89 @@ logging.basicConfig(
 )
 logger = logging.getLogger("face_recognition_service")
 
-# Database connection parameters from environment variables
-db_params = {
-    "host": os.getenv("PGHOST", "localhost"),
-    "database": os.getenv("PGDATABASE", "postgres"),
-    "user": os.getenv("PGUSER", "postgres"),
-    "password": os.getenv("PGPASSWORD", "lakshman&66"),
-    "port": os.getenv("PGPORT", "5432")
-}
+# Distance below which a probe is accepted as a known face (lower is better);
+# defaults to the feature extractor's own threshold
+MATCH_THRESHOLD = float(os.getenv("FACE_MATCH_THRESHOLD", "0")) or None
 
-def get_db_connection():
-    """Establish a database connection."""
-    try:
-        conn = psycopg2.connect(**db_params)
-        return conn
-    except Exception as e:
-        logger.error(f"Database connection error: {e}")
-        raise
+# Images per chunk and frame workers for --batch (defaults to FACE_WORKERS)
+BATCH_SIZE = int(os.getenv("FACE_BATCH_SIZE", "64"))
+BATCH_WORKERS = int(os.getenv("FACE_BATCH_WORKERS", "0")) or None
 
-def initialize_database():
-    """Create necessary tables if they don't exist."""
-    try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        
-        # Create faces table
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS faces (
-                id SERIAL PRIMARY KEY,
-                name VARCHAR(255) NOT NULL,
-                encoding BYTEA NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        
-        conn.commit()
-        cur.close()
-        conn.close()
-        logger.info("Database initialized successfully")
-    except Exception as e:
-        logger.error(f"Database initialization error: {e}")
-        raise
+# Number of legacy crops sampled to fit the PCA projection during migration
+PCA_FIT_SAMPLE_SIZE = int(os.getenv("FACE_PCA_FIT_SAMPLE_SIZE", "20000"))
+
+# Minimum seconds between gallery refreshes on the recognition path
+GALLERY_REFRESH_INTERVAL = float(os.getenv("FACE_GALLERY_REFRESH_INTERVAL", "1.0"))
+
+# What to do with a registration that looks like an already registered face:
+# reject it when it is registered under another name (another sample of the
+# same person is stored), merge it into that registration when the names
+# agree (and reject it otherwise), or allow it
+DUPLICATE_POLICY = os.getenv("FACE_DUPLICATE_POLICY", "reject")
+
+# Distance below which two faces count as duplicates; defaults to the
+# feature extractor's near-duplicate distance, well inside its match threshold
+DUPLICATE_DISTANCE = float(os.getenv("FACE_DUPLICATE_DISTANCE", "0")) or None
+
+# Match probes person by person (centroids first, then the closest people's
+# samples) rather than against every registered row: 1 always, 0 never (rows
+# are searched through the ANN index if there is one), auto unless an ANN
+# search backend is configured
+IDENTITY_MATCHING_MODE = os.getenv("FACE_IDENTITY_MATCHING", "auto")
+IDENTITY_MATCHING = IDENTITY_MATCHING_MODE == "1" or (IDENTITY_MATCHING_MODE != "0" and SEARCH_BACKEND == "exact")
 
-def decode_image(base64_image):
-    """Decode base64 image string to image."""
+# Rows fetched per query when loading the gallery
+GALLERY_LOAD_CHUNK = int(os.getenv("FACE_GALLERY_LOAD_CHUNK", "50000"))
+
+# Where the built ANN search index is persisted between runs
+SEARCH_INDEX_PATH = os.getenv("FACE_SEARCH_INDEX_PATH", "")
+
+# Start the gallery from a memory-mapped snapshot file (set to 0 to always
+# load it from the database), and where that file lives
+GALLERY_SNAPSHOT = os.getenv("FACE_GALLERY_SNAPSHOT", "1") != "0"
+GALLERY_SNAPSHOT_PATH = os.getenv("FACE_GALLERY_SNAPSHOT_PATH", "")
+
+# --serve rewrites the snapshot at startup once this many loaded faces aren't in it
+GALLERY_SNAPSHOT_MIN_DELTA = int(os.getenv("FACE_GALLERY_SNAPSHOT_MIN_DELTA", "1000"))
+
+# Detection profile used by each service operation
+DETECTION_OPERATIONS = {"check-face": "check", "register-face": "register", "recognize": "recognize"}
+
+def load_frame(image, operation="recognize"):
+    """Decode an image into the grayscale frame detection and encoding use.
+    
+    ``image`` is a base64 string (optionally a data URL), encoded JPEG/PNG
+    bytes, or an already decoded pixel array from a binary frame. Encoded
+    images are decoded straight to grayscale, and JPEGs at a reduced
+    resolution when the operation's detection width allows it.
+    """
     try:
+        if isinstance(image, np.ndarray):
+            return GrayFrame(image)
+        
         # Check if the base64 string is not empty
-        if not base64_image or base64_image == "{}":
+        if not image or image == "{}":
             raise ValueError("Empty or invalid base64 image data")
-            
-        # Remove any headers if present (e.g., "data:image/jpeg;base64,")
-        if ',' in base64_image:
-            base64_image = base64_image.split(',')[1]
-            
-        # Decode base64 image
-        image_data = base64.b64decode(base64_image)
-        
-        # Decode to numpy array directly using OpenCV
-        nparr = np.frombuffer(image_data, np.uint8)
-        image = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
         
-        if image is None:
-            raise ValueError("Failed to decode image data")
+        with timed("decode"):
+            if isinstance(image, str):
+                # Skip any header if present (e.g., "data:image/jpeg;base64,")
+                image = base64.b64decode(image[image.find(',') + 1:])
             
-        # Convert BGR to RGB (OpenCV uses BGR)
-        image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        
-        return image_rgb
+            return decode_gray(image, detection_width(DETECTION_OPERATIONS[operation]))
     except Exception as e:
         logger.error(f"Error decoding image: {e}")
         raise
 
-def check_face(base64_image):
+def check_face(base64_image, detector=None):
     """Check if the image contains a face using OpenCV."""
     try:
-        # Decode image
-        image = decode_image(base64_image)
-        
-        # Convert to grayscale for face detection
-        gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
-        
-        # Load the face cascade classifier
-        face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+        # Decode image straight to grayscale for face detection
+        frame = load_frame(base64_image, "check-face")
         
         # Detect faces (with reduced strictness: lower scale factor and min neighbors)
-        faces = face_cascade.detectMultiScale(gray, 1.05, 2)
+        with timed("detect"):
+            faces = detect_faces(frame.image, "check", detector, frame.size)
         
         # Return result
         return {
@@ -117,236 +132,1020 @@ def check_face(base64_image):
         logger.error(f"Error checking face: {e}")
         raise
 
-def register_face(base64_image, name):
-    """Register a face with the given name using OpenCV."""
-    try:
-        # Decode image
-        image = decode_image(base64_image)
+def encode_registration(base64_image, detector=None):
+    """Decode a registration image and encode its first face, or None if it has none."""
+    # Decode image straight to grayscale for face detection
+    frame = load_frame(base64_image, "register-face")
+    
+    # Detect faces
+    with timed("detect"):
+        faces = detect_faces(frame.image, "register", detector, frame.size)
+    
+    if len(faces) == 0:
+        return None
+    
+    # Crop the first face at the standard size and turn it into a feature vector
+    with timed("encode"):
+        return get_extractor().extract(frame.crops(faces[:1]))[0]
+
+def no_face_result():
+    return {
+        "success": False,
+        "reason": "no-face",
+        "message": "No face detected in the image. Please use a clear, front-facing photo."
+    }
+
+# Serializes duplicate checks with inserts, so two concurrent registrations
+# of one face can't both pass the check
+_registration_lock = threading.Lock()
+
+def register_encodings(names, encodings, policy=None):
+    """Store new faces, checking them for near-duplicates first.
+    
+    The whole batch is checked in one pass, against the gallery and
+    against itself (see FaceGallery.find_duplicates); what happens to a
+    duplicate depends on ``policy`` (DUPLICATE_POLICY by default). Accepted
+    faces are stored in one COPY. Returns one result dict per face, in order.
+    """
+    if len(names) == 0:
+        return []
+    
+    policy = policy or DUPLICATE_POLICY
+    encodings = np.asarray(encodings)
+    threshold = DUPLICATE_DISTANCE or get_extractor().duplicate_distance
+    
+    with _registration_lock:
+        # Include faces registered by other processes since the last refresh
+        gallery.refresh(force=True)
         
-        # Convert to grayscale for face detection
-        gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+        if policy == "allow":
+            duplicates = [(None, -1, float("inf"))] * len(names)
+        else:
+            with timed("search"):
+                if policy == "merge":
+                    duplicates = gallery.find_duplicates(encodings, threshold)
+                else:
+                    # Only a face registered under another name is refused
+                    duplicates = gallery.find_duplicates(
+                        encodings, threshold, [identity_key(name) for name in names], identity_key
+                    )
         
-        # Load the face cascade classifier
-        face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+        results = [None] * len(names)
+        # Batch position -> (id, name) it was stored or merged under
+        stored = {}
         
-        # Detect faces
-        faces = face_cascade.detectMultiScale(gray, 1.1, 4)
+        # Faces unlike anything registered are stored first, all at once
+        inserts = [position for position, (kind, _, _) in enumerate(duplicates) if kind is None]
+        if inserts:
+            rows = store_face_encodings(
+                [names[position] for position in inserts],
+                encode_encodings(get_extractor(), encodings[inserts])
+            )
+            
+            for position, (face_id, created_at) in zip(inserts, rows):
+                logger.info(f"Face registered: {names[position]} (ID: {face_id})")
+                stored[position] = (face_id, names[position])
+                results[position] = {
+                    "success": True,
+                    "message": f"Face registered successfully: {names[position]}",
+                    "id": face_id,
+                    "timestamp": created_at.isoformat()
+                }
+            
+            # Make the new faces matchable in this process without a full reload
+            gallery.refresh(force=True)
         
-        if len(faces) == 0:
-            # For testing, we'll create a dummy face region in the center
-            # In a production system, we'd want to return an error
-            h, w = gray.shape
-            x, y = w//4, h//4
-            w, h = w//2, h//2
-            logger.info("No face detected, using center portion of image for testing")
-            faces = [(x, y, w, h)]
+        for position, (name, (kind, index, distance)) in enumerate(zip(names, duplicates)):
+            if kind is None:
+                continue
+            
+            if kind == "gallery":
+                other_id, other_name = gallery.ids[index], gallery.names[index]
+            else:
+                # An earlier face of this batch; it has no id if it was refused
+                other_id, other_name = stored.get(index, (None, names[index]))
+            
+            if policy == "merge" and other_id is not None and identity_key(other_name) == identity_key(name):
+                stored[position] = (other_id, other_name)
+                results[position] = {
+                    "success": True,
+                    "merged": True,
+                    "message": f"Face matches the existing registration of {other_name}; no new entry was added",
+                    "id": other_id
+                }
+            else:
+                if other_id is None:
+                    message = f"This face is too similar to the image of {other_name} earlier in the batch"
+                else:
+                    message = f"This face is too similar to {other_name}, who is already registered"
+                results[position] = {
+                    "success": False,
+                    "reason": "duplicate",
+                    "message": message,
+                    "duplicate": {"id": other_id, "name": other_name, "distance": distance}
+                }
+    
+    return results
+
+def register_face(base64_image, name, detector=None):
+    """Register a face with the given name using OpenCV.
+    
+    Images without a detectable face, and faces too similar to a registered
+    one (see DUPLICATE_POLICY), are refused with ``success: False`` and a
+    ``reason`` of ``no-face`` or ``duplicate``.
+    """
+    try:
+        face_encoding = encode_registration(base64_image, detector)
+        if face_encoding is None:
+            logger.info(f"Registration of {name} refused: no face detected")
+            return no_face_result()
         
-        # Use the first face found
-        x, y, w, h = faces[0]
+        result = register_encodings([name], face_encoding[None, :])[0]
+        if not result["success"]:
+            logger.info(f"Registration of {name} refused: {result['message']}")
+        return result
+    except Exception as e:
+        logger.error(f"Error registering face: {e}")
+        raise
+
+def register_faces(faces, detector=None):
+    """Register several ``{"image": ..., "name": ...}`` faces at once.
+    
+    All of them are deduplicated together in one pass and stored with one
+    COPY; the result list matches the input order.
+    """
+    try:
+        results = [None] * len(faces)
+        names, encodings, positions = [], [], []
+        for position, face in enumerate(faces):
+            face_encoding = encode_registration(face["image"], detector)
+            if face_encoding is None:
+                results[position] = no_face_result()
+                continue
+            names.append(face["name"])
+            encodings.append(face_encoding)
+            positions.append(position)
         
-        # Extract the face region
-        face_roi = gray[y:y+h, x:x+w]
+        if encodings:
+            for position, result in zip(positions, register_encodings(names, np.stack(encodings))):
+                results[position] = result
         
-        # Resize to a standard size for consistent feature extraction
-        face_roi_resized = cv2.resize(face_roi, (100, 100))
+        return results
+    except Exception as e:
+        logger.error(f"Error registering faces: {e}")
+        raise
+
+def extractor_rows(extractor):
+    """SQL condition (and its parameters) selecting the rows encoded by ``extractor``.
+    
+    These are rows carrying its format prefix, plus headerless rows from
+    before the format existed whose length matches it.
+    """
+    return (
+        "(substring(encoding from 1 for 6) = %(format_prefix)s"
+        " OR (substring(encoding from 1 for 4) <> %(format_magic)s AND octet_length(encoding) = %(legacy_size)s))",
+        {
+            "format_prefix": psycopg2.Binary(extractor_prefix(extractor)),
+            "format_magic": psycopg2.Binary(MAGIC),
+            "legacy_size": encoding_size(extractor),
+        }
+    )
+
+def pending_ids_condition(pending):
+    """SQL matching ids in any of the pending (low, high) ranges, and its parameters."""
+    if not pending:
+        return "FALSE", {}
+    return (
+        " OR ".join(f"id BETWEEN %(pending_low_{i})s AND %(pending_high_{i})s" for i in range(len(pending))),
+        {
+            key: value
+            for i, (low, high) in enumerate(pending)
+            for key, value in ((f"pending_low_{i}", low), (f"pending_high_{i}", high))
+        }
+    )
+
+def get_face_encodings_since(last_id, pending=(), chunk_size=GALLERY_LOAD_CHUNK):
+    """Retrieve face encodings with an id above last_id or in a pending range, ordered by id.
+    
+    Pending ranges are ids below last_id that were not committed yet when
+    the rows above them were loaded (see watermark.IdWatermark).
+    Only rows encoded by the active feature extractor are returned; rows
+    still waiting for --migrate-encodings are skipped. Each chunk of rows
+    comes back grouped by storage format, with the vectors of a group
+    concatenated by the database, so a group decodes into one matrix
+    instead of one small array per row.
+    """
+    try:
+        extractor = get_extractor()
+        condition, params = extractor_rows(extractor)
+        pending_condition, pending_params = pending_ids_condition(pending)
+        params = dict(params, after_id=last_id, **pending_params)
+        # Chunks are paged by id from the lowest pending one
+        last_id = min([last_id] + [low - 1 for low, _ in pending])
+        prefix_size = FORMAT_PREFIX_SIZE
+        scale_size = HEADER.size - FORMAT_PREFIX_SIZE
+        face_data = []
         
-        # Flatten the image for storage as a simple feature vector
-        face_encoding = face_roi_resized.flatten()
+        with db_connection() as conn, conn.cursor() as cur:
+            while True:
+                cur.execute(
+                    f"""
+                    WITH chunk AS (
+                        SELECT id, name, encoding, substring(encoding from 1 for 4) = %(format_magic)s AS formatted
+                        FROM faces
+                        WHERE id > %(last_id)s AND (id > %(after_id)s OR {pending_condition}) AND {condition}
+                        ORDER BY id
+                        LIMIT %(chunk_size)s
+                    )
+                    SELECT
+                        CASE WHEN formatted THEN substring(encoding from 1 for {prefix_size}) ELSE ''::bytea END AS prefix,
+                        count(*),
+                        max(id),
+                        array_agg(id ORDER BY id),
+                        array_agg(name ORDER BY id),
+                        string_agg(CASE WHEN formatted THEN substring(encoding from {prefix_size + 1} for {scale_size}) ELSE ''::bytea END, ''::bytea ORDER BY id),
+                        string_agg(CASE WHEN formatted THEN substring(encoding from {HEADER.size + 1}) ELSE encoding END, ''::bytea ORDER BY id)
+                    FROM chunk
+                    GROUP BY 1
+                    """,
+                    dict(params, last_id=last_id, chunk_size=chunk_size)
+                )
+                groups = cur.fetchall()
+                
+                for prefix, count, _, ids, names, scales, payload in groups:
+                    try:
+                        matrix = decode_matrix(prefix, scales, payload, count, extractor)
+                    except ValueError as e:
+                        logger.warning(f"Skipping {count} encodings that can't be decoded: {e}")
+                        continue
+                    if matrix.shape[1] != extractor.dimension:
+                        logger.warning(f"Skipping {count} encodings of dimension {matrix.shape[1]} "
+                                       f"(expected {extractor.dimension})")
+                        continue
+                    face_data.extend(zip(ids, names, matrix))
+                
+                if sum(group[1] for group in groups) < chunk_size:
+                    break
+                last_id = max(group[2] for group in groups)
         
-        # Store in database
-        conn = get_db_connection()
-        cur = conn.cursor()
+        face_data.sort(key=lambda row: row[0])
+        return face_data
+    except Exception as e:
+        logger.error(f"Error retrieving face encodings: {e}")
+        raise
+
+def get_all_face_encodings():
+    """Retrieve all face encodings from the database."""
+    return [
+        {'id': face_id, 'name': name, 'encoding': encoding}
+        for face_id, name, encoding in get_face_encodings_since(0)
+    ]
+
+# Enrolled encodings, kept in memory and refreshed incrementally
+gallery = FaceGallery(get_face_encodings_since, GALLERY_REFRESH_INTERVAL)
+
+# The same encodings grouped by person, with per-person centroids
+identities = IdentityIndex(gallery)
+
+def match_encodings(encodings):
+    """Nearest gallery row and its distance for each probe encoding."""
+    if IDENTITY_MATCHING:
+        return identities.search(encodings)
+    return gallery.search(encodings)
+
+# Per-session face tracks for live recognition streams
+trackers = SessionTrackers()
+
+def detect_frame(base64_image, detector=None):
+    """Decode an image and find its faces; returns the grayscale frame and boxes."""
+    # Decode image straight to grayscale for face detection
+    frame = load_frame(base64_image, "recognize")
+    
+    # Detect faces
+    with timed("detect"):
+        faces = detect_faces(frame.image, "recognize", detector, frame.size)
+    
+    if len(faces) == 0:
+        # For testing, we'll create a dummy face region in the center
+        w, h = frame.size
+        x, y = w // 4, h // 4
+        w, h = w // 2, h // 2
+        logger.info("No face detected during recognition, using center portion of image for testing")
+        faces = [(x, y, w, h)]
+    
+    return frame, faces
+
+def detect_and_encode(base64_image, detector=None):
+    """Decode an image, find its faces and encode each one.
+    
+    Returns the face boxes and one encoding row per box. This stage doesn't
+    touch the gallery, so many images can go through it in parallel.
+    """
+    frame, faces = detect_frame(base64_image, detector)
+    
+    # Encode every detected face (same preprocessing as during registration)
+    with timed("encode"):
+        return faces, get_extractor().extract(frame.crops(faces))
+
+def describe_faces(faces, best_indices=None, best_distances=None):
+    """Build the JSON face list from boxes and their nearest gallery matches."""
+    if best_indices is None:
+        return [
+            {
+                "name": "Unknown",
+                "x": int(x),
+                "y": int(y),
+                "width": int(w),
+                "height": int(h),
+                "confidence": 0.0
+            }
+            for x, y, w, h in faces
+        ]
+    
+    threshold = MATCH_THRESHOLD or get_extractor().match_threshold
+    
+    # Initialize array to hold recognized faces
+    recognized_faces = []
+    
+    for (x, y, w, h), best_index, distance in zip(faces, best_indices, best_distances):
+        # Accept the closest match only if it's under the threshold
+        if distance < threshold:
+            name = gallery.names[best_index]
+        else:
+            name = "Unknown"
         
-        # Convert numpy array to bytes for storage
-        encoding_bytes = face_encoding.tobytes()
+        # Log the matched face name
+        logger.info(f"Matched face name: {name} (distance: {distance:.3f})")
         
-        # Insert into database
-        cur.execute(
-            "INSERT INTO faces (name, encoding) VALUES (%s, %s) RETURNING id, created_at",
-            (name, psycopg2.Binary(encoding_bytes))
-        )
+        # Calculate confidence score (0-1)
+        confidence = max(0, min(1, 1.0 - distance))
         
-        result = cur.fetchone()
-        face_id, created_at = result
+        # Convert all numpy values to Python native types for JSON serialization
+        recognized_faces.append({
+            "name": name,
+            "x": int(x),
+            "y": int(y),
+            "width": int(w),
+            "height": int(h),
+            "confidence": float(confidence)
+        })
+    
+    return recognized_faces
+
+def recognize_tracked(base64_image, session, detector=None):
+    """Recognize faces in a stream frame, reusing identities from earlier frames.
+    
+    Faces are followed across a session's frames by box overlap; only new
+    faces, weakly associated ones and those due for a periodic re-check are
+    encoded and matched against the gallery.
+    """
+    tracker = trackers.get(session)
+    
+    with tracker.lock:
+        if not tracker.should_detect():
+            return {"faces": [track.describe() for track in tracker.skip_frame()]}
         
-        conn.commit()
-        cur.close()
-        conn.close()
+        frame, faces = detect_frame(base64_image, detector)
+        tracks = tracker.update(faces)
         
-        logger.info(f"Face registered: {name} (ID: {face_id})")
+        stale = [track for track in tracks if track.needs_identity]
+        if stale:
+            gallery.refresh()
+            boxes = [track.box for track in stale]
+            
+            if len(gallery) == 0:
+                tracked_names = describe_faces(boxes)
+            else:
+                with timed("encode"):
+                    encodings = get_extractor().extract(frame.crops(boxes))
+                with timed("search"):
+                    best_indices, best_distances = match_encodings(encodings)
+                tracked_names = describe_faces(boxes, best_indices, best_distances)
+            
+            for track, identity in zip(stale, tracked_names):
+                tracker.identify(track, identity["name"], identity["confidence"])
         
-        return {
-            "success": True,
-            "message": f"Face registered successfully: {name}",
-            "id": face_id,
-            "timestamp": created_at.isoformat()
-        }
-    except Exception as e:
-        logger.error(f"Error registering face: {e}")
-        raise
+        return {"faces": [track.describe() for track in tracks]}
 
-def get_all_face_encodings():
-    """Retrieve all face encodings from the database."""
-    try:
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        
-        cur.execute("SELECT id, name, encoding FROM faces")
-        face_data = cur.fetchall()
-        
-        faces = []
-        for face in face_data:
-            # Convert bytes to numpy array - using uint8 since we're storing grayscale pixel values
-            encoding = np.frombuffer(face['encoding'], dtype=np.uint8)
-            faces.append({
-                'id': face['id'],
-                'name': face['name'],
-                'encoding': encoding
-            })
-        
-        cur.close()
-        conn.close()
-        
-        return faces
-    except Exception as e:
-        logger.error(f"Error retrieving face encodings: {e}")
-        raise
+def end_session(session):
+    """Forget a stream's tracking state and report its counters."""
+    return {"session": session, "stats": trackers.end(session)}
 
-def recognize_faces(base64_image):
+def recognize_faces(base64_image, detector=None, session=None):
     """Recognize faces in the given image using OpenCV."""
     try:
-        # Decode image
-        image = decode_image(base64_image)
-        
-        # Convert to grayscale for face detection
-        gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+        if session is not None:
+            return recognize_tracked(base64_image, session, detector)
         
-        # Load the face cascade classifier
-        face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+        faces, face_encodings = detect_and_encode(base64_image, detector)
         
-        # Detect faces
-        faces = face_cascade.detectMultiScale(gray, 1.1, 4)
+        # Pick up any faces registered since the last frame
+        gallery.refresh()
         
-        if len(faces) == 0:
-            # For testing, we'll create a dummy face region in the center
-            h, w = gray.shape
-            x, y = w // 4, h // 4
-            w, h = w // 2, h // 2
-            logger.info("No face detected during recognition, using center portion of image for testing")
-            faces = [(x, y, w, h)]
-        
-        # Get stored face encodings from database
-        known_faces = get_all_face_encodings()
-        
-        if not known_faces:
+        if len(gallery) == 0:
             logger.info("No registered faces found in the database.")
-            return {
-                "faces": [
-                    {
-                        "name": "Unknown",
-                        "x": int(x),
-                        "y": int(y),
-                        "width": int(w),
-                        "height": int(h),
-                        "confidence": 0.0
-                    }
-                    for x, y, w, h in faces
-                ]
-            }
+            return {"faces": describe_faces(faces)}
         
-        # Known face encodings and names
-        known_face_encodings = [face['encoding'] for face in known_faces]
-        known_face_names = [face['name'] for face in known_faces]
+        # Match all faces against the whole gallery in one batched query
+        with timed("search"):
+            best_indices, best_distances = match_encodings(face_encodings)
+        recognized_faces = describe_faces(faces, best_indices, best_distances)
         
-        # Initialize array to hold recognized faces
-        recognized_faces = []
+        logger.info(f"Recognized {len(recognized_faces)} faces")
         
-        # For each detected face
-        for (x, y, w, h) in faces:
-            # Extract the face region
-            face_roi = gray[y:y+h, x:x+w]
-            
-            # Resize to a standard size (same as during registration)
-            face_roi_resized = cv2.resize(face_roi, (100, 100))
-            
-            # Flatten to get face encoding
-            face_encoding = face_roi_resized.flatten()
-            
-            # # Log the detected face encoding
-            # logger.info(f"Detected face encoding: {face_encoding.tolist()}")
+        return {"faces": recognized_faces}
+    except Exception as e:
+        logger.error(f"Error recognizing faces: {e}")
+        raise
+
+def _parse_batch_line(position, line):
+    """Split a batch input line into its id and base64 image.
+    
+    Lines are either a bare base64 image or a JSON object with ``image``
+    and an optional ``id``; the id defaults to the line's position.
+    """
+    if line.startswith('{'):
+        request = json.loads(line)
+        return request.get("id", position), request.get("image")
+    return position, line
+
+def _detect_batch_item(item, detector=None):
+    position, line = item
+    request_id = position
+    try:
+        request_id, base64_image = _parse_batch_line(position, line)
+        faces, encodings = detect_and_encode(base64_image, detector)
+        return request_id, faces, encodings, None
+    except Exception as e:
+        logger.error(f"Error processing batch item {request_id}: {e}")
+        return request_id, None, None, str(e)
+
+def recognize_batch(lines, writer, batch_size=BATCH_SIZE, workers=BATCH_WORKERS, detector=None,
+                    mode=WORKER_MODE):
+    """Recognize faces in many images, streaming one JSON line per image.
+    
+    Images are handled in chunks of ``batch_size``: decoding, detection and
+    encoding run on the worker pool (threads, since OpenCV releases the GIL
+    for these, or processes), then every face in the chunk is matched with
+    a single gallery search. Only one chunk is held in memory at a time and
+    output keeps input order.
+    """
+    gallery.refresh(force=True)
+    processed = 0
+    
+    numbered_lines = (
+        (position, line.strip())
+        for position, line in enumerate(lines)
+        if line.strip()
+    )
+    
+    workers = workers or WORKERS
+    detect_item = functools.partial(_detect_batch_item, detector=detector)
+    batch_pool = WorkerPool(workers, mode, initializer=_init_worker,
+                            initargs=([detector] if detector else None, workers, mode, False))
+    
+    try:
+        while True:
+            chunk = list(itertools.islice(numbered_lines, batch_size))
+            if not chunk:
+                break
             
-            # Simple nearest neighbor matching 
-            # Calculate Euclidean distance to all known faces
-            distances = []
-            for known_encoding in known_face_encodings:
-                distance = np.linalg.norm(known_encoding - face_encoding)
-                distances.append(distance)
+            results = list(batch_pool.map(detect_item, chunk))
             
-            # Log the similarity scores
-            logger.info(f"Similarity scores: {distances}")
+            # One search for every face found in the chunk
+            encodings = [result[2] for result in results if result[3] is None]
+            best_indices = best_distances = None
+            if encodings and len(gallery) > 0:
+                best_indices, best_distances = match_encodings(np.concatenate(encodings))
             
-            # Find the closest match
-            if distances:
-                best_match_index = np.argmin(distances)
-                # Threshold for accepting a match (may need tuning)
-                if distances[best_match_index] < 20000:  # Lower is better match
-                    name = known_face_names[best_match_index]
+            offset = 0
+            for request_id, faces, face_encodings, error in results:
+                if error is not None:
+                    response = {"id": request_id, "error": error}
+                elif best_indices is None:
+                    response = {"id": request_id, "faces": describe_faces(faces)}
                 else:
-                    name = "Unknown"
-            else:
-                name = "Unknown"
-            
-            # Log the matched face name
-            logger.info(f"Matched face name: {name}")
+                    end = offset + len(face_encodings)
+                    response = {
+                        "id": request_id,
+                        "faces": describe_faces(faces, best_indices[offset:end], best_distances[offset:end])
+                    }
+                    offset = end
+                
+                writer.write(json.dumps(response) + "\n")
             
-            # Calculate confidence score (0-1)
-            confidence = 0.0
-            if distances and len(distances) > 0:
-                best_match_index = np.argmin(distances)
-                confidence = max(0, min(1, 1.0 - distances[best_match_index]))
+            writer.flush()
+            processed += len(chunk)
+            logger.info(f"Processed {processed} batch images")
+    finally:
+        batch_pool.shutdown()
+    
+    logger.info(f"Batch stage timings: {json.dumps(batch_pool.stats()['stages'])}")
+    return processed
+
+def _rewrite_encodings(extractor, transform, batch_size):
+    """Stream an extractor's rows and store transform(rows) for them, batch by batch.
+    
+    ``transform`` gets a list of (id, stored bytes) and returns the new
+    stored bytes for each (None to leave a row alone). Batches are
+    committed as they go, so an interrupted run can simply be restarted.
+    """
+    condition, params = extractor_rows(extractor)
+    rewritten = 0
+    
+    with db_connection() as read_conn, db_connection() as write_conn:
+        # Stream rows through a server-side cursor
+        with read_conn.cursor(name="rewrite_encodings") as read_cur, write_conn.cursor() as write_cur:
+            read_cur.itersize = batch_size
+            read_cur.execute(f"SELECT id, encoding FROM faces WHERE {condition} ORDER BY id", params)
             
-            # Convert all numpy values to Python native types for JSON serialization
-            recognized_faces.append({
-                "name": name,
-                "x": int(x),
-                "y": int(y),
-                "width": int(w),
-                "height": int(h),
-                "confidence": float(confidence)
-            })
+            while True:
+                rows = read_cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                
+                updates = [
+                    (psycopg2.Binary(encoding), face_id)
+                    for (face_id, _), encoding in zip(rows, transform(rows))
+                    if encoding is not None
+                ]
+                psycopg2.extras.execute_batch(write_cur, "UPDATE faces SET encoding = %s WHERE id = %s", updates)
+                write_conn.commit()
+                
+                rewritten += len(updates)
+                logger.info(f"Rewrote {rewritten} '{extractor.name}' encodings")
+    
+    return rewritten
+
+def migrate_encodings(extractor_name="pca", batch_size=500):
+    """Re-encode raw-pixel rows with a compact feature extractor.
+    
+    Raw encodings are the 100x100 grayscale crop itself, so each crop is
+    rebuilt from its row and passed through the new extractor. Rows are
+    updated in committed batches, so an interrupted run can simply be
+    restarted. When migrating to PCA without a fitted projection, one is
+    fitted from a sample of the raw crops first.
+    """
+    if extractor_name == "raw":
+        return {"success": False, "message": "Encodings are already stored as raw pixels"}
+    
+    raw = RawPixelExtractor()
+    
+    if extractor_name == "pca" and not os.path.exists(PCA_MODEL_PATH):
+        condition, params = extractor_rows(raw)
+        with db_connection() as conn, conn.cursor() as cur:
+            cur.execute(
+                f"SELECT encoding FROM faces WHERE {condition} ORDER BY random() LIMIT %(limit)s",
+                dict(params, limit=PCA_FIT_SAMPLE_SIZE)
+            )
+            crops = [decode_encoding(row[0], raw) for row in cur.fetchall()]
         
-        logger.info(f"Recognized {len(recognized_faces)} faces")
+        if not crops:
+            raise ValueError("No raw encodings found to fit the PCA projection from")
+        PCAExtractor.fit(crops).save()
+    
+    extractor = create_extractor(extractor_name)
+    
+    def re_encode(rows):
+        crops = np.stack([decode_encoding(encoding, raw) for _, encoding in rows])
+        return encode_encodings(extractor, extractor.extract(crops))
+    
+    migrated = _rewrite_encodings(raw, re_encode, batch_size)
+    remove_gallery_snapshot(extractor)
+    
+    return {
+        "success": True,
+        "extractor": extractor.name,
+        "dimension": extractor.dimension,
+        "migrated": migrated
+    }
+
+def convert_encodings(dtype=None, batch_size=500):
+    """Store the active extractor's encodings in the current format and dtype.
+    
+    Headerless legacy rows get a format header, and vectors stored as
+    another dtype are converted (FACE_ENCODING_DTYPE unless ``dtype`` is
+    given). Rows already in the target form are left alone.
+    """
+    extractor = get_extractor()
+    target = np.dtype(storage_dtype(extractor, dtype))
+    
+    def convert(rows):
+        encodings = [bytes(encoding) for _, encoding in rows]
+        stale = [
+            position for position, encoding in enumerate(encodings)
+            if encoding[:len(MAGIC)] != MAGIC or read_header(encoding).dtype != target
+        ]
+        converted = [None] * len(rows)
+        if stale:
+            vectors = np.stack([decode_encoding(encodings[position], extractor) for position in stale])
+            for position, encoding in zip(stale, encode_encodings(extractor, vectors, target.name)):
+                converted[position] = encoding
+        return converted
+    
+    converted = _rewrite_encodings(extractor, convert, batch_size)
+    if converted:
+        remove_gallery_snapshot(extractor)
+    
+    return {
+        "success": True,
+        "extractor": extractor.name,
+        "dtype": target.name,
+        "converted": converted
+    }
+
+OPERATIONS = {
+    "check-face": lambda request: check_face(request["image"], request.get("detector")),
+    "register-face": lambda request: register_face(request["image"], request["name"], request.get("detector")),
+    "register-faces": lambda request: {"results": register_faces(request["faces"], request.get("detector"))},
+    "recognize": lambda request: recognize_faces(request.get("image"), request.get("detector"), request.get("session")),
+    "end-session": lambda request: end_session(request["session"]),
+    "ping": lambda request: {"ok": True},
+    "stats": lambda request: {
+        "db_pool": pool_stats(),
+        "tracking_sessions": len(trackers),
+        "workers": pool.stats() if pool else None,
+        "identities": identities.stats() if IDENTITY_MATCHING else None,
+        "person": identities.describe(request["name"]) if IDENTITY_MATCHING and request.get("name") else None,
+    },
+}
+
+# Cheap operations answered by the reading thread instead of the worker pool
+INLINE_OPERATIONS = {"ping", "stats"}
+
+# Frame workers used by --serve
+pool = None
+
+def handle_request(request):
+    """Dispatch a single framed request to the matching operation.
+
+    Requests are dicts with an ``op`` key (``check-face``, ``register-face``,
+    ``register-faces``, ``recognize``, ``end-session``, ``ping`` or ``stats``) plus the
+    operation's inputs and an optional ``detector`` name. ``recognize``
+    requests that carry a ``session`` are tracked across frames. An optional ``id`` is echoed back so callers can
+    pipeline several requests.
+    """
+    request_id = request.get("id")
+    handler = OPERATIONS.get(request.get("op"))
+    
+    try:
+        if handler is None:
+            result = {"error": "No valid operation specified"}
+        else:
+            result = handler(request)
+    except Exception as e:
+        logger.error(f"Error handling {request.get('op')} request: {e}")
+        result = {"error": str(e)}
+    
+    if request_id is not None:
+        result = dict(result, id=request_id)
+    return result
+
+def _init_worker(detectors=None, workers=1, mode=WORKER_MODE, gallery_needed=True):
+    """Warm up frame workers: detectors, gallery and OpenCV threading."""
+    # The pool already runs one frame per core; OpenCV's own threads would
+    # only compete with it
+    if workers > 1:
+        cv2.setNumThreads(1)
+    preload_detectors(detectors, workers if mode == "thread" else 1)
+    if gallery_needed:
+        load_gallery()
+
+class Responder:
+    """Writes JSON responses from any thread, one line at a time."""
+    
+    def __init__(self, writer):
+        self.writer = writer
+        self.lock = threading.Lock()
+        self.pending = set()
+    
+    def __call__(self, response):
+        with self.lock:
+            self.writer.write(json.dumps(response) + "\n")
+            self.writer.flush()
+    
+    def dispatch(self, request):
+        """Answer a request, on the worker pool when there is one.
         
-        return {"faces": recognized_faces}
+        Requests without an ``id`` are answered in order on this thread,
+        since their responses couldn't be matched up otherwise. Requests
+        with a ``session`` are pinned to one worker process.
+        """
+        if pool is None or request.get("id") is None or request.get("op") in INLINE_OPERATIONS:
+            self(handle_request(request))
+            return
+        
+        future = pool.submit(handle_request, request, key=request.get("session"))
+        self.pending.add(future)
+        
+        def finished(future):
+            self.pending.discard(future)
+            try:
+                response = future.result()
+            except Exception as e:
+                logger.error(f"Worker failed on {request.get('op')} request: {e}")
+                response = {"error": str(e), "id": request["id"]}
+            self(response)
+        
+        future.add_done_callback(finished)
+    
+    def drain(self):
+        """Wait for every request still on the worker pool."""
+        wait(list(self.pending))
+
+def serve_stream(reader, writer):
+    """Answer newline-delimited JSON requests until the reader is exhausted."""
+    respond = Responder(writer)
+    for line in reader:
+        line = line.strip()
+        if not line:
+            continue
+        
+        try:
+            request = json.loads(line)
+        except ValueError as e:
+            respond({"error": f"Invalid request: {e}"})
+        else:
+            respond.dispatch(request)
+    
+    respond.drain()
+
+def serve_binary_stream(reader, writer):
+    """Answer length-prefixed binary requests until the reader is exhausted.
+    
+    Each frame carries a JSON header (the request without ``image``, plus
+    the image's ``format`` and, for raw pixels, its ``shape``) followed by
+    the image bytes, so no base64 text has to be built or parsed. Responses
+    are the same JSON lines as in text mode. A bad frame gets an error
+    response; only a stream that ends inside a frame stops the loop.
+    """
+    respond = Responder(writer)
+    while True:
+        try:
+            frame = read_frame(reader)
+        except FrameError as e:
+            # The stream ended inside a frame; there is nothing more to read
+            logger.error(f"Truncated binary frame: {e}")
+            respond({"error": f"Invalid frame: {e}"})
+            break
+        except FrameRejected as e:
+            # The frame was read past, so the next one is still in sync
+            logger.warning(f"Rejected binary frame: {e}")
+            response = {"error": f"Invalid frame: {e}"}
+            if e.header and e.header.get("id") is not None:
+                response["id"] = e.header["id"]
+            respond(response)
+            continue
+        
+        if frame is None:
+            break
+        
+        header, payload = frame
+        try:
+            request = frame_request(header, payload)
+        except Exception as e:
+            logger.error(f"Error decoding {header.get('op')} frame: {e}")
+            response = {"error": str(e)}
+            if header.get("id") is not None:
+                response["id"] = header["id"]
+            respond(response)
+        else:
+            respond.dispatch(request)
+    
+    respond.drain()
+
+def serve_socket(socket_path, binary=False):
+    """Serve framed requests on a local Unix domain socket."""
+    import socketserver
+    
+    class RequestHandler(socketserver.StreamRequestHandler):
+        def handle(self):
+            writer = io.TextIOWrapper(self.wfile, encoding='utf-8')
+            if binary:
+                serve_binary_stream(self.rfile, writer)
+            else:
+                serve_stream(io.TextIOWrapper(self.rfile, encoding='utf-8'), writer)
+    
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    
+    with socketserver.ThreadingUnixStreamServer(socket_path, RequestHandler) as server:
+        logger.info(f"Face recognition service listening on {socket_path}")
+        try:
+            server.serve_forever()
+        finally:
+            os.unlink(socket_path)
+
+def search_index_path(index):
+    """Location of the persisted ANN index for the configured backend."""
+    return SEARCH_INDEX_PATH or data_path(f"face_index_{index.kind}.faiss")
+
+def gallery_snapshot_path(extractor=None):
+    """Location of the gallery snapshot for a feature extractor (the active one by default)."""
+    return GALLERY_SNAPSHOT_PATH or data_path(f"gallery_{(extractor or get_extractor()).name}.snapshot")
+
+def count_faces_up_to(last_id, pending=()):
+    """Number of rows with an id up to last_id and outside the pending ranges, whatever their extractor."""
+    pending_condition, params = pending_ids_condition(pending)
+    with db_connection() as conn, conn.cursor() as cur:
+        cur.execute(
+            f"SELECT count(*) FROM faces WHERE id <= %(last_id)s AND NOT ({pending_condition})",
+            dict(params, last_id=last_id)
+        )
+        return cur.fetchone()[0]
+
+def load_gallery_snapshot():
+    """Map the gallery snapshot into the still empty gallery, if it is current.
+    
+    A snapshot is current when it was written for the active extractor and
+    no row up to its last id has been deleted since. Faces registered
+    after it, or committed late into its pending ids, are left to the
+    next refresh.
+    """
+    if not GALLERY_SNAPSHOT or len(gallery) > 0:
+        return False
+    
+    extractor = get_extractor()
+    
+    def is_current(header):
+        return (
+            header.get("extractor") == extractor.name
+            and (header["count"] == 0 or header["dimension"] == extractor.dimension)
+            and header.get("faces") == count_faces_up_to(header["last_id"], header.get("pending", []))
+        )
+    
+    try:
+        return gallery.load_snapshot(gallery_snapshot_path(extractor), is_current)
     except Exception as e:
-        logger.error(f"Error recognizing faces: {e}")
+        logger.error(f"Error loading gallery snapshot: {e}")
         raise
 
+def save_gallery_snapshot():
+    """Write the loaded gallery to its snapshot file for other processes to map."""
+    path = gallery_snapshot_path()
+    header = gallery.save_snapshot(path, {
+        "extractor": get_extractor().name,
+        "faces": count_faces_up_to(gallery.last_id, gallery.watermark.pending())
+    })
+    return {"success": True, "path": path, "size": header["count"], "last_id": header["last_id"]}
+
+def remove_gallery_snapshot(extractor=None):
+    """Drop a snapshot whose encodings no longer match the stored ones."""
+    path = gallery_snapshot_path(extractor)
+    if os.path.exists(path):
+        os.remove(path)
+        logger.info(f"Removed gallery snapshot {path}")
+
+def prepare_gallery_snapshot(min_delta=GALLERY_SNAPSHOT_MIN_DELTA):
+    """Load the gallery and bring its snapshot up to date before workers start.
+    
+    The snapshot is rewritten when there is no current one, or when at
+    least ``min_delta`` of the loaded faces had to come from the database.
+    """
+    if not GALLERY_SNAPSHOT:
+        return None
+    
+    mapped = load_gallery_snapshot()
+    in_snapshot = len(gallery)
+    gallery.refresh(force=True)
+    
+    if not mapped or len(gallery) - in_snapshot >= min_delta:
+        return save_gallery_snapshot()
+    return None
+
+def load_gallery():
+    """Load the whole gallery and prepare what probes are matched with.
+    
+    The gallery starts from its snapshot when there is a current one, so
+    only faces registered since it was written are read from the database.
+    Probes go either through the identities or through the configured ANN
+    index, so only the one in use is built.
+    """
+    load_gallery_snapshot()
+    gallery.refresh(force=True)
+    if IDENTITY_MATCHING:
+        identities.sync()
+        return
+    index = create_index()
+    gallery.attach_index(index, search_index_path(index) if index else None)
+
+def build_search_index():
+    """Build the configured ANN index from the database and save it."""
+    gallery.refresh(force=True)
+    index = create_index()
+    if index is None:
+        return {"success": False, "message": "Exact search is configured; there is no index to build"}
+    if IDENTITY_MATCHING:
+        return {"success": False, "message": "Probes are matched by identity (FACE_IDENTITY_MATCHING=1); the row index would not be used"}
+    
+    gallery.attach_index(index)
+    path = search_index_path(index)
+    gallery.save_index(path)
+    return {"success": True, "backend": index.kind, "size": index.ntotal, "path": path}
+
+def serve(socket_path=None, detectors=None, binary=False, workers=WORKERS, mode=WORKER_MODE):
+    """Run as a long-lived worker, keeping the interpreter and models warm.
+    
+    Requests are processed concurrently by a pool of ``workers`` threads or
+    processes; once it is full, reading stops until a frame finishes.
+    """
+    global pool
+    ensure_schema()
+    # Workers map the snapshot written here instead of each reading the database
+    prepare_gallery_snapshot()
+    pool = WorkerPool(workers, mode, initializer=_init_worker, initargs=(detectors, workers, mode))
+    
+    try:
+        if socket_path:
+            serve_socket(socket_path, binary)
+        elif binary:
+            logger.info("Face recognition service reading binary frames from stdin")
+            serve_binary_stream(sys.stdin.buffer, sys.stdout)
+        else:
+            logger.info("Face recognition service reading requests from stdin")
+            serve_stream(sys.stdin, sys.stdout)
+    finally:
+        pool.shutdown()
+        # Hand the database connections back before the worker exits
+        close_pool()
+
 def main():
     """Main entry point for the script."""
     parser = argparse.ArgumentParser(description='Face Recognition Service')
     parser.add_argument('--check-face', action='store_true', help='Check if image contains a face')
     parser.add_argument('--register-face', metavar='NAME', help='Register a face with the given name')
     parser.add_argument('--recognize', action='store_true', help='Recognize faces in the image')
+    parser.add_argument('--serve', action='store_true', help='Serve newline-delimited JSON requests until stdin closes')
+    parser.add_argument('--socket', metavar='PATH', help='With --serve, listen on a Unix domain socket instead of stdin')
+    parser.add_argument('--binary', action='store_true', help='With --serve, read length-prefixed binary frames instead of JSON lines')
+    parser.add_argument('--detector', metavar='NAME', help='Face detector to use (see detectors.DETECTOR_FACTORIES)')
+    parser.add_argument('--preload', metavar='NAME', action='append', help='With --serve, detector to load at startup (repeatable)')
+    parser.add_argument('--build-index', action='store_true', help='Build and save the ANN search index (FACE_SEARCH_BACKEND)')
+    parser.add_argument('--save-snapshot', action='store_true', help='Write the memory-mapped gallery snapshot (FACE_GALLERY_SNAPSHOT_PATH)')
+    parser.add_argument('--batch', action='store_true', help='Recognize one image per stdin line (base64 or JSON), streaming JSON lines')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='With --batch, images matched per gallery search')
+    parser.add_argument('--workers', type=int, help='Frames processed concurrently by --serve and --batch (FACE_WORKERS)')
+    parser.add_argument('--worker-mode', choices=['thread', 'process'], default=WORKER_MODE,
+                        help='Run frame workers as threads or processes (FACE_WORKER_MODE)')
+    parser.add_argument('--migrate-encodings', metavar='EXTRACTOR', nargs='?', const='pca',
+                        help='Re-encode raw-pixel rows with a compact feature extractor (pca or dnn)')
+    parser.add_argument('--convert-encodings', metavar='DTYPE', nargs='?', const='',
+                        help='Rewrite stored encodings in the current format (FACE_ENCODING_DTYPE unless given)')
     
     args = parser.parse_args()
     
+    if args.serve:
+        serve(args.socket, args.preload or ([args.detector] if args.detector else None), args.binary,
+              args.workers or WORKERS, args.worker_mode)
+        return
+    
+    if args.build_index:
+        ensure_schema()
+        print(json.dumps(build_search_index()))
+        return
+    
+    if args.save_snapshot:
+        ensure_schema()
+        load_gallery_snapshot()
+        gallery.refresh(force=True)
+        print(json.dumps(save_gallery_snapshot()))
+        return
+    
+    if args.batch:
+        ensure_schema()
+        load_gallery_snapshot()
+        recognize_batch(sys.stdin, sys.stdout, args.batch_size, args.workers or BATCH_WORKERS, args.detector,
+                        args.worker_mode)
+        return
+    
+    if args.migrate_encodings:
+        ensure_schema()
+        print(json.dumps(migrate_encodings(args.migrate_encodings)))
+        return
+    
+    if args.convert_encodings is not None:
+        ensure_schema()
+        print(json.dumps(convert_encodings(args.convert_encodings or None)))
+        return
+    
     try:
-        # Initialize database
-        initialize_database()
+        # Make sure the schema exists (a no-op once it has been verified)
+        ensure_schema()
+        if args.recognize or args.register_face:
+            load_gallery_snapshot()
         
         # Read base64 image from stdin
         base64_image = sys.stdin.buffer.read().decode('utf-8')
         
         # Process request based on command line arguments
         if args.check_face:
-            result = check_face(base64_image)
+            result = check_face(base64_image, args.detector)
             print(json.dumps(result))
         elif args.register_face:
-            result = register_face(base64_image, args.register_face)
+            result = register_face(base64_image, args.register_face, args.detector)
             print(json.dumps(result))
         elif args.recognize:
-            result = recognize_faces(base64_image)
+            result = recognize_faces(base64_image, args.detector)
             print(json.dumps(result))
         else:
             print(json.dumps({"error": "No valid operation specified"}))
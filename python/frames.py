@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+import os
+import json
+import struct
+import logging
+import numpy as np
+import cv2
+from face_features import CROP_SIZE
+
+logger = logging.getLogger("frames")
+
+# Every binary frame starts with the JSON header's length and the payload's
+# length, as big-endian unsigned 32-bit integers
+FRAME_PREFIX = struct.Struct(">II")
+
+# Largest header and payload a frame may declare (bytes)
+MAX_HEADER_BYTES = int(os.getenv("FACE_FRAME_MAX_HEADER_BYTES", str(64 * 1024)))
+MAX_PAYLOAD_BYTES = int(os.getenv("FACE_FRAME_MAX_PAYLOAD_BYTES", str(32 * 1024 * 1024)))
+
+# Payload formats: compressed images, or raw 8-bit pixel buffers described
+# by the header's "shape" ([height, width])
+ENCODED_FORMATS = ("jpeg", "png", "encoded")
+RAW_FORMATS = {
+    "gray": (1, None),
+    "bgr": (3, cv2.COLOR_BGR2GRAY),
+    "rgb": (3, cv2.COLOR_RGB2GRAY),
+    "bgra": (4, cv2.COLOR_BGRA2GRAY),
+    "rgba": (4, cv2.COLOR_RGBA2GRAY),
+}
+
+# JPEG decoding can skip detail at these factors (DCT scaling), which is far
+# cheaper than a full decode followed by a resize
+REDUCED_GRAYSCALE_MODES = (
+    (8, cv2.IMREAD_REDUCED_GRAYSCALE_8),
+    (4, cv2.IMREAD_REDUCED_GRAYSCALE_4),
+    (2, cv2.IMREAD_REDUCED_GRAYSCALE_2),
+)
+
+# Set to 0 to always decode frames at full resolution
+REDUCED_DECODE = os.getenv("FACE_REDUCED_DECODE", "1") != "0"
+
+# JPEG start-of-frame markers (every SOFn except DHT, JPG and DAC)
+_JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+# Bytes read at a time while skipping a rejected frame
+SKIP_CHUNK_BYTES = 64 * 1024
+
+class FrameError(ValueError):
+    """A binary frame was truncated; the stream can't be read any further."""
+
+class FrameRejected(ValueError):
+    """A complete frame was skipped for breaking the limits; the stream is still in sync.
+
+    ``header`` is the frame's JSON header when it could be read, so the
+    error can be answered under the request's id.
+    """
+
+    def __init__(self, message, header=None):
+        super().__init__(message)
+        self.header = header
+
+def jpeg_size(data):
+    """(width, height) from a JPEG's frame header, or None if it can't be found."""
+    view = memoryview(data)
+    if len(view) < 4 or view[0] != 0xFF or view[1] != 0xD8:
+        return None
+
+    position = 2
+    while position + 4 <= len(view):
+        if view[position] != 0xFF:
+            return None
+        marker = view[position + 1]
+        if marker == 0xFF:
+            position += 1
+            continue
+        if marker in (0x01, 0xD0, 0xD1, 0xD2, 0xD3, 0xD4, 0xD5, 0xD6, 0xD7):
+            position += 2
+            continue
+
+        length = (view[position + 2] << 8) | view[position + 3]
+        if marker in _JPEG_SOF_MARKERS:
+            if position + 9 > len(view):
+                return None
+            height = (view[position + 5] << 8) | view[position + 6]
+            width = (view[position + 7] << 8) | view[position + 8]
+            return width, height
+        position += 2 + length
+    return None
+
+class GrayFrame:
+    """A grayscale frame, possibly decoded at a reduced resolution.
+
+    Detection runs on ``image``; ``size`` is the original (width, height)
+    that face boxes refer to. Face crops are cut from the reduced image
+    when it still has at least CROP_SIZE pixels across the face, otherwise
+    from a full-resolution decode made the first time one is needed.
+    """
+
+    def __init__(self, image, data=None, size=None):
+        self.image = image
+        self.size = size or (image.shape[1], image.shape[0])
+        self.scale = image.shape[1] / self.size[0]
+        self._data = data
+        self._full = image if self.scale == 1 else None
+
+    @property
+    def reduced(self):
+        return self.scale < 1
+
+    def full(self):
+        """The full-resolution grayscale image, decoded on first use."""
+        if self._full is None:
+            self._full = cv2.imdecode(np.frombuffer(self._data, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+            if self._full is None:
+                raise ValueError("Failed to decode image data")
+        return self._full
+
+    def crops(self, boxes):
+        """Standard-size crops for full-resolution (x, y, w, h) boxes."""
+        crops = []
+        for x, y, w, h in boxes:
+            if self.reduced and min(w, h) * self.scale >= CROP_SIZE:
+                s = self.scale
+                region = self.image[int(y * s):int((y + h) * s), int(x * s):int((x + w) * s)]
+            else:
+                region = self.full()[y:y+h, x:x+w]
+            crops.append(cv2.resize(region, (CROP_SIZE, CROP_SIZE)))
+        return np.stack(crops)
+
+def decode_gray(data, min_width=0):
+    """Decode JPEG/PNG bytes straight to a grayscale GrayFrame.
+
+    With ``min_width`` set, JPEGs are decoded at the largest reduction that
+    keeps the frame at least that wide, since detection would downscale it
+    to that width anyway.
+
+    Rotated JPEGs come out upright, at full and reduced resolution alike,
+    so ``size`` is the upright size as well.
+    """
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    size = jpeg_size(data) if REDUCED_DECODE and min_width else None
+
+    if size is not None:
+        for factor, mode in REDUCED_GRAYSCALE_MODES:
+            if size[0] // factor >= min_width:
+                image = cv2.imdecode(buffer, mode)
+                if image is not None:
+                    # imdecode applies the EXIF orientation, and the frame
+                    # header doesn't: a quarter turn swaps the full size too
+                    width, height = size
+                    if (image.shape[1] > image.shape[0]) != (width > height):
+                        size = (height, width)
+                    return GrayFrame(image, data, size)
+                break
+
+    image = cv2.imdecode(buffer, cv2.IMREAD_GRAYSCALE)
+    if image is None:
+        raise ValueError("Failed to decode image data")
+    return GrayFrame(image, data)
+
+def _read_exact(stream, size):
+    """Read exactly ``size`` bytes into a fresh buffer, or None at a clean EOF."""
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = stream.readinto(view[received:])
+        if not count:
+            if received == 0:
+                return None
+            raise FrameError(f"Stream ended after {received} of {size} bytes")
+        received += count
+    return buffer
+
+def _skip(stream, size):
+    """Read and discard ``size`` bytes."""
+    buffer = bytearray(min(size, SKIP_CHUNK_BYTES))
+    view = memoryview(buffer)
+    remaining = size
+    while remaining:
+        count = stream.readinto(view[:min(remaining, len(buffer))])
+        if not count:
+            raise FrameError(f"Stream ended after {size - remaining} of {size} bytes")
+        remaining -= count
+
+def _parse_header(header):
+    """The JSON object in a frame header; raises FrameRejected if it isn't one."""
+    try:
+        header = json.loads(header) if header else {}
+    except ValueError as e:
+        raise FrameRejected(f"Header is not valid JSON: {e}")
+    if not isinstance(header, dict):
+        raise FrameRejected("Header is not a JSON object")
+    return header
+
+def read_frame(stream):
+    """Read one length-prefixed frame from a binary stream.
+
+    Returns the decoded JSON header and the raw payload (a bytearray,
+    possibly empty), or None once the stream is exhausted. A frame that is
+    too large or whose header isn't a JSON object is read past and
+    rejected, so the next frame can still be read.
+    """
+    prefix = _read_exact(stream, FRAME_PREFIX.size)
+    if prefix is None:
+        return None
+
+    header_size, payload_size = FRAME_PREFIX.unpack(prefix)
+    too_large = f"Frame too large ({header_size} byte header, {payload_size} byte payload)"
+    if header_size > MAX_HEADER_BYTES:
+        _skip(stream, header_size + payload_size)
+        raise FrameRejected(too_large)
+
+    header = _read_exact(stream, header_size) if header_size else bytearray()
+    if header is None:
+        raise FrameError("Stream ended inside a frame")
+
+    if payload_size > MAX_PAYLOAD_BYTES:
+        _skip(stream, payload_size)
+        try:
+            header = _parse_header(header)
+        except FrameRejected:
+            header = None
+        raise FrameRejected(too_large, header)
+
+    payload = _read_exact(stream, payload_size) if payload_size else bytearray()
+    if payload is None:
+        raise FrameError("Stream ended inside a frame")
+    return _parse_header(header), payload
+
+def write_frame(stream, header, payload=b""):
+    """Write one frame; the counterpart of read_frame."""
+    encoded = json.dumps(header).encode("utf-8")
+    stream.write(FRAME_PREFIX.pack(len(encoded), len(payload)))
+    stream.write(encoded)
+    stream.write(payload)
+
+def decode_payload(payload, image_format="encoded", shape=None):
+    """Turn a frame payload into something the service can load as a frame.
+
+    JPEG/PNG payloads are returned as bytes so decoding can pick a reduced
+    resolution for the operation (see decode_gray). Raw pixel buffers are
+    viewed in place as a grayscale image; colour buffers are converted once,
+    into a new array. The request may wait on the worker pool while the
+    reading thread decodes later frames, so it can't share a reused buffer.
+    """
+    if not payload:
+        raise ValueError("Empty image payload")
+
+    if image_format in ENCODED_FORMATS:
+        return payload
+
+    data = np.frombuffer(payload, dtype=np.uint8)
+
+    if image_format not in RAW_FORMATS:
+        raise ValueError(f"Unknown image format: {image_format}")
+    if not shape or len(shape) < 2:
+        raise ValueError(f"Raw '{image_format}' frames need a [height, width] shape")
+
+    channels, conversion = RAW_FORMATS[image_format]
+    height, width = int(shape[0]), int(shape[1])
+    if data.size != height * width * channels:
+        raise ValueError(
+            f"Payload has {data.size} bytes, expected {height * width * channels} for "
+            f"{height}x{width} {image_format}"
+        )
+
+    if channels == 1:
+        return data.reshape(height, width)
+    return cv2.cvtColor(data.reshape(height, width, channels), conversion)
+
+def frame_request(header, payload):
+    """Build a worker request from a binary frame, decoding any image payload."""
+    request = dict(header)
+    if payload:
+        request["image"] = decode_payload(payload, request.pop("format", "encoded"), request.pop("shape", None))
+    return request
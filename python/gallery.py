@@ -0,0 +1,478 @@
+#!/usr/bin/env python3
+import os
+import json
+import struct
+import functools
+import logging
+import threading
+import time
+import numpy as np
+from watermark import IdWatermark
+
+logger = logging.getLogger("gallery")
+
+# Rows of a batch compared with each other at once when looking for duplicates
+DUPLICATE_BLOCK_SIZE = 1024
+
+# Nearest gallery faces checked per new face when duplicates under the
+# same name don't count
+DUPLICATE_NEIGHBOURS = 8
+
+# Gallery snapshots start with this magic and the length of a JSON header;
+# the sections after it (encodings, squared norms, ids, names) start on
+# SNAPSHOT_ALIGNMENT-byte boundaries so they can be mapped in place
+SNAPSHOT_MAGIC = b"FTGS"
+SNAPSHOT_VERSION = 1
+SNAPSHOT_PREAMBLE = struct.Struct("<4sI")
+SNAPSHOT_ALIGNMENT = 64
+
+def _aligned(offset):
+    return -(-offset // SNAPSHOT_ALIGNMENT) * SNAPSHOT_ALIGNMENT
+
+def read_snapshot_header(path):
+    """The JSON header of a gallery snapshot, or None if there is no valid one."""
+    try:
+        with open(path, "rb") as f:
+            magic, header_size = SNAPSHOT_PREAMBLE.unpack(f.read(SNAPSHOT_PREAMBLE.size))
+            if magic != SNAPSHOT_MAGIC:
+                return None
+            header = json.loads(f.read(header_size))
+    except (OSError, ValueError, struct.error):
+        return None
+    if header.get("version") != SNAPSHOT_VERSION:
+        return None
+    header["data_offset"] = _aligned(SNAPSHOT_PREAMBLE.size + header_size)
+    return header
+
+def euclidean_distances(queries, matrix, sq_norms=None):
+    """Distances from each query row to every matrix row, as one matrix product."""
+    queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+    if sq_norms is None:
+        sq_norms = np.einsum('ij,ij->i', matrix, matrix)
+
+    # ||q - k||^2 = ||q||^2 - 2 q.k + ||k||^2, for all pairs at once
+    sq_distances = queries @ matrix.T
+    sq_distances *= -2.0
+    sq_distances += np.einsum('ij,ij->i', queries, queries)[:, None]
+    sq_distances += sq_norms[None, :]
+    np.maximum(sq_distances, 0.0, out=sq_distances)
+    return np.sqrt(sq_distances, out=sq_distances)
+
+def earlier_neighbours(encodings, threshold, block_size=DUPLICATE_BLOCK_SIZE, groups=None):
+    """For each row, the closest earlier row within ``threshold`` (-1 if none).
+
+    Rows are compared with all the rows before them a block at a time, so
+    deduplicating an import is a few matrix products instead of one search
+    per row. With ``groups`` (one integer per row), rows of the same group
+    are never each other's neighbours.
+    """
+    encodings = np.atleast_2d(np.asarray(encodings, dtype=np.float32))
+    neighbours = np.full(len(encodings), -1, dtype=np.int64)
+    distances = np.full(len(encodings), np.inf, dtype=np.float32)
+    sq_norms = np.einsum('ij,ij->i', encodings, encodings)
+
+    for start in range(0, len(encodings), block_size):
+        end = min(start + block_size, len(encodings))
+        block = euclidean_distances(encodings[start:end], encodings[:end], sq_norms[:end])
+        # Only rows before each one count
+        block[np.arange(end - start)[:, None] + start <= np.arange(end)[None, :]] = np.inf
+        if groups is not None:
+            block[groups[start:end, None] == groups[None, :end]] = np.inf
+
+        nearest = block.argmin(axis=1)
+        nearest_distances = block[np.arange(end - start), nearest]
+        close = nearest_distances < threshold
+        neighbours[start:end][close] = nearest[close]
+        distances[start:end][close] = nearest_distances[close]
+
+    return neighbours, distances
+
+def _read_names(blob, offsets, start, stop):
+    """Names ``start:stop`` of a snapshot, from its offsets and UTF-8 blob."""
+    bounds = offsets[start:stop + 1].tolist()
+    data = blob[bounds[0]:bounds[-1]].tobytes()
+    return [data[begin - bounds[0]:end - bounds[0]].decode("utf-8") for begin, end in zip(bounds, bounds[1:])]
+
+class MappedColumn:
+    """A gallery column (ids or names) read from a snapshot on demand, plus appended values.
+
+    ``read(start, stop)`` returns the snapshot's values in that range as a
+    list, so opening a snapshot doesn't build a Python object per row.
+    """
+
+    def __init__(self, size, read):
+        self._size = size
+        self._read = read
+        self._added = []
+
+    def __len__(self):
+        return self._size + len(self._added)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if step != 1:
+                return self[start:stop][::step]
+            values = self._read(start, min(stop, self._size)) if start < self._size else []
+            return values + self._added[max(start - self._size, 0):max(stop - self._size, 0)]
+
+        if key < 0:
+            key += len(self)
+        if not 0 <= key < len(self):
+            raise IndexError("gallery row out of range")
+        return self._read(key, key + 1)[0] if key < self._size else self._added[key - self._size]
+
+    def __iter__(self):
+        return iter(self[:])
+
+    def append(self, value):
+        self._added.append(value)
+
+class FaceGallery:
+    """In-memory index of enrolled face encodings.
+
+    All encodings live in one contiguous float32 matrix (grown by doubling),
+    with their squared norms cached, so a batch of probes is matched against
+    the whole gallery with a single matrix product. Rows are pulled from the
+    database incrementally: ``refresh`` only asks for ids above the highest
+    one already loaded.
+
+    An approximate index (see ann_index) can be attached for large
+    galleries; exact search is used whenever it isn't built yet.
+
+    The gallery can start from a snapshot file (``load_snapshot``). Its
+    rows are memory-mapped read-only, so processes loading the same
+    snapshot share one copy in the page cache, and rows added afterwards
+    go to a separate in-memory matrix instead of copying the mapped one.
+    """
+
+    def __init__(self, fetch_rows, refresh_interval=0.0):
+        # fetch_rows(after_id, pending) -> iterable of (id, name, encoding) ordered
+        # by id, for ids above after_id or in the pending (low, high) ranges
+        self._fetch_rows = fetch_rows
+        self.refresh_interval = refresh_interval
+        self._lock = threading.RLock()
+        # Rows mapped from a snapshot, followed by the rows added since
+        self._base = None
+        self._base_sq_norms = None
+        self._matrix = None
+        self._sq_norms = None
+        self._size = 0
+        self.ids = []
+        self.names = []
+        # Ids added since the snapshot; the snapshot holds every id up to its
+        # last_id except the ones still pending when it was written
+        self._known_ids = set()
+        self._snapshot_last_id = 0
+        self.watermark = IdWatermark()
+        self._last_refresh = None
+        self.index = None
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def last_id(self):
+        return self.watermark.last_id
+
+    @property
+    def dimension(self):
+        for matrix in (self._base, self._matrix):
+            if matrix is not None:
+                return matrix.shape[1]
+        return None
+
+    @property
+    def _base_size(self):
+        return 0 if self._base is None else len(self._base)
+
+    def _segments(self):
+        """(encodings, squared norms) of the mapped rows and of the rows added since."""
+        segments = []
+        if self._base is not None:
+            segments.append((self._base, self._base_sq_norms))
+        if self._matrix is not None:
+            tail_size = self._size - self._base_size
+            segments.append((self._matrix[:tail_size], self._sq_norms[:tail_size]))
+        return segments
+
+    def rows_from(self, start):
+        """Encodings from row ``start`` on; copies only if they span both segments."""
+        with self._lock:
+            parts = []
+            offset = 0
+            for matrix, _ in self._segments():
+                if start < offset + len(matrix):
+                    parts.append(matrix[max(start - offset, 0):])
+                offset += len(matrix)
+            if not parts:
+                return np.empty((0, self.dimension or 0), dtype=np.float32)
+            return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+    def take(self, positions):
+        """Encodings and squared norms of the given rows, gathered from both segments."""
+        positions = np.asarray(positions, dtype=np.int64)
+        with self._lock:
+            segments = self._segments()
+            dimension = self.dimension or 0
+        encodings = np.empty((len(positions), dimension), dtype=np.float32)
+        sq_norms = np.empty(len(positions), dtype=np.float32)
+        offset = 0
+        for matrix, segment_sq_norms in segments:
+            inside = (positions >= offset) & (positions < offset + len(matrix))
+            encodings[inside] = matrix[positions[inside] - offset]
+            sq_norms[inside] = segment_sq_norms[positions[inside] - offset]
+            offset += len(matrix)
+        return encodings, sq_norms
+
+    @property
+    def matrix(self):
+        """The loaded encodings, one row per enrolled face."""
+        return self.rows_from(0)
+
+    def _reserve(self, dimension, extra):
+        tail_size = self._size - self._base_size
+        if self.dimension is not None and self.dimension != dimension:
+            raise ValueError(
+                f"Encoding has {dimension} dimensions, gallery expects {self.dimension}"
+            )
+        if self._matrix is None:
+            capacity = max(extra, 64)
+            self._matrix = np.empty((capacity, dimension), dtype=np.float32)
+            self._sq_norms = np.empty(capacity, dtype=np.float32)
+        elif tail_size + extra > len(self._matrix):
+            capacity = max(tail_size + extra, 2 * len(self._matrix))
+            matrix = np.empty((capacity, dimension), dtype=np.float32)
+            matrix[:tail_size] = self._matrix[:tail_size]
+            sq_norms = np.empty(capacity, dtype=np.float32)
+            sq_norms[:tail_size] = self._sq_norms[:tail_size]
+            self._matrix, self._sq_norms = matrix, sq_norms
+
+    def add_many(self, rows):
+        """Append (id, name, encoding) rows, skipping ids already loaded."""
+        with self._lock:
+            rows = [
+                row for row in rows
+                if row[0] not in self._known_ids
+                and (row[0] > self._snapshot_last_id or self.watermark.is_pending(row[0]))
+            ]
+            if not rows:
+                return 0
+
+            encodings = np.stack([np.asarray(encoding, dtype=np.float32) for _, _, encoding in rows])
+            self._reserve(encodings.shape[1], len(rows))
+
+            start = self._size - self._base_size
+            end = start + len(rows)
+            self._matrix[start:end] = encodings
+            self._sq_norms[start:end] = np.einsum('ij,ij->i', encodings, encodings)
+            self._size += len(rows)
+
+            for face_id, name, _ in rows:
+                self.ids.append(face_id)
+                self.names.append(name)
+                self._known_ids.add(face_id)
+            self.watermark.advance([face_id for face_id, _, _ in rows])
+
+            if self.index is not None:
+                self.index.sync(self.rows_from, len(self))
+
+            return len(rows)
+
+    def add(self, face_id, name, encoding):
+        """Add a single newly registered face."""
+        return self.add_many([(face_id, name, encoding)])
+
+    def refresh(self, force=False):
+        """Load faces registered since the last refresh, or committed late below it."""
+        with self._lock:
+            now = time.monotonic()
+            if (not force and self._last_refresh is not None
+                    and now - self._last_refresh < self.refresh_interval):
+                return 0
+
+            added = self.add_many(list(self._fetch_rows(self.last_id, self.watermark.pending())))
+            self._last_refresh = now
+
+        if added:
+            logger.info(f"Loaded {added} new face encodings (gallery size: {len(self)})")
+        return added
+
+    def distances(self, queries):
+        """Euclidean distances from each query row to every gallery row."""
+        with self._lock:
+            segments = self._segments()
+        parts = [euclidean_distances(queries, matrix, sq_norms) for matrix, sq_norms in segments]
+        return parts[0] if len(parts) == 1 else np.concatenate(parts, axis=1)
+
+    def save_snapshot(self, path, meta=None):
+        """Write every loaded row to a snapshot file, then serve from its mapping.
+
+        ``meta`` is stored in the header for whoever loads it to check. The
+        file is written next to ``path`` and renamed over it, so processes
+        still mapping an older snapshot keep reading that one.
+        """
+        with self._lock:
+            count, dimension = len(self), self.dimension or 0
+            names = [name.encode("utf-8") for name in self.names]
+            name_offsets = np.zeros(count + 1, dtype=np.int64)
+            np.cumsum([len(name) for name in names], out=name_offsets[1:])
+
+            # Section offsets, relative to the aligned end of the header
+            offsets = {"encodings": 0}
+            offsets["sq_norms"] = _aligned(offsets["encodings"] + 4 * count * dimension)
+            offsets["ids"] = _aligned(offsets["sq_norms"] + 4 * count)
+            offsets["name_offsets"] = _aligned(offsets["ids"] + 8 * count)
+            offsets["names"] = _aligned(offsets["name_offsets"] + 8 * (count + 1))
+
+            header = dict(meta or {}, version=SNAPSHOT_VERSION, count=count, dimension=dimension,
+                          last_id=self.last_id, pending=self.watermark.pending(), offsets=offsets)
+            header_bytes = json.dumps(header).encode("utf-8")
+            data_offset = _aligned(SNAPSHOT_PREAMBLE.size + len(header_bytes))
+
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(SNAPSHOT_PREAMBLE.pack(SNAPSHOT_MAGIC, len(header_bytes)) + header_bytes)
+                segments = self._segments()
+                for section, parts in (
+                    ("encodings", [matrix for matrix, _ in segments]),
+                    ("sq_norms", [sq_norms for _, sq_norms in segments]),
+                    ("ids", [np.asarray(self.ids[:], dtype=np.int64)]),
+                    ("name_offsets", [name_offsets]),
+                    ("names", [b"".join(names)]),
+                ):
+                    f.write(b"\0" * (data_offset + offsets[section] - f.tell()))
+                    for part in parts:
+                        f.write(part if isinstance(part, bytes) else np.ascontiguousarray(part).tobytes())
+            os.replace(tmp_path, path)
+
+            self._map_snapshot(path, header, data_offset)
+        logger.info(f"Saved gallery snapshot with {count} encodings (up to id {header['last_id']}) to {path}")
+        return header
+
+    def load_snapshot(self, path, is_current=None):
+        """Start an empty gallery from a snapshot file.
+
+        ``is_current(header)`` can reject a snapshot that no longer matches
+        the database; rows above its ``last_id``, and pending ids below it
+        that commit later, come in with the next ``refresh``.
+        """
+        header = read_snapshot_header(path)
+        if header is None:
+            return False
+        if is_current is not None and not is_current(header):
+            logger.warning(f"Ignoring stale gallery snapshot at {path}")
+            return False
+
+        with self._lock:
+            if len(self) > 0:
+                raise ValueError("A snapshot can only be loaded into an empty gallery")
+            self._map_snapshot(path, header, header["data_offset"])
+        logger.info(f"Mapped gallery snapshot with {len(self)} encodings (up to id {self.last_id}) from {path}")
+        return True
+
+    def _map_snapshot(self, path, header, data_offset):
+        count, dimension, offsets = header["count"], header["dimension"], header["offsets"]
+
+        def section(name, dtype, shape):
+            return np.memmap(path, dtype=dtype, mode="r", offset=data_offset + offsets[name], shape=shape)
+
+        if count:
+            base = section("encodings", np.float32, (count, dimension))
+            sq_norms = section("sq_norms", np.float32, (count,))
+            ids = section("ids", np.int64, (count,))
+            name_offsets = section("name_offsets", np.int64, (count + 1,))
+            names = section("names", np.uint8, (int(name_offsets[-1]),)) if name_offsets[-1] else b""
+        else:
+            base = sq_norms = ids = name_offsets = names = None
+
+        self._base, self._base_sq_norms = base, sq_norms
+        self._matrix = self._sq_norms = None
+        self._size = count
+        self.ids = MappedColumn(count, lambda start, stop: ids[start:stop].tolist())
+        self.names = MappedColumn(count, functools.partial(_read_names, names, name_offsets))
+        self._known_ids = set()
+        self._snapshot_last_id = header["last_id"]
+        self.watermark.restore(header["last_id"], header.get("pending", []))
+        if self.index is not None:
+            self.index.sync(self.rows_from, len(self))
+
+    def attach_index(self, index, path=None):
+        """Serve searches from an ANN index, reusing a saved copy if possible."""
+        with self._lock:
+            self.index = index
+            if index is None:
+                return
+
+            if path and index.load(path, self.ids, self.dimension):
+                index.sync(self.rows_from, len(self))
+            else:
+                index.sync(self.rows_from, len(self))
+                if path and index.ready:
+                    index.save(path, self.ids)
+
+    def save_index(self, path):
+        """Persist the attached index, building it first if necessary."""
+        with self._lock:
+            if not self.index.ready:
+                self.index.build(self.matrix)
+            self.index.save(path, self.ids)
+
+    def knn(self, queries, k=1):
+        """Return (distances, row indices) of the k nearest rows per query."""
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        k = min(k, len(self))
+
+        if self.index is not None and self.index.ready:
+            return self.index.search(queries, k)
+
+        distances = self.distances(queries)
+        if k < distances.shape[1]:
+            candidates = np.argpartition(distances, k - 1, axis=1)[:, :k]
+        else:
+            candidates = np.broadcast_to(np.arange(distances.shape[1]), distances.shape)
+        candidate_distances = np.take_along_axis(distances, candidates, axis=1)
+        order = np.argsort(candidate_distances, axis=1)
+        return (np.take_along_axis(candidate_distances, order, axis=1),
+                np.take_along_axis(candidates, order, axis=1))
+
+    def search(self, queries):
+        """Return the nearest gallery index and its distance for each query."""
+        distances, indices = self.knn(queries, 1)
+        return indices[:, 0], distances[:, 0]
+
+    def find_duplicates(self, encodings, threshold, keys=None, key=None):
+        """Near-duplicates of new encodings, both in the gallery and among themselves.
+
+        Returns one ``(kind, index, distance)`` per row: ``("gallery", row)``
+        for the closest gallery face within ``threshold``, otherwise
+        ``("batch", position)`` for the closest earlier row of the same
+        batch, otherwise ``(None, -1, inf)``.
+
+        With ``keys`` (one per new row) and ``key`` (the same for a gallery
+        name), faces with equal keys don't count as duplicates of each
+        other, so another sample of the same person is not refused.
+        """
+        encodings = np.atleast_2d(np.asarray(encodings, dtype=np.float32))
+        results = [(None, -1, float("inf"))] * len(encodings)
+
+        if len(self) > 0:
+            distances, indices = self.knn(encodings, 1 if keys is None else DUPLICATE_NEIGHBOURS)
+            for position, (row_indices, row_distances) in enumerate(zip(indices, distances)):
+                for index, distance in zip(row_indices, row_distances):
+                    if distance >= threshold:
+                        break
+                    if index >= 0 and (keys is None or key(self.names[index]) != keys[position]):
+                        results[position] = ("gallery", int(index), float(distance))
+                        break
+
+        groups = None
+        if keys is not None:
+            numbering = {}
+            groups = np.array([numbering.setdefault(row_key, len(numbering)) for row_key in keys])
+        neighbours, distances = earlier_neighbours(encodings, threshold, groups=groups)
+        for position, (neighbour, distance) in enumerate(zip(neighbours, distances)):
+            if results[position][0] is None and neighbour >= 0:
+                results[position] = ("batch", int(neighbour), float(distance))
+
+        return results
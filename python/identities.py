@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+import os
+import logging
+import threading
+import numpy as np
+from gallery import euclidean_distances
+
+logger = logging.getLogger("identities")
+
+# People whose individual samples are compared with a probe after the centroid pass
+IDENTITY_SHORTLIST = int(os.getenv("FACE_IDENTITY_SHORTLIST", "8"))
+
+# Encoding values (rows x dimensions) folded into the identities per step
+IDENTITY_SYNC_CHUNK = 1 << 22
+
+def identity_key(name):
+    """People are grouped by name, ignoring case and spacing, as the merge policy does."""
+    return " ".join(name.split()).casefold()
+
+class IdentityIndex:
+    """Registered faces grouped by person, so matching scales with people instead of images.
+
+    Each identity keeps the gallery rows registered under its name, their
+    centroid and two spread statistics: the RMS and the largest distance
+    of its samples from the centroid (its radius). A probe is matched in
+    two stages: against every centroid, then exactly against the samples
+    of the ``shortlist`` identities with the closest centroids only. The
+    match reported is still a gallery row and its real distance, so the
+    match threshold means what it did before, and someone registered many
+    times costs one centroid comparison unless they are a likely match.
+
+    Identities follow the gallery: ``sync`` folds in rows added to it
+    since the last call, updating only the identities they belong to.
+    The spread statistics are reported by ``stats`` and ``describe`` (the
+    service's ``stats`` op), to show how consistent people's samples are.
+    """
+
+    def __init__(self, gallery, shortlist=IDENTITY_SHORTLIST):
+        self.gallery = gallery
+        self.shortlist = shortlist
+        self._lock = threading.RLock()
+        self._keys = {}
+        self.names = []
+        # Gallery row positions per identity
+        self._members = []
+        self._counts = None
+        self._sums = None
+        self._sq_sums = None
+        self._centroids = None
+        self._centroid_sq_norms = None
+        self._rms = None
+        self._radii = None
+        self._synced = 0
+
+    def __len__(self):
+        return len(self.names)
+
+    def _reserve(self, dimension, count):
+        if self._sums is not None and count <= len(self._sums):
+            return
+        capacity = max(count, 64, 2 * (0 if self._sums is None else len(self._sums)))
+        arrays = {
+            "_counts": ((capacity,), np.int64),
+            "_sums": ((capacity, dimension), np.float64),
+            "_sq_sums": ((capacity,), np.float64),
+            "_centroids": ((capacity, dimension), np.float32),
+            "_centroid_sq_norms": ((capacity,), np.float32),
+            "_rms": ((capacity,), np.float32),
+            "_radii": ((capacity,), np.float32),
+        }
+        for attribute, (shape, dtype) in arrays.items():
+            grown = np.zeros(shape, dtype=dtype)
+            old = getattr(self, attribute)
+            if old is not None:
+                grown[:len(old)] = old
+            setattr(self, attribute, grown)
+
+    def _identity(self, name):
+        key = identity_key(name)
+        identity = self._keys.get(key)
+        if identity is None:
+            identity = self._keys[key] = len(self.names)
+            self.names.append(name)
+            self._members.append(np.empty(0, dtype=np.int64))
+        return identity
+
+    def sync(self):
+        """Fold in gallery rows added since the last sync; returns how many."""
+        with self._lock:
+            start, size = self._synced, len(self.gallery)
+            if size <= start:
+                return 0
+
+            names = self.gallery.names[start:size]
+            identity_of = {name: self._identity(name) for name in dict.fromkeys(names)}
+            codes = np.fromiter((identity_of[name] for name in names), dtype=np.int64, count=len(names))
+            dimension = self.gallery.dimension
+            self._reserve(dimension, len(self.names))
+
+            # Number the identities that got rows 0..n-1, so the sums below stay small
+            touched, codes = np.unique(codes, return_inverse=True)
+            sums = np.zeros(len(touched) * dimension, dtype=np.float64)
+            sq_sums = np.zeros(len(touched), dtype=np.float64)
+            chunk_size = max(1, IDENTITY_SYNC_CHUNK // dimension)
+            for chunk_start in range(0, len(codes), chunk_size):
+                chunk = slice(chunk_start, chunk_start + chunk_size)
+                encodings, sq_norms = self.gallery.take(np.arange(start, size)[chunk])
+                # Each row's values go to its identity's cells of the flattened sums
+                cells = (codes[chunk, None] * dimension + np.arange(dimension)).ravel()
+                sums += np.bincount(cells, weights=encodings.ravel(), minlength=len(sums))
+                sq_sums += np.bincount(codes[chunk], weights=sq_norms, minlength=len(touched))
+
+            self._sums[touched] += sums.reshape(len(touched), dimension)
+            self._sq_sums[touched] += sq_sums
+            self._counts[touched] += np.bincount(codes, minlength=len(touched))
+
+            order = np.argsort(codes, kind="stable")
+            bounds = np.searchsorted(codes[order], np.arange(len(touched) + 1)).tolist()
+            positions = order + start
+            for local, identity in enumerate(touched.tolist()):
+                self._members[identity] = np.concatenate(
+                    (self._members[identity], positions[bounds[local]:bounds[local + 1]])
+                )
+
+            self._update_statistics(touched)
+            added, self._synced = size - start, size
+
+        logger.info(f"Grouped {added} new face encodings by person ({len(self)} identities)")
+        return added
+
+    def _update_statistics(self, touched):
+        """Recompute centroids, RMS and radius of the identities that got new rows."""
+        counts = self._counts[touched]
+        centroids = self._sums[touched] / counts[:, None]
+        centroid_sq_norms = np.einsum('ij,ij->i', centroids, centroids)
+        self._centroids[touched] = centroids
+        self._centroid_sq_norms[touched] = centroid_sq_norms
+        # Mean squared distance to the centroid is E[|x|^2] - |mean|^2
+        self._rms[touched] = np.sqrt(np.maximum(self._sq_sums[touched] / counts - centroid_sq_norms, 0.0))
+
+        # The radius is a maximum, so it is measured again from the members
+        self._radii[touched] = 0.0
+        members = [self._members[identity] for identity in touched.tolist()]
+        positions = np.concatenate(members)
+        codes = np.repeat(touched, [len(group) for group in members])
+        chunk_size = max(1, IDENTITY_SYNC_CHUNK // self.gallery.dimension)
+        for start in range(0, len(positions), chunk_size):
+            chunk = slice(start, start + chunk_size)
+            encodings, _ = self.gallery.take(positions[chunk])
+            distances = np.linalg.norm(encodings - self._centroids[codes[chunk]], axis=1)
+            np.maximum.at(self._radii, codes[chunk], distances.astype(np.float32))
+
+    def search(self, queries):
+        """Return the nearest gallery row and its distance for each query."""
+        self.sync()
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+
+        with self._lock:
+            count = len(self)
+            members = self._members[:count]
+            centroid_distances = euclidean_distances(
+                queries, self._centroids[:count], self._centroid_sq_norms[:count]
+            )
+
+        shortlist = min(self.shortlist, count)
+        if shortlist < count:
+            candidates = np.argpartition(centroid_distances, shortlist - 1, axis=1)[:, :shortlist]
+        else:
+            candidates = np.broadcast_to(np.arange(count), centroid_distances.shape)
+
+        indices = np.empty(len(queries), dtype=np.int64)
+        distances = np.empty(len(queries), dtype=np.float32)
+        for position, (query, identities) in enumerate(zip(queries, candidates)):
+            rows = np.concatenate([members[identity] for identity in identities])
+            encodings, sq_norms = self.gallery.take(rows)
+            row_distances = euclidean_distances(query, encodings, sq_norms)[0]
+            best = row_distances.argmin()
+            indices[position], distances[position] = rows[best], row_distances[best]
+        return indices, distances
+
+    def describe(self, name):
+        """Sample count and spread of the person registered under ``name``, or None.
+
+        Like ``stats`` this reports the rows grouped so far, without syncing.
+        """
+        with self._lock:
+            identity = self._keys.get(identity_key(name))
+            if identity is None:
+                return None
+            return {
+                "name": self.names[identity],
+                "samples": int(self._counts[identity]),
+                "rms_spread": float(self._rms[identity]),
+                "radius": float(self._radii[identity]),
+            }
+
+    def stats(self):
+        """Identity and sample counts, and how far samples lie from their person's centroid."""
+        with self._lock:
+            count = len(self)
+            return {
+                "identities": count,
+                "samples": self._synced,
+                "mean_rms_spread": float(self._rms[:count].mean()) if count else None,
+                "max_radius": float(self._radii[:count].max()) if count else None,
+            }
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+import re
+
+_WORD_PATTERN = re.compile(r"\w+")
+
+# Trie key under which a node stores the name ending there
+_END = ""
+
+# A name's words as name_tokens splits them, joined by single spaces; the
+# faces table is indexed on this expression (schema migration 4)
+NAME_WORDS_SQL = r"btrim(regexp_replace(LOWER(name), '\W+', ' ', 'g'))"
+
+def name_tokens(text):
+    """Case-folded words of a name or question; names match on whole words."""
+    return _WORD_PATTERN.findall(text.casefold())
+
+def name_candidates(text, max_words):
+    """Every run of up to max_words consecutive words of ``text``, as NAME_WORDS_SQL writes them."""
+    words = name_tokens(text)
+    return sorted({
+        " ".join(words[start:end])
+        for start in range(len(words))
+        for end in range(start + 1, min(start + max_words, len(words)) + 1)
+    })
+
+class NameMatcher:
+    """Finds registered people's names in a question with one pass over its words.
+
+    Names are kept in a trie keyed by word, so matching a question costs
+    one walk per word of the question (each at most as deep as the longest
+    name). Punctuation is ignored, so "Dr. Smith" is found in "when was
+    dr smith registered". Each name remembers how it was first written
+    and when it was first registered, which is all the "when" questions
+    need.
+    """
+
+    def __init__(self, rows=()):
+        self._root = {}
+        self._size = 0
+        self.add_many(rows)
+
+    def __len__(self):
+        """Number of distinct names (by their words) in the matcher."""
+        return self._size
+
+    def add(self, name, created_at):
+        """Add one registered name; returns whether it was new."""
+        tokens = name_tokens(name)
+        if not tokens:
+            return False
+
+        node = self._root
+        for token in tokens:
+            node = node.setdefault(token, {})
+
+        entry = node.get(_END)
+        if entry is None:
+            node[_END] = [name, created_at]
+            self._size += 1
+            return True
+        if created_at is not None and (entry[1] is None or created_at < entry[1]):
+            entry[1] = created_at
+        return False
+
+    def add_many(self, rows):
+        """Add (name, created_at) rows; returns how many new names were added."""
+        return sum(self.add(name, created_at) for name, created_at in rows)
+
+    def find_all(self, text):
+        """Every registered name in ``text`` as (name, first registered) pairs.
+
+        Matches are whole words, reported in the order they appear. Where
+        names overlap the longest wins, so "anna lee" is not also reported
+        as "anna".
+        """
+        tokens = name_tokens(text)
+        matches = []
+        seen = set()
+        position = 0
+        while position < len(tokens):
+            node = self._root
+            match, end = None, position
+            for offset in range(position, len(tokens)):
+                node = node.get(tokens[offset])
+                if node is None:
+                    break
+                if _END in node:
+                    match, end = node[_END], offset + 1
+
+            if match is None:
+                position += 1
+                continue
+
+            if id(match) not in seen:
+                seen.add(id(match))
+                matches.append((match[0], match[1]))
+            position = end
+        return matches
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+import os
+import re
+import zlib
+import hashlib
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.llms import LLM
+
+# Embedding and LLM backends: cohere (remote API), local (CPU only) or stub
+# (deterministic, for tests and latency measurements)
+RAG_PROVIDER = os.getenv("RAG_PROVIDER", "cohere")
+EMBEDDING_PROVIDER = os.getenv("RAG_EMBEDDING_PROVIDER", "") or RAG_PROVIDER
+LLM_PROVIDER = os.getenv("RAG_LLM_PROVIDER", "") or RAG_PROVIDER
+
+COHERE_API_KEY = os.getenv("COHERE_API_KEY", "v1mBXtR48OllAMPADPuMxoApU1FecoZ9yvSbLfrd")
+COHERE_EMBEDDING_MODEL = "embed-english-v3.0"
+
+# Number of hashed TF-IDF buckets
+LOCAL_EMBEDDING_DIMENSION = int(os.getenv("RAG_LOCAL_EMBEDDING_DIMENSION", "1024"))
+
+STUB_EMBEDDING_DIMENSION = 64
+
+# Reuse document embeddings across runs, keyed by model and content hash
+EMBEDDING_CACHE = os.getenv("RAG_EMBEDDING_CACHE", "1") != "0"
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+def tokenize(text):
+    return _TOKEN_PATTERN.findall(text.lower())
+
+class HashedTfidfEmbeddings(Embeddings):
+    """TF-IDF vectors over hashed terms, computed on the CPU.
+
+    Words and word bigrams are hashed into a fixed number of signed
+    buckets. Documents get L2-normalized log term frequencies, so their
+    vectors never change once indexed; IDF weights are applied to queries
+    only, from the document frequencies of the indexed corpus (see ``fit``).
+    """
+
+    def __init__(self, dimension=LOCAL_EMBEDDING_DIMENSION):
+        self.dimension = dimension
+        self.idf = np.ones(dimension, dtype=np.float32)
+
+    def _document_vector(self, text):
+        tokens = tokenize(text)
+        terms = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+        counts = np.zeros(self.dimension, dtype=np.float32)
+        for term in terms:
+            digest = zlib.crc32(term.encode("utf-8"))
+            counts[digest % self.dimension] += 1.0 if digest & 0x80000000 else -1.0
+
+        vector = np.sign(counts) * np.log1p(np.abs(counts))
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def fit(self, texts):
+        """Recompute IDF weights from the documents currently indexed."""
+        document_frequency = np.zeros(self.dimension, dtype=np.int64)
+        for text in texts:
+            document_frequency += self._document_vector(text) != 0
+        self.idf = (np.log((1 + len(texts)) / (1 + document_frequency)) + 1).astype(np.float32)
+
+    def embed_documents(self, texts):
+        return [self._document_vector(text).tolist() for text in texts]
+
+    def embed_query(self, text):
+        vector = self._document_vector(text) * self.idf
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+class StubEmbeddings(Embeddings):
+    """Deterministic pseudo-random unit vectors seeded by each text's hash."""
+
+    def __init__(self, dimension=STUB_EMBEDDING_DIMENSION):
+        self.dimension = dimension
+
+    def _vector(self, text):
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "big")
+        vector = np.random.default_rng(seed).standard_normal(self.dimension)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_documents(self, texts):
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._vector(text)
+
+class CachedEmbeddings(Embeddings):
+    """Wraps an embeddings provider with the on-disk EmbeddingCache.
+
+    Only documents are cached: their vectors depend on nothing but the
+    model and the text. Queries go straight to the provider, since some
+    (like the TF-IDF one) weight them by the current corpus.
+    """
+
+    def __init__(self, embeddings, cache):
+        self.embeddings = embeddings
+        self.cache = cache
+
+    def embed_documents(self, texts):
+        vectors = self.cache.get_many(texts)
+        missing = [position for position, vector in enumerate(vectors) if vector is None]
+
+        if missing:
+            # Identical texts in one call are embedded once
+            unique_texts = list(dict.fromkeys(texts[position] for position in missing))
+            computed = dict(zip(unique_texts, self.embeddings.embed_documents(unique_texts)))
+            self.cache.put_many(unique_texts, [computed[text] for text in unique_texts])
+            for position in missing:
+                vectors[position] = computed[texts[position]]
+
+        return [list(map(float, vector)) for vector in vectors]
+
+    def embed_query(self, text):
+        return self.embeddings.embed_query(text)
+
+    def fit(self, texts):
+        fit = getattr(self.embeddings, "fit", None)
+        if fit is not None:
+            fit(texts)
+
+def _split_prompt(prompt):
+    """Pull the retrieved context and the question out of the QA prompt."""
+    context = prompt.split("Context:", 1)[-1]
+    context, _, question = context.partition("Question:")
+    question = question.split("Answer:", 1)[0]
+    return context.strip(), question.strip()
+
+class ExtractiveLLM(LLM):
+    """Answers from the retrieved context without a language model.
+
+    Returns the context lines that share the most words with the question,
+    which is enough for the lookup-style questions the assistant gets.
+    """
+
+    max_lines: int = 5
+
+    @property
+    def _llm_type(self):
+        return "extractive"
+
+    def _call(self, prompt, stop=None, run_manager=None, **kwargs):
+        context, question = _split_prompt(prompt)
+        question_terms = set(tokenize(question))
+        lines = [line.strip() for line in context.splitlines() if line.strip()]
+
+        scored = [
+            (len(question_terms & set(tokenize(line))), -position, line)
+            for position, line in enumerate(lines)
+        ]
+        best = [line for score, _, line in sorted(scored, reverse=True)[:self.max_lines] if score > 0]
+        if not best:
+            return "I don't know."
+        return "\n".join(best)
+
+class StubLLM(LLM):
+    """Deterministic answers that echo the question, for tests and timing."""
+
+    @property
+    def _llm_type(self):
+        return "stub"
+
+    def _call(self, prompt, stop=None, run_manager=None, **kwargs):
+        context, question = _split_prompt(prompt)
+        return f"Stub answer to '{question}' from {len(context.splitlines())} context lines."
+
+def embedding_model_id(provider=EMBEDDING_PROVIDER):
+    """Identifies the embedding space, so saved indexes from another one are rebuilt."""
+    if provider == "cohere":
+        return f"cohere:{COHERE_EMBEDDING_MODEL}"
+    if provider == "local":
+        return f"local-tfidf:{LOCAL_EMBEDDING_DIMENSION}"
+    if provider == "stub":
+        return f"stub:{STUB_EMBEDDING_DIMENSION}"
+    raise ValueError(f"Unknown embedding provider: {provider}")
+
+def create_embeddings(provider=EMBEDDING_PROVIDER, cache=EMBEDDING_CACHE):
+    """The provider's embeddings, behind the document embedding cache unless disabled."""
+    embeddings = _create_provider_embeddings(provider)
+    if not cache:
+        return embeddings
+
+    from embedding_cache import EmbeddingCache
+    return CachedEmbeddings(embeddings, EmbeddingCache(embedding_model_id(provider)))
+
+def _create_provider_embeddings(provider):
+    if provider == "cohere":
+        from langchain_cohere import CohereEmbeddings
+
+        return CohereEmbeddings(
+            model=COHERE_EMBEDDING_MODEL,
+            cohere_api_key=COHERE_API_KEY,
+            user_agent="FaceRecognitionPlatform/1.0"
+        )
+    if provider == "local":
+        return HashedTfidfEmbeddings()
+    if provider == "stub":
+        return StubEmbeddings()
+    raise ValueError(f"Unknown embedding provider: {provider}")
+
+def create_llm(provider=LLM_PROVIDER):
+    if provider == "cohere":
+        from langchain_community.llms import Cohere
+
+        return Cohere(
+            model="command",
+            cohere_api_key=COHERE_API_KEY,
+            temperature=0.1,
+            client=None  # Let the library create the client
+        )
+    if provider == "local":
+        return ExtractiveLLM()
+    if provider == "stub":
+        return StubLLM()
+    raise ValueError(f"Unknown LLM provider: {provider}")
@@ -5,10 +5,12 @@ import json
 import logging
 import argparse
 import time
-import requests
 from datetime import datetime
 import psycopg2
 import psycopg2.extras
+from db_pool import db_connection
+from database import get_registered_faces_page
+from name_matcher import NAME_WORDS_SQL, NameMatcher, name_candidates
 
 # Configure logging
 logging.basicConfig(
@@ -20,199 +22,136 @@ logger = logging.getLogger("rag_service")
 # We'll use a keyword-based approach locally without any external API
 # This allows us to work without requiring any API keys
 
-# Database connection parameters from environment variables
-db_params = {
-    "host": os.getenv("PGHOST", "localhost"),
-    "database": os.getenv("PGDATABASE", "postgres"),
-    "user": os.getenv("PGUSER", "postgres"),
-    "password": os.getenv("PGPASSWORD", "lakshman&66"),
-    "port": os.getenv("PGPORT", "5432")
-}
+# Answer when there is nothing registered to talk about
+NO_DATA_RESPONSE = "I don't have any face registration data to answer questions about yet. Please register some faces first."
 
-def get_db_connection():
-    """Establish a database connection."""
-    try:
-        conn = psycopg2.connect(**db_params)
-        return conn
-    except Exception as e:
-        logger.error(f"Database connection error: {e}")
-        raise
+# Most registrations listed when no specific intent matched
+LISTING_LIMIT = int(os.getenv("RAG_LISTING_LIMIT", "50"))
 
-def get_face_registration_data():
-    """Get all face registration data from the database."""
+# Longest name, in words, looked up from a "when" question
+NAME_MAX_WORDS = int(os.getenv("RAG_NAME_MAX_WORDS", "5"))
+
+def get_face_registration_data(limit=LISTING_LIMIT):
+    """The newest face registrations formatted for responses, and whether there are more."""
     try:
-        conn = get_db_connection()
-        cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        
-        # Query to get all face registration data
-        cur.execute("""
-            SELECT id, name, created_at
-            FROM faces
-            ORDER BY created_at DESC
-        """)
-        
-        faces = cur.fetchall()
-        
-        cur.close()
-        conn.close()
+        page = get_registered_faces_page(limit)
         
         # Format the data as text for RAG
-        registration_data = []
-        for face in faces:
-            registration_text = (
-                f"Person ID: {face['id']}, "
-                f"Name: {face['name']}, "
-                f"Registered at: {face['created_at'].isoformat()}"
-            )
-            registration_data.append(registration_text)
-        
-        return registration_data
+        lines = [
+            f"Person ID: {face['id']}, "
+            f"Name: {face['name']}, "
+            f"Registered at: {face['created_at']}"
+            for face in page["faces"]
+        ]
+        return lines, page["next_cursor"] is not None
     except Exception as e:
         logger.error(f"Error getting face registration data: {e}")
         raise
 
-def initialize_rag_system():
-    """Initialize a simple retrieval system (no vector search)."""
-    try:
-        # Get face registration data
-        registration_texts = get_face_registration_data()
-        
-        if not registration_texts:
-            logger.warning("No face registration data found")
-            return None
-        
-        # Simplified approach without vector search
-        # Just return the registration data
-        return registration_texts
-    except Exception as e:
-        logger.error(f"Error initializing retrieval system: {e}")
-        raise
+def find_registered_names(cur, query, max_words=NAME_MAX_WORDS):
+    """Registered names in a question as (name, first registered) pairs, longest first where they overlap.
+    
+    Only the question's runs of words are looked up, on the index of the
+    names' words, and the whole-word matching is then done among the few
+    names found.
+    """
+    cur.execute(f"""
+        SELECT MIN(name) AS name, MIN(created_at) AS created_at
+        FROM faces
+        WHERE {NAME_WORDS_SQL} = ANY(%s)
+        GROUP BY {NAME_WORDS_SQL}
+    """, (name_candidates(query, max_words),))
+    return NameMatcher((row['name'], row['created_at']) for row in cur.fetchall()).find_all(query)
 
-def process_query(query):
-    """Process a query using a simplified retrieval system."""
-    try:
-        # Initialize system
-        registration_data = initialize_rag_system()
-        
-        if not registration_data:
-            return {
-                "response": "I don't have any face registration data to answer questions about yet. Please register some faces first."
-            }
+def no_data_response():
+    return {"response": NO_DATA_RESPONSE}
+
+def answer_query(cur, query):
+    """Answer a question with one targeted query for its intent.
+    
+    An empty faces table shows up as an empty result in every branch, so
+    no separate existence check is needed; the registrations are only
+    listed (newest first, up to LISTING_LIMIT) when no intent matched.
+    """
+    query_lower = query.lower()
+    
+    # For "last person registered" query
+    if "last person" in query_lower or "latest" in query_lower:
+        cur.execute("SELECT name, created_at FROM faces ORDER BY created_at DESC LIMIT 1")
+        last_face = cur.fetchone()
+        if last_face is None:
+            return no_data_response()
         
-        # Check for common query patterns and augment with database queries
-        query_lower = query.lower()
+        return {
+            "response": f"The last person registered was {last_face['name']} at {last_face['created_at'].isoformat()}."
+        }
+    
+    # For "how many people" query
+    elif "how many" in query_lower or "count" in query_lower:
+        cur.execute("SELECT COUNT(*) FROM faces")
+        count = cur.fetchone()[0]
+        if count == 0:
+            return no_data_response()
         
-        # For "last person registered" query
-        if "last person" in query_lower or "latest" in query_lower:
-            conn = get_db_connection()
-            cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-            cur.execute("SELECT name, created_at FROM faces ORDER BY created_at DESC LIMIT 1")
-            last_face = cur.fetchone()
-            cur.close()
-            conn.close()
-            
-            if last_face:
-                # Return direct answer for simple queries
-                return {
-                    "response": f"The last person registered was {last_face['name']} at {last_face['created_at'].isoformat()}."
-                }
+        return {
+            "response": f"There are currently {count} people registered in the system."
+        }
+    
+    # For time-based queries about specific person
+    elif "time" in query_lower or "when" in query_lower:
+        # Every registered person named in the question
+        matches = find_registered_names(cur, query)
         
-        # For "how many people" query
-        elif "how many" in query_lower or "count" in query_lower:
-            conn = get_db_connection()
-            cur = conn.cursor()
-            cur.execute("SELECT COUNT(*) FROM faces")
-            count = cur.fetchone()[0]
-            cur.close()
-            conn.close()
-            
-            # Return direct answer for simple queries
+        if matches:
             return {
-                "response": f"There are currently {count} people registered in the system."
-            }
-        
-        # For time-based queries about specific person
-        elif "time" in query_lower or "when" in query_lower:
-            # Extract person name from query
-            potential_names = []
-            conn = get_db_connection()
-            cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-            cur.execute("SELECT DISTINCT name FROM faces")
-            all_names = [row['name'].lower() for row in cur.fetchall()]
-            
-            for name in all_names:
-                if name.lower() in query_lower:
-                    potential_names.append(name)
-            
-            if potential_names:
-                name_to_check = potential_names[0]  # Use the first matched name
-                cur.execute(
-                    "SELECT created_at FROM faces WHERE LOWER(name) = LOWER(%s) ORDER BY created_at ASC LIMIT 1",
-                    (name_to_check,)
+                "response": " ".join(
+                    f"{name.lower()} was registered at {created_at.isoformat()}."
+                    for name, created_at in matches
                 )
-                registration_time = cur.fetchone()
-                
-                if registration_time:
-                    # Return direct answer for simple queries
-                    return {
-                        "response": f"{name_to_check} was registered at {registration_time['created_at'].isoformat()}."
-                    }
-            
-            cur.close()
-            conn.close()
+            }
+    
+    # For people names in the query
+    elif "who" in query_lower or "person" in query_lower or "name" in query_lower:
+        cur.execute("SELECT name FROM faces GROUP BY name ORDER BY MAX(created_at) DESC")
+        names = [row['name'] for row in cur.fetchall()]
+        if not names:
+            return no_data_response()
         
-        # For people names in the query
-        elif "who" in query_lower or "person" in query_lower or "name" in query_lower:
-            conn = get_db_connection()
-            cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-            cur.execute("SELECT name FROM faces ORDER BY created_at DESC")
-            faces = cur.fetchall()
-            cur.close()
-            conn.close()
-            
-            if faces:
-                names = [face['name'] for face in faces]
-                unique_names = list(set(names))
-                name_list = ", ".join(unique_names)
-                return {
-                    "response": f"The registered people are: {name_list}."
-                }
+        return {
+            "response": f"The registered people are: {', '.join(names)}."
+        }
+    
+    # For recognition statistics
+    if any(term in query_lower for term in ["statistic", "stats", "summary", "dashboard"]):
+        cur.execute("SELECT COUNT(*), COUNT(DISTINCT name), MIN(created_at), MAX(created_at) FROM faces")
+        total_count, unique_count, first_registered, last_registered = cur.fetchone()
+        if total_count == 0:
+            return no_data_response()
         
-        # Enhanced keyword matching for more complex queries
+        first_date = first_registered.isoformat() if first_registered else "N/A"
+        last_date = last_registered.isoformat() if last_registered else "N/A"
         
-        # For recognition statistics
-        if any(term in query_lower for term in ["statistic", "stats", "summary", "dashboard"]):
-            conn = get_db_connection()
-            cur = conn.cursor()
-            
-            # Get total count
-            cur.execute("SELECT COUNT(*) FROM faces")
-            total_count = cur.fetchone()[0]
-            
-            # Get unique names count
-            cur.execute("SELECT COUNT(DISTINCT name) FROM faces")
-            unique_count = cur.fetchone()[0]
-            
-            # Get first and last registration date
-            cur.execute("SELECT MIN(created_at), MAX(created_at) FROM faces")
-            date_range = cur.fetchone()
-            first_date = date_range[0].isoformat() if date_range[0] else "N/A"
-            last_date = date_range[1].isoformat() if date_range[1] else "N/A"
-            
-            cur.close()
-            conn.close()
-            
-            return {
-                "response": f"Face Recognition Statistics:\n- Total faces registered: {total_count}\n- Unique people registered: {unique_count}\n- First registration: {first_date}\n- Latest registration: {last_date}"
-            }
-            
-        # Enhanced pattern matching for more complex queries
-        # Provide all available data as a simple response
-        data_info = "\n".join(registration_data)
         return {
-            "response": f"I found the following registration information: \n{data_info}"
+            "response": f"Face Recognition Statistics:\n- Total faces registered: {total_count}\n- Unique people registered: {unique_count}\n- First registration: {first_date}\n- Latest registration: {last_date}"
         }
-        
+    
+    # Provide all available data as a simple response
+    registration_data, more = get_face_registration_data()
+    if not registration_data:
+        return no_data_response()
+    
+    if more:
+        registration_data.append(f"(showing the {len(registration_data)} most recent registrations)")
+    data_info = "\n".join(registration_data)
+    return {
+        "response": f"I found the following registration information: \n{data_info}"
+    }
+
+def process_query(query):
+    """Process a query using a simplified retrieval system."""
+    try:
+        with db_connection() as conn, conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
+            return answer_query(cur, query)
     except Exception as e:
         logger.error(f"Error processing query: {e}")
         return {
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+import os
+import sys
+import json
+import logging
+import argparse
+from config import DATA_DIR
+from db_pool import db_connection, db_params
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger("schema")
+
+# Ordered schema migrations: (version, description, statements)
+MIGRATIONS = [
+    (1, "Create faces table", [
+        """
+        CREATE TABLE IF NOT EXISTS faces (
+            id SERIAL PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            encoding BYTEA NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+    ]),
+    (2, "Index faces by registration time and lower-cased name", [
+        "CREATE INDEX IF NOT EXISTS faces_created_at_idx ON faces (created_at)",
+        "CREATE INDEX IF NOT EXISTS faces_lower_name_idx ON faces (LOWER(name))",
+    ]),
+    (3, "Index faces by (created_at, id) for keyset pagination", [
+        "CREATE INDEX IF NOT EXISTS faces_created_at_id_idx ON faces (created_at, id)",
+        "DROP INDEX IF EXISTS faces_created_at_idx",
+    ]),
+    (4, "Index faces by the words of their lower-cased name", [
+        r"CREATE INDEX IF NOT EXISTS faces_name_words_idx ON faces ((btrim(regexp_replace(LOWER(name), '\W+', ' ', 'g'))))",
+    ]),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+# Records which databases are known to be at SCHEMA_VERSION, so services can
+# skip the database round trip (and any DDL) on startup
+SCHEMA_MARKER_PATH = os.getenv("FACE_SCHEMA_MARKER_PATH", "") or os.path.join(DATA_DIR, "schema_version.json")
+
+# Arbitrary key for the advisory lock that serializes concurrent migrators
+MIGRATION_LOCK_ID = 72_410_001
+
+def _database_key():
+    return f"{db_params['host']}:{db_params['port']}/{db_params['database']}"
+
+def _read_marker():
+    try:
+        with open(SCHEMA_MARKER_PATH) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _write_marker(version):
+    marker = _read_marker()
+    marker[_database_key()] = version
+    os.makedirs(os.path.dirname(SCHEMA_MARKER_PATH), exist_ok=True)
+    tmp_path = SCHEMA_MARKER_PATH + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(marker, f)
+    os.replace(tmp_path, SCHEMA_MARKER_PATH)
+
+def schema_verified():
+    """Whether this database was already migrated to SCHEMA_VERSION."""
+    return _read_marker().get(_database_key()) == SCHEMA_VERSION
+
+def migrate():
+    """Apply any pending migrations and mark the schema as verified.
+
+    Safe to run repeatedly and from several processes at once: applied
+    versions are tracked in schema_migrations, and an advisory lock keeps
+    two migrators from racing.
+    """
+    try:
+        applied_now = []
+        with db_connection() as conn, conn.cursor() as cur:
+            cur.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATION_LOCK_ID,))
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    version INTEGER PRIMARY KEY,
+                    description TEXT NOT NULL,
+                    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            cur.execute("SELECT version FROM schema_migrations")
+            applied = {row[0] for row in cur.fetchall()}
+
+            for version, description, statements in MIGRATIONS:
+                if version in applied:
+                    continue
+                for statement in statements:
+                    cur.execute(statement)
+                cur.execute(
+                    "INSERT INTO schema_migrations (version, description) VALUES (%s, %s)",
+                    (version, description)
+                )
+                applied_now.append(version)
+                logger.info(f"Applied schema migration {version}: {description}")
+
+        _write_marker(SCHEMA_VERSION)
+        logger.info(f"Database schema is at version {SCHEMA_VERSION}")
+        return applied_now
+    except Exception as e:
+        logger.error(f"Database migration error: {e}")
+        raise
+
+def ensure_schema():
+    """Migrate once per database; afterwards this only reads the marker file."""
+    if schema_verified():
+        return []
+    return migrate()
+
+def main():
+    """Main entry point for the script."""
+    parser = argparse.ArgumentParser(description='Database schema migrations')
+    parser.add_argument('--check', action='store_true', help='Only report whether the schema is marked as verified')
+
+    args = parser.parse_args()
+
+    try:
+        if args.check:
+            print(json.dumps({"version": SCHEMA_VERSION, "verified": schema_verified()}))
+        else:
+            print(json.dumps({"version": SCHEMA_VERSION, "applied": migrate()}))
+    except Exception as e:
+        logger.error(f"Unhandled exception: {e}")
+        print(json.dumps({"error": str(e)}))
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
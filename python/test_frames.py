@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+import struct
+import cv2
+import numpy as np
+from frames import decode_gray, jpeg_size
+
+def rotated_jpeg(image, orientation):
+    """JPEG bytes for ``image`` with an EXIF orientation tag."""
+    _, buffer = cv2.imencode('.jpg', image)
+    data = buffer.tobytes()
+    tiff = (b"MM\x00*" + struct.pack(">I", 8) + struct.pack(">H", 1)
+            + struct.pack(">HHIHH", 0x0112, 3, 1, orientation, 0) + struct.pack(">I", 0))
+    exif = b"\xff\xe1" + struct.pack(">H", 2 + 6 + len(tiff)) + b"Exif\x00\x00" + tiff
+    return data[:2] + exif + data[2:]
+
+def test_rotated_jpeg_boxes_map_to_full_resolution():
+    # 800x400 stored, shown 400x800 (orientation 6: rotate 90 degrees clockwise)
+    image = np.zeros((400, 800), np.uint8)
+    image[:, :400] = 255
+    data = rotated_jpeg(image, 6)
+    assert jpeg_size(data) == (800, 400)
+
+    frame = decode_gray(data, min_width=100)
+    assert frame.reduced
+    assert frame.size == (400, 800)
+    assert frame.full().shape == (800, 400)
+    assert frame.image.shape[0] * frame.size[0] == frame.image.shape[1] * frame.size[1]
+
+    # The stored left half is the top half once turned upright
+    crops = frame.crops([(100, 100, 240, 240)])
+    assert crops.shape[0] == 1
+    assert crops.mean() > 200
+
+def test_unrotated_jpeg_keeps_its_size():
+    image = np.zeros((400, 800), np.uint8)
+    _, buffer = cv2.imencode('.jpg', image)
+    frame = decode_gray(buffer.tobytes(), min_width=100)
+    assert frame.size == (800, 400)
+    assert frame.full().shape == (400, 800)
+
+if __name__ == "__main__":
+    test_rotated_jpeg_boxes_map_to_full_resolution()
+    test_unrotated_jpeg_keeps_its_size()
+    print("frames tests passed")
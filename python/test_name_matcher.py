@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+from datetime import datetime
+import psycopg2
+import psycopg2.extras
+from db_pool import db_connection
+from name_matcher import NAME_WORDS_SQL, NameMatcher, name_candidates
+from schema import MIGRATIONS
+
+REGISTERED = [
+    ("Dr. Smith", datetime(2024, 1, 1)),
+    ("Anna", datetime(2024, 1, 2)),
+    ("Anna Lee", datetime(2024, 1, 3)),
+    ("O'Brien", datetime(2024, 1, 4)),
+]
+
+def test_punctuated_names_match_on_their_words():
+    matcher = NameMatcher(REGISTERED)
+    assert matcher.find_all("When was Dr. Smith registered?") == [("Dr. Smith", datetime(2024, 1, 1))]
+    assert matcher.find_all("when was dr smith added") == [("Dr. Smith", datetime(2024, 1, 1))]
+    assert matcher.find_all("When was o'brien here?") == [("O'Brien", datetime(2024, 1, 4))]
+    assert matcher.find_all("when was smith registered") == []
+
+def test_longest_name_wins_and_only_whole_words():
+    matcher = NameMatcher(REGISTERED)
+    assert matcher.find_all("when did anna lee and anna register") == [
+        ("Anna Lee", datetime(2024, 1, 3)),
+        ("Anna", datetime(2024, 1, 2)),
+    ]
+    assert matcher.find_all("when did annabel register") == []
+
+def test_candidates_are_runs_of_words():
+    candidates = name_candidates("When was Dr. Smith registered?", 2)
+    assert "dr smith" in candidates
+    assert "was dr smith" not in candidates
+    assert "dr. smith" not in candidates
+
+def test_registered_names_lookup_uses_the_name_words():
+    try:
+        from rag_service import find_registered_names
+        with db_connection() as conn, conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
+            # A temporary table hides the real faces table for this transaction
+            cur.execute("CREATE TEMP TABLE faces (id SERIAL PRIMARY KEY, name VARCHAR(255) NOT NULL, "
+                        "created_at TIMESTAMP) ON COMMIT DROP")
+            psycopg2.extras.execute_values(cur, "INSERT INTO faces (name, created_at) VALUES %s", REGISTERED)
+            for version, _, statements in MIGRATIONS:
+                if version == 4:
+                    for statement in statements:
+                        cur.execute(statement)
+
+            cur.execute(f"SELECT {NAME_WORDS_SQL} FROM faces ORDER BY id")
+            assert [row[0] for row in cur.fetchall()] == ["dr smith", "anna", "anna lee", "o brien"]
+            assert find_registered_names(cur, "When was Dr. Smith registered?") == [
+                ("Dr. Smith", datetime(2024, 1, 1))
+            ]
+            assert find_registered_names(cur, "When was O'Brien registered?") == [
+                ("O'Brien", datetime(2024, 1, 4))
+            ]
+    except psycopg2.OperationalError as e:
+        print(f"Skipping the database lookup test: {e}")
+
+if __name__ == "__main__":
+    test_punctuated_names_match_on_their_words()
+    test_longest_name_wins_and_only_whole_words()
+    test_candidates_are_runs_of_words()
+    test_registered_names_lookup_uses_the_name_words()
+    print("name matcher tests passed")
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+import os
+import time
+import logging
+import threading
+import itertools
+import numpy as np
+
+logger = logging.getLogger("tracking")
+
+# Re-run identity matching for a tracked face at least this often (frames)
+REIDENTIFY_EVERY = int(os.getenv("FACE_TRACK_REIDENTIFY_EVERY", "10"))
+
+# Run detection every N frames; frames in between reuse the tracked boxes
+DETECT_EVERY = int(os.getenv("FACE_TRACK_DETECT_EVERY", "1"))
+
+# Box overlap needed to treat a detection as the same face; a weaker
+# association means the tracker has lost confidence and re-identifies
+MIN_IOU = float(os.getenv("FACE_TRACK_MIN_IOU", "0.3"))
+CONFIDENT_IOU = float(os.getenv("FACE_TRACK_CONFIDENT_IOU", "0.5"))
+
+# Drop a track after this many frames without a matching detection
+MAX_MISSES = int(os.getenv("FACE_TRACK_MAX_MISSES", "3"))
+
+# Forget sessions that haven't sent a frame for this many seconds
+SESSION_IDLE_SECONDS = float(os.getenv("FACE_TRACK_SESSION_IDLE_SECONDS", "120"))
+
+_track_ids = itertools.count(1)
+
+def iou_matrix(boxes_a, boxes_b):
+    """Intersection-over-union for every pair of (x, y, w, h) boxes."""
+    a = np.asarray(boxes_a, dtype=np.float32).reshape(-1, 4)
+    b = np.asarray(boxes_b, dtype=np.float32).reshape(-1, 4)
+    ax2, ay2 = a[:, 0] + a[:, 2], a[:, 1] + a[:, 3]
+    bx2, by2 = b[:, 0] + b[:, 2], b[:, 1] + b[:, 3]
+
+    inter_w = np.clip(np.minimum(ax2[:, None], bx2[None, :]) - np.maximum(a[:, None, 0], b[None, :, 0]), 0, None)
+    inter_h = np.clip(np.minimum(ay2[:, None], by2[None, :]) - np.maximum(a[:, None, 1], b[None, :, 1]), 0, None)
+    intersection = inter_w * inter_h
+    union = (a[:, 2] * a[:, 3])[:, None] + (b[:, 2] * b[:, 3])[None, :] - intersection
+    return intersection / np.maximum(union, 1e-6)
+
+class Track:
+    """A face followed across frames, with its last identity result."""
+
+    def __init__(self, box):
+        self.id = next(_track_ids)
+        self.box = tuple(int(v) for v in box)
+        self.name = None
+        self.confidence = 0.0
+        self.frames_since_identified = 0
+        self.misses = 0
+        self.needs_identity = True
+
+    def describe(self):
+        x, y, w, h = self.box
+        return {
+            "name": self.name or "Unknown",
+            "x": x,
+            "y": y,
+            "width": w,
+            "height": h,
+            "confidence": float(self.confidence),
+            "trackId": self.id
+        }
+
+class FaceTracker:
+    """Associates detections with the previous frame's faces by IoU.
+
+    A tracked face keeps its identity until REIDENTIFY_EVERY frames have
+    passed or its association with the new detection is weak; only those
+    faces go back through encoding and gallery search.
+    """
+
+    def __init__(self, reidentify_every=REIDENTIFY_EVERY, detect_every=DETECT_EVERY,
+                 min_iou=MIN_IOU, confident_iou=CONFIDENT_IOU, max_misses=MAX_MISSES):
+        self.reidentify_every = reidentify_every
+        self.detect_every = detect_every
+        self.min_iou = min_iou
+        self.confident_iou = confident_iou
+        self.max_misses = max_misses
+        self.tracks = []
+        self.frames = 0
+        self.lock = threading.Lock()
+        self.last_seen = time.monotonic()
+        self.stats = {"frames": 0, "detections": 0, "identifications": 0, "reused": 0}
+
+    def should_detect(self):
+        """Whether this frame needs detection, or the tracked boxes can be reused."""
+        return not self.tracks or self.frames % self.detect_every == 0
+
+    def skip_frame(self):
+        """Account for a frame answered from the existing tracks."""
+        self.frames += 1
+        self.stats["frames"] += 1
+        self.last_seen = time.monotonic()
+        return self.visible_tracks()
+
+    def update(self, boxes):
+        """Associate this frame's detections with existing tracks.
+
+        Returns the tracks visible in this frame, in detection order. Tracks
+        whose identity has to be (re)computed have ``needs_identity`` set.
+        """
+        self.frames += 1
+        self.stats["frames"] += 1
+        self.stats["detections"] += 1
+        self.last_seen = time.monotonic()
+
+        boxes = [tuple(int(v) for v in box) for box in boxes]
+        assigned = [None] * len(boxes)
+        unmatched_tracks = set(range(len(self.tracks)))
+
+        if self.tracks and boxes:
+            overlaps = iou_matrix([track.box for track in self.tracks], boxes)
+            # Greedy association, strongest overlaps first
+            for flat in np.argsort(overlaps, axis=None)[::-1]:
+                track_index, box_index = np.unravel_index(flat, overlaps.shape)
+                overlap = overlaps[track_index, box_index]
+                if overlap < self.min_iou:
+                    break
+                if track_index not in unmatched_tracks or assigned[box_index] is not None:
+                    continue
+
+                track = self.tracks[track_index]
+                track.box = boxes[box_index]
+                track.misses = 0
+                track.frames_since_identified += 1
+                track.needs_identity = (
+                    track.name is None
+                    or overlap < self.confident_iou
+                    or track.frames_since_identified >= self.reidentify_every
+                )
+                assigned[box_index] = track
+                unmatched_tracks.discard(track_index)
+
+        for track_index in unmatched_tracks:
+            self.tracks[track_index].misses += 1
+
+        for box_index, box in enumerate(boxes):
+            if assigned[box_index] is None:
+                track = Track(box)
+                self.tracks.append(track)
+                assigned[box_index] = track
+
+        self.tracks = [track for track in self.tracks if track.misses <= self.max_misses]
+
+        for track in assigned:
+            if track.needs_identity:
+                self.stats["identifications"] += 1
+            else:
+                self.stats["reused"] += 1
+        return assigned
+
+    def identify(self, track, name, confidence):
+        """Store the identity result for a track."""
+        track.name = name
+        track.confidence = confidence
+        track.frames_since_identified = 0
+        track.needs_identity = False
+
+    def visible_tracks(self):
+        return [track for track in self.tracks if track.misses == 0]
+
+class SessionTrackers:
+    """FaceTrackers keyed by client session, expiring idle sessions."""
+
+    def __init__(self, idle_seconds=SESSION_IDLE_SECONDS):
+        self.idle_seconds = idle_seconds
+        self._trackers = {}
+        self._lock = threading.Lock()
+
+    def get(self, session):
+        with self._lock:
+            self._expire()
+            tracker = self._trackers.get(session)
+            if tracker is None:
+                tracker = self._trackers[session] = FaceTracker()
+            return tracker
+
+    def end(self, session):
+        with self._lock:
+            tracker = self._trackers.pop(session, None)
+        return tracker.stats if tracker else None
+
+    def _expire(self):
+        cutoff = time.monotonic() - self.idle_seconds
+        for session in [s for s, t in self._trackers.items() if t.last_seen < cutoff]:
+            logger.info(f"Dropping idle tracking session {session}")
+            del self._trackers[session]
+
+    def __len__(self):
+        return len(self._trackers)
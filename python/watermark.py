@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+import os
+import time
+import bisect
+import threading
+
+# Seconds an id below the highest one loaded is still expected to commit;
+# ids reserved by a transaction that rolled back are given up after this
+PENDING_ID_SECONDS = float(os.getenv("FACE_PENDING_ID_SECONDS", "600"))
+
+# Most ranges of pending ids kept; the oldest are given up first
+PENDING_ID_RANGES = 256
+
+class IdWatermark:
+    """The highest id loaded from the faces table, and the ids below it still to come.
+
+    SERIAL ids are handed out when rows are inserted, not when they commit,
+    so a transaction can commit rows with ids below ones already loaded
+    (a bulk COPY reserves its ids before writing them). Every id skipped
+    while the high-water mark moved up is kept as pending for
+    ``pending_seconds``; incremental loads ask for the ids above
+    ``last_id`` and the pending ranges, which are primary key lookups.
+    """
+
+    def __init__(self, pending_seconds=PENDING_ID_SECONDS, max_ranges=PENDING_ID_RANGES):
+        self.pending_seconds = pending_seconds
+        self.max_ranges = max_ranges
+        self._lock = threading.RLock()
+        self.last_id = 0
+        # [low, high, monotonic time first seen] of ids not loaded yet, by low
+        self._ranges = []
+
+    def pending(self):
+        """Ranges (low, high) of ids below last_id that may still commit."""
+        with self._lock:
+            cutoff = time.monotonic() - self.pending_seconds
+            self._ranges = [entry for entry in self._ranges if entry[2] >= cutoff]
+            return [(low, high) for low, high, _ in self._ranges]
+
+    def is_pending(self, face_id):
+        with self._lock:
+            position = bisect.bisect_right([low for low, _, _ in self._ranges], face_id) - 1
+            return position >= 0 and face_id <= self._ranges[position][1]
+
+    def advance(self, ids):
+        """Record newly loaded ids: they leave the pending ranges, and skipped ids join them."""
+        ids = sorted(ids)
+        if not ids:
+            return
+        with self._lock:
+            now = time.monotonic()
+            ranges = []
+            for low, high, seen in self._ranges:
+                start = bisect.bisect_left(ids, low)
+                stop = bisect.bisect_right(ids, high)
+                for face_id in ids[start:stop]:
+                    if face_id > low:
+                        ranges.append([low, face_id - 1, seen])
+                    low = face_id + 1
+                if low <= high:
+                    ranges.append([low, high, seen])
+
+            previous = self.last_id
+            for face_id in ids[bisect.bisect_right(ids, previous):]:
+                if face_id > previous + 1:
+                    ranges.append([previous + 1, face_id - 1, now])
+                previous = face_id
+            self.last_id = previous
+
+            if len(ranges) > self.max_ranges:
+                ranges = sorted(ranges, key=lambda entry: entry[2])[-self.max_ranges:]
+            self._ranges = sorted(ranges)
+
+    def restore(self, last_id, pending):
+        """Continue from a saved high-water mark and its pending ranges."""
+        with self._lock:
+            now = time.monotonic()
+            known = {(low, high) for low, high, _ in self._ranges}
+            self._ranges = sorted(self._ranges + [
+                [low, high, now] for low, high in pending if (low, high) not in known
+            ])
+            self.last_id = max(self.last_id, last_id)
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+import os
+import time
+import logging
+import threading
+import itertools
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+
+logger = logging.getLogger("worker_pool")
+
+# Concurrent frames per service instance (0 = one per CPU core)
+WORKERS = int(os.getenv("FACE_WORKERS", "0")) or os.cpu_count() or 1
+
+# thread: OpenCV releases the GIL while decoding, detecting and resizing, so
+# threads share one copy of the models. process: one interpreter per worker.
+WORKER_MODE = os.getenv("FACE_WORKER_MODE", "thread")
+
+# Frames accepted but not yet finished before submitters block (0 = 2 per worker)
+QUEUE_SIZE = int(os.getenv("FACE_WORKER_QUEUE", "0"))
+
+_task_state = threading.local()
+
+@contextmanager
+def timed(stage):
+    """Add the block's duration to the running pool task's stage timings.
+
+    Outside a pool task this does nothing, so pipeline code can be timed
+    unconditionally.
+    """
+    timings = getattr(_task_state, "timings", None)
+    if timings is None:
+        yield
+        return
+
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - started
+
+def _run_task(fn, args, submitted):
+    """Run one task in a worker, returning its result and stage timings."""
+    started = time.monotonic()
+    _task_state.timings = timings = {"queued": started - submitted}
+    try:
+        result = fn(*args)
+    finally:
+        _task_state.timings = None
+    timings["total"] = time.monotonic() - started
+    return result, timings
+
+class StageTimings:
+    """Call counts and durations per pipeline stage."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = {}
+
+    def add(self, timings):
+        with self._lock:
+            for stage, seconds in timings.items():
+                entry = self._stages.setdefault(stage, [0, 0.0, 0.0])
+                entry[0] += 1
+                entry[1] += seconds
+                entry[2] = max(entry[2], seconds)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                stage: {
+                    "count": count,
+                    "total_seconds": total,
+                    "avg_ms": 1000 * total / count,
+                    "max_ms": 1000 * longest,
+                }
+                for stage, (count, total, longest) in self._stages.items()
+            }
+
+class WorkerPool:
+    """Runs frame-processing tasks on several threads or processes.
+
+    At most ``queue_size`` tasks are in flight (running or waiting); further
+    submits block until one finishes, which pushes back on whoever is
+    reading requests. Tasks that share a ``key`` run in the same process in
+    process mode, so per-session state stays in one place.
+    """
+
+    def __init__(self, workers=WORKERS, mode=WORKER_MODE, queue_size=QUEUE_SIZE,
+                 initializer=None, initargs=()):
+        if mode not in ("thread", "process"):
+            raise ValueError(f"Unknown worker mode: {mode}")
+
+        self.workers = max(1, workers)
+        self.mode = mode
+        self.queue_size = queue_size or 2 * self.workers
+
+        if mode == "process":
+            # One single-process executor per worker, so keyed tasks can be pinned
+            self._executors = [
+                ProcessPoolExecutor(1, initializer=initializer, initargs=initargs)
+                for _ in range(self.workers)
+            ]
+        else:
+            if initializer is not None:
+                initializer(*initargs)
+            self._executors = [ThreadPoolExecutor(self.workers, thread_name_prefix="face-worker")]
+
+        self._slots = threading.BoundedSemaphore(self.queue_size)
+        self._round_robin = itertools.count()
+        self._lock = threading.Lock()
+        self.timings = StageTimings()
+        self._stats = {
+            "submitted": 0,
+            "completed": 0,
+            "failed": 0,
+            "in_flight": 0,
+            "backpressure_waits": 0,
+            "backpressure_seconds": 0.0,
+        }
+        logger.info(f"Started {self.workers} {mode} workers (queue size {self.queue_size})")
+
+    def _executor_for(self, key):
+        if len(self._executors) == 1:
+            return self._executors[0]
+        if key is None:
+            return self._executors[next(self._round_robin) % len(self._executors)]
+        return self._executors[hash(key) % len(self._executors)]
+
+    def submit(self, fn, *args, key=None):
+        """Queue ``fn(*args)``, blocking while the pool is full; returns a Future."""
+        if not self._slots.acquire(blocking=False):
+            started = time.monotonic()
+            self._slots.acquire()
+            with self._lock:
+                self._stats["backpressure_waits"] += 1
+                self._stats["backpressure_seconds"] += time.monotonic() - started
+
+        with self._lock:
+            self._stats["submitted"] += 1
+            self._stats["in_flight"] += 1
+
+        result = Future()
+
+        def finished(inner):
+            self._slots.release()
+            error = inner.exception()
+            with self._lock:
+                self._stats["in_flight"] -= 1
+                self._stats["failed" if error else "completed"] += 1
+            if error is not None:
+                result.set_exception(error)
+                return
+            value, timings = inner.result()
+            self.timings.add(timings)
+            result.set_result(value)
+
+        try:
+            inner = self._executor_for(key).submit(_run_task, fn, args, time.monotonic())
+        except Exception:
+            self._slots.release()
+            with self._lock:
+                self._stats["in_flight"] -= 1
+            raise
+        inner.add_done_callback(finished)
+        return result
+
+    def map(self, fn, items):
+        """Apply ``fn`` to every item concurrently, yielding results in order.
+
+        Items are pulled lazily, so only about ``queue_size`` of them are
+        held at once however long the input is.
+        """
+        pending = deque()
+        for item in items:
+            pending.append(self.submit(fn, item))
+            while pending and pending[0].done():
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+    def stats(self):
+        """Throughput counters, backpressure and per-stage timing."""
+        with self._lock:
+            stats = dict(self._stats)
+        stats["mode"] = self.mode
+        stats["workers"] = self.workers
+        stats["queue_size"] = self.queue_size
+        stats["stages"] = self.timings.snapshot()
+        return stats
+
+    def shutdown(self, wait=True):
+        for executor in self._executors:
+            executor.shutdown(wait=wait)